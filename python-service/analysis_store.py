@@ -0,0 +1,265 @@
+"""Persistent store of per-session emotion vectors.
+
+Every analyzed session that belongs to a patient is written to a local SQLite
+table: counts, z-scores, valence, word count, the analyzer version and a
+timestamp, indexed by (patient, date). Trends, summaries and combined views
+for a patient are then range queries over stored vectors instead of a
+re-analysis of every transcript. Rows written by another analyzer version are
+dropped at startup and never returned.
+
+Long histories are read in keyset pages (an opaque cursor over
+``(session_date, session_id)``) or as column arrays for server-side
+downsampling, so neither the payload nor the work grows with every session.
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from emotion_stats import EMOTIONS
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+ANALYSIS_DB_PATH = os.getenv("ANALYSIS_DB_PATH", os.path.join(DATA_DIR, "analysis.sqlite3"))
+ANALYSIS_STORE_ENABLED = os.getenv("ANALYSIS_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+_Z_COLUMNS = [f"z_{emotion}" for emotion in EMOTIONS]
+_COUNT_COLUMNS = [f"n_{emotion}" for emotion in EMOTIONS]
+_ID_CHUNK = 900
+
+
+def _date_range(sql: str, params: List, date_from: Optional[str], date_to: Optional[str]) -> str:
+    if date_from:
+        sql += " AND session_date >= ?"
+        params.append(date_from)
+    if date_to:
+        sql += " AND session_date <= ?"
+        params.append(date_to)
+    return sql
+
+
+def encode_cursor(session_date: Optional[str], session_id: str) -> str:
+    payload = json.dumps([session_date or "", session_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """``(session_date, session_id)`` of the last row of the previous page; ValueError if malformed"""
+    try:
+        session_date, session_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(session_date), str(session_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS session_vectors (
+    patient_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    language TEXT NOT NULL,
+    session_date TEXT,
+    session_title TEXT,
+    content_hash TEXT,
+    analyzer_version TEXT NOT NULL,
+    {", ".join(f"{c} REAL NOT NULL" for c in _Z_COLUMNS)},
+    {", ".join(f"{c} INTEGER" for c in _COUNT_COLUMNS)},
+    emotional_valence REAL NOT NULL,
+    positive_score REAL NOT NULL,
+    negative_score REAL NOT NULL,
+    word_count INTEGER NOT NULL,
+    analyzed_at TEXT NOT NULL,
+    PRIMARY KEY (patient_id, session_id, language)
+);
+CREATE INDEX IF NOT EXISTS session_vectors_by_date ON session_vectors (patient_id, language, session_date);
+"""
+
+
+class AnalysisStore:
+    def __init__(self, db_path: str = ANALYSIS_DB_PATH):
+        self.db_path = db_path
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self):
+        if not self._ready:
+            self._initialize()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _initialize(self):
+        with self._lock:
+            if self._ready:
+                return
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+            finally:
+                conn.close()
+            self._ready = True
+
+    def upsert(self, patient_id: str, session_id: str, analysis: Dict, analyzer_version: str,
+               session_date: Optional[str] = None, session_title: Optional[str] = None,
+               content_hash: Optional[str] = None) -> int:
+        """Store (or replace) the vector of one analyzed session; returns the rows written"""
+        z_scores = analysis['z_scores']
+        counts = analysis.get('emotion_counts') or {}
+        columns = ["patient_id", "session_id", "language", "session_date", "session_title", "content_hash",
+                   "analyzer_version", *_Z_COLUMNS, *_COUNT_COLUMNS, "emotional_valence", "positive_score",
+                   "negative_score", "word_count", "analyzed_at"]
+        values = [patient_id, session_id, analysis.get('language', 'italian'), session_date, session_title,
+                  content_hash, analyzer_version, *(float(z_scores[e]) for e in EMOTIONS),
+                  *(counts.get(e) for e in EMOTIONS), float(analysis['emotional_valence']),
+                  float(analysis['positive_score']), float(analysis['negative_score']),
+                  int(analysis.get('word_count', 0)), datetime.now().isoformat()]
+        with self._connect() as conn:
+            return conn.execute(
+                f"INSERT OR REPLACE INTO session_vectors ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                values
+            ).rowcount
+
+    def query(self, patient_id: str, analyzer_version: str, language: str = 'italian',
+              date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict]:
+        """Stored vectors of a patient in date order, optionally within [date_from, date_to]"""
+        sql = "SELECT * FROM session_vectors WHERE patient_id = ? AND language = ? AND analyzer_version = ?"
+        params = [patient_id, language, analyzer_version]
+        sql = _date_range(sql, params, date_from, date_to) + " ORDER BY session_date, session_id"
+        with self._connect() as conn:
+            return [row_to_vector(row) for row in conn.execute(sql, params).fetchall()]
+
+    def page(self, patient_id: str, analyzer_version: str, language: str = 'italian',
+             date_from: Optional[str] = None, date_to: Optional[str] = None, cursor: Optional[str] = None,
+             limit: int = 50) -> Tuple[List[Dict], Optional[str]]:
+        """One page of ``query`` after ``cursor``, and the cursor of the next page (None on the last one)"""
+        sql = "SELECT * FROM session_vectors WHERE patient_id = ? AND language = ? AND analyzer_version = ?"
+        params: List = [patient_id, language, analyzer_version]
+        sql = _date_range(sql, params, date_from, date_to)
+        if cursor:
+            after_date, after_id = decode_cursor(cursor)
+            sql += " AND (COALESCE(session_date, ''), session_id) > (?, ?)"
+            params += [after_date, after_id]
+        sql += " ORDER BY COALESCE(session_date, ''), session_id LIMIT ?"
+        params.append(limit + 1)
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["session_date"], rows[-1]["session_id"]) if more and rows else None
+        return [row_to_vector(row) for row in rows], next_cursor
+
+    def load_series(self, patient_id: str, analyzer_version: str, language: str = 'italian',
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """A patient's stored vectors in date order as column arrays, for trends and downsampling"""
+        sql = (f"SELECT session_id, session_date, {', '.join(_Z_COLUMNS)}, emotional_valence, positive_score, "
+               f"negative_score, word_count FROM session_vectors "
+               f"WHERE patient_id = ? AND language = ? AND analyzer_version = ?")
+        params: List = [patient_id, language, analyzer_version]
+        sql = _date_range(sql, params, date_from, date_to) + " ORDER BY COALESCE(session_date, ''), session_id"
+        with self._connect() as conn:
+            conn.row_factory = None
+            rows = conn.execute(sql, params).fetchall()
+
+        n = len(rows)
+        values = np.array([row[2:] for row in rows], dtype=np.float64).reshape(n, len(EMOTIONS) + 4)
+        k = len(EMOTIONS)
+        return {
+            'session_ids': np.array([row[0] for row in rows], dtype=object),
+            'session_dates': np.array([row[1] or "" for row in rows], dtype=object),
+            'z_scores': np.ascontiguousarray(values[:, :k]),
+            'emotional_valence': np.ascontiguousarray(values[:, k]),
+            'positive_score': np.ascontiguousarray(values[:, k + 1]),
+            'negative_score': np.ascontiguousarray(values[:, k + 2]),
+            'word_count': np.ascontiguousarray(values[:, k + 3])
+        }
+
+    def load_matrix(self, analyzer_version: str, language: str = 'italian',
+                    patient_ids: Optional[List[str]] = None, date_from: Optional[str] = None,
+                    date_to: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """Stored vectors as contiguous arrays: patient ids, z-scores (n x 8), valence and word counts"""
+        sql = (f"SELECT patient_id, {', '.join(_Z_COLUMNS)}, emotional_valence, word_count FROM session_vectors "
+               f"WHERE language = ? AND analyzer_version = ?")
+        params: List = [language, analyzer_version]
+        sql = _date_range(sql, params, date_from, date_to)
+
+        rows: List = []
+        with self._connect() as conn:
+            conn.row_factory = None  # plain tuples: much cheaper to turn into arrays
+            if patient_ids is None:
+                rows = conn.execute(sql, params).fetchall()
+            else:
+                # Stay under SQLite's bound-parameter limit
+                for i in range(0, len(patient_ids), _ID_CHUNK):
+                    chunk = patient_ids[i:i + _ID_CHUNK]
+                    rows.extend(conn.execute(
+                        f"{sql} AND patient_id IN ({', '.join('?' * len(chunk))})", params + chunk
+                    ).fetchall())
+
+        n = len(rows)
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(n, len(EMOTIONS) + 2)
+        return {
+            'patient_ids': np.array([row[0] for row in rows], dtype=object),
+            'z_scores': np.ascontiguousarray(values[:, :len(EMOTIONS)]),
+            'emotional_valence': np.ascontiguousarray(values[:, len(EMOTIONS)]),
+            'word_count': np.ascontiguousarray(values[:, len(EMOTIONS) + 1])
+        }
+
+    def delete(self, patient_id: str, session_id: Optional[str] = None) -> int:
+        with self._connect() as conn:
+            if session_id is None:
+                cursor = conn.execute("DELETE FROM session_vectors WHERE patient_id = ?", (patient_id,))
+            else:
+                cursor = conn.execute("DELETE FROM session_vectors WHERE patient_id = ? AND session_id = ?",
+                                      (patient_id, session_id))
+            return cursor.rowcount
+
+    def invalidate_stale(self, analyzer_version: str) -> int:
+        """Drop vectors computed by a different analyzer version"""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM session_vectors WHERE analyzer_version != ?", (analyzer_version,))
+            return cursor.rowcount
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS sessions, COUNT(DISTINCT patient_id) AS patients FROM session_vectors"
+            ).fetchone()
+        return {"path": self.db_path, "sessions": row["sessions"], "patients": row["patients"]}
+
+
+def row_to_vector(row: sqlite3.Row) -> Dict:
+    """A stored row in the same shape as ``analyze_session`` results"""
+    z_scores = {emotion: row[f"z_{emotion}"] for emotion in EMOTIONS}
+    counts = {emotion: row[f"n_{emotion}"] for emotion in EMOTIONS}
+    return {
+        'session_id': row['session_id'],
+        'session_date': row['session_date'],
+        'session_title': row['session_title'],
+        'content_hash': row['content_hash'],
+        'analyzer_version': row['analyzer_version'],
+        'analyzed_at': row['analyzed_at'],
+        'analysis': {
+            'z_scores': z_scores,
+            'emotion_counts': counts if all(v is not None for v in counts.values()) else None,
+            'emotional_valence': row['emotional_valence'],
+            'positive_score': row['positive_score'],
+            'negative_score': row['negative_score'],
+            'language': row['language'],
+            'word_count': row['word_count'],
+            'significant_emotions': {e: s for e, s in z_scores.items() if abs(s) >= 1.96}
+        }
+    }
+
+
+analysis_store = AnalysisStore()
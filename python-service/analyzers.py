@@ -0,0 +1,240 @@
+"""Lazy loading, caching and warmup of the heavy NLP dependencies.
+
+EmoAtlas, matplotlib and spaCy are imported on first use instead of at module
+import, every import is timed, and ``EmoScores`` analyzers are built once per
+language and shared. spaCy pipelines come from ``nlp_registry``, so the
+analyzers and the lemmatizer share one copy of each model. ``warmup()`` loads everything up front: the gunicorn
+config calls it in the parent process before workers are forked, so the
+models are shared copy-on-write across workers.
+"""
+import functools
+import gc
+import importlib
+import os
+import threading
+import time
+from typing import Dict
+
+import snapshot
+from lexicon_arrays import ARRAYS_ENABLED, get_lexicon_arrays
+from nlp_registry import model_for_language, nlp_registry
+
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "false").lower() in ("1", "true", "yes")
+WARMUP_LANGUAGES = [l.strip() for l in os.getenv("WARMUP_LANGUAGES", "italian").split(",") if l.strip()]
+# Empty: lemmatize with the Italian analyzer's own model instead of loading a second one
+LEMMATIZER_MODEL = os.getenv("LEMMATIZER_MODEL", "")
+
+# Bump when the scoring changes without an EmoAtlas upgrade: stored vectors are recomputed.
+# Deliberately, every time: a git-installed EmoAtlas reports the same version across commits
+# 2: z-scores against EmoAtlas' packaged baseline table on every path
+ANALYZER_REVISION = "2"
+
+IMPORT_TIMINGS: Dict[str, float] = {}
+WARMUP_TIMINGS: Dict[str, float] = {}
+
+_lock = threading.RLock()
+_state = {
+    "imports_done": False,
+    "emoatlas_available": None,
+    "import_error": None,
+    "lemmatizer_loaded": None,
+    "warmed_up": False,
+    "preloaded_in_pid": None,
+    "heap_frozen": False
+}
+_modules = {}
+_analyzers = {}
+_analyzer_sources = {}
+_lemmatizer = None
+
+
+def timed_import(module_name: str):
+    """Import a module and record how long it took (only the first import costs anything)"""
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    elapsed = time.perf_counter() - start
+    IMPORT_TIMINGS.setdefault(module_name, round(elapsed, 4))
+    return module
+
+
+def _ensure_imports() -> bool:
+    with _lock:
+        if _state["imports_done"]:
+            return _state["emoatlas_available"]
+        try:
+            matplotlib = timed_import("matplotlib")
+            matplotlib.use('Agg')  # Use non-interactive backend
+            timed_import("matplotlib.pyplot")
+            _modules["spacy"] = timed_import("spacy")
+            _modules["emoatlas"] = timed_import("emoatlas")
+            _state["emoatlas_available"] = True
+            print("✅ EmoAtlas successfully imported")
+        except ImportError as e:
+            print(f"⚠️ EmoAtlas or dependencies not available: {e}")
+            _state["emoatlas_available"] = False
+            _state["import_error"] = str(e)
+        _state["imports_done"] = True
+        return _state["emoatlas_available"]
+
+
+def emoatlas_available() -> bool:
+    """Whether EmoAtlas can be used; loads the Italian analyzer on first call"""
+    if "italian" not in _analyzers and _state["emoatlas_available"] is not False:
+        try:
+            get_emoscores("italian")
+        except Exception:
+            pass
+    return bool(_state["emoatlas_available"])
+
+
+def get_emoscores(language: str = "italian"):
+    """Shared EmoScores analyzer for a language, built on first use"""
+    analyzer = _analyzers.get(language)
+    if analyzer is not None:
+        return analyzer
+    with _lock:
+        analyzer = _analyzers.get(language)
+        if analyzer is not None:
+            return analyzer
+        if not _ensure_imports():
+            raise RuntimeError(f"EmoAtlas not available: {_state['import_error']}")
+        start = time.perf_counter()
+        try:
+            analyzer, source = _build_emoscores(language)
+        except Exception as e:
+            if language == "italian":
+                _state["emoatlas_available"] = False
+                _state["import_error"] = str(e)
+            print(f"⚠️ EmoScores initialization failed for '{language}': {e}")
+            raise
+        WARMUP_TIMINGS.setdefault(f"emoscores_{language}", round(time.perf_counter() - start, 4))
+        _analyzers[language] = analyzer
+        _analyzer_sources[language] = source
+        print(f"✅ EmoScores ready for '{language}' (from {source})")
+        return analyzer
+
+
+def _build_emoscores(language: str):
+    """Assemble from the warm-state snapshot when possible, otherwise initialize normally"""
+    if snapshot.SNAPSHOT_ENABLED:
+        try:
+            return snapshot.load_emoscores(language), "snapshot"
+        except Exception as e:
+            print(f"⚠️ Snapshot load failed for '{language}', initializing EmoScores normally: {e}")
+    model = model_for_language(language)
+    emo = _modules["emoatlas"].EmoScores(language=language, spacy_model=model)
+    # Same null model as the snapshot and the compiled arrays
+    emo._lookup = dict(snapshot._package_lookup_table(language))
+    nlp_registry.adopt(model, emo._tagger)
+    emo._tagger = nlp_registry.task(model, "network")
+    return emo, "init"
+
+
+@functools.lru_cache(maxsize=None)
+def analyzer_version() -> str:
+    """Identifies the code that produced a stored emotion vector (fixed for the process lifetime)"""
+    # blocks imports this module
+    from blocks import block_scheme
+    try:
+        from importlib.metadata import version
+        emoatlas_version = version("emoatlas")
+    except Exception:
+        emoatlas_version = "unavailable"
+    return f"emoatlas-{emoatlas_version}+rev{ANALYZER_REVISION}+{block_scheme()}"
+
+
+def get_lemmatizer():
+    """Lemmas-only view of the shared spaCy pipeline used by ``lemmatize_word``; None if not installed"""
+    global _lemmatizer
+    if _state["lemmatizer_loaded"] is not None:
+        return _lemmatizer
+    with _lock:
+        if _state["lemmatizer_loaded"] is not None:
+            return _lemmatizer
+        if not _ensure_imports() and "spacy" not in _modules:
+            _state["lemmatizer_loaded"] = False
+            return None
+        start = time.perf_counter()
+        try:
+            _lemmatizer = nlp_registry.task(LEMMATIZER_MODEL or model_for_language("italian"), "lemmas")
+            _state["lemmatizer_loaded"] = True
+            print(f"✅ Italian Spacy model loaded for lemmatization")
+        except (OSError, ImportError):
+            _lemmatizer = None
+            _state["lemmatizer_loaded"] = False
+            print("⚠️ Italian Spacy model not available for lemmatization")
+        WARMUP_TIMINGS.setdefault("lemmatizer", round(time.perf_counter() - start, 4))
+        return _lemmatizer
+
+
+def warmup(languages=None) -> Dict:
+    """Load every model and run one small analysis per language so first requests are warm"""
+    with _lock:
+        if _state["warmed_up"]:
+            return startup_report()
+        total_start = time.perf_counter()
+        get_lemmatizer()
+        for language in languages or WARMUP_LANGUAGES:
+            try:
+                emo = get_emoscores(language)
+            except Exception:
+                continue
+            start = time.perf_counter()
+            emo.zscores("Test di inizializzazione EmoAtlas.")
+            WARMUP_TIMINGS[f"zscores_{language}"] = round(time.perf_counter() - start, 4)
+            if ARRAYS_ENABLED:
+                start = time.perf_counter()
+                try:
+                    # Mapped before the fork, so workers share the pages
+                    get_lexicon_arrays(language)
+                except Exception as e:
+                    print(f"⚠️ Lexicon arrays unavailable for '{language}': {e}")
+                WARMUP_TIMINGS[f"lexicon_arrays_{language}"] = round(time.perf_counter() - start, 4)
+            start = time.perf_counter()
+            try:
+                # First network build loads the WordNet corpus used for synonyms
+                emo.formamentis_network("Test di inizializzazione della rete cognitiva.")
+            except Exception as e:
+                print(f"⚠️ Formamentis warmup failed for '{language}': {e}")
+            WARMUP_TIMINGS[f"formamentis_{language}"] = round(time.perf_counter() - start, 4)
+        WARMUP_TIMINGS["total"] = round(time.perf_counter() - total_start, 4)
+        _state["warmed_up"] = True
+        print(f"🔥 Warmup completed in {WARMUP_TIMINGS['total']:.2f}s")
+        return startup_report()
+
+
+def preload_for_fork():
+    """Warm up in the parent process, then freeze the heap so forked workers keep sharing its pages"""
+    warmup()
+    gc.collect()
+    # Objects moved to the permanent generation are never touched by the
+    # collector, so its bookkeeping writes don't un-share copy-on-write pages.
+    gc.freeze()
+    _state["preloaded_in_pid"] = os.getpid()
+    _state["heap_frozen"] = True
+    print(f"🧊 Models preloaded in parent process {os.getpid()} ({gc.get_freeze_count()} objects frozen)")
+
+
+def load_state() -> Dict:
+    """Current model-load state; never triggers loading"""
+    return {
+        "emoatlas_available": _state["emoatlas_available"],
+        "analyzers_loaded": sorted(_analyzers.keys()),
+        "analyzer_sources": dict(_analyzer_sources),
+        "lemmatizer_loaded": _state["lemmatizer_loaded"],
+        "warmed_up": _state["warmed_up"]
+    }
+
+
+def startup_report() -> Dict:
+    return {
+        **load_state(),
+        "pid": os.getpid(),
+        "preloaded_in_pid": _state["preloaded_in_pid"],
+        "shared_with_parent": _state["preloaded_in_pid"] is not None and _state["preloaded_in_pid"] != os.getpid(),
+        "heap_frozen": _state["heap_frozen"],
+        "import_error": _state["import_error"],
+        "import_timings": dict(IMPORT_TIMINGS),
+        "warmup_timings": dict(WARMUP_TIMINGS),
+        "nlp_models": nlp_registry.stats()
+    }
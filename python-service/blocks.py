@@ -0,0 +1,352 @@
+"""Transcript blocks with cached per-block analysis, for cheap re-analysis after edits.
+
+A transcript is split into blocks: its lines (turns, paragraphs), with lines
+longer than ``BLOCK_MAX_CHARS`` cut at sentence ends. Each block is addressed
+by the SHA-256 of its text, and what the analyses need from it is cached in
+memory and in SQLite: its lemmatized word list and its forma mentis fragment
+(the syntactic edges and kept vertices of its sentences). Entries are keyed
+by analyzer version and spaCy model.
+
+After an edit only the blocks whose text changed go through spaCy. The
+session word list is the concatenation of the block word lists (z-scores,
+counts and the arc derive from it as before) and the session network is the
+union of the fragments plus the synonym edges among the merged vertices,
+with WordNet lookups cached per word. Sentences never span blocks, so a line
+break ends a sentence even without final punctuation.
+
+This is not the same as a full-text pass: spaCy tags and lemmatizes the
+words at a block edge without the context across it, and idiomatic
+expressions spanning two blocks are not matched. The block scheme is
+therefore part of ``analyzer_version``, so vectors from block and full-text
+analyses are never mixed. Block mode is off by default (``BLOCKS_ENABLED``)
+until the divergence is measured: with it on, a sample of the block word
+lists (``BLOCK_VERIFY_RATE``) is compared with a full-text pass of the same
+transcript by a background thread, off the request path, and divergences
+are counted in the cache stats.
+"""
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from collections import Counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from analysis_store import ANALYSIS_DB_PATH
+from analyzers import analyzer_version
+from cancellation import checkpoint
+from emotion_stats import load_wordlists
+
+BLOCKS_ENABLED = os.getenv("BLOCKS_ENABLED", "false").lower() in ("1", "true", "yes")
+BLOCK_MAX_CHARS = int(os.getenv("BLOCK_MAX_CHARS", "2000"))
+# Block entries kept in memory (each is a word list or a network fragment)
+BLOCK_CACHE_SIZE = int(os.getenv("BLOCK_CACHE_SIZE", "50000"))
+BLOCK_DB_PATH = os.getenv("BLOCK_DB_PATH", ANALYSIS_DB_PATH)
+# Share of block word lists checked against a full-text pass, run by a background thread
+BLOCK_VERIFY_RATE = float(os.getenv("BLOCK_VERIFY_RATE", "0.01"))
+# Checks waiting for that thread; further samples are dropped, never waited on
+BLOCK_VERIFY_QUEUE = int(os.getenv("BLOCK_VERIFY_QUEUE", "8"))
+
+# Same shape as EmoAtlas' namedtuple, so draw/extract helpers accept it
+FormamentisNetwork = namedtuple("FormamentisNetwork", "edges vertices")
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_HASH_CHUNK = 900
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_blocks (
+    analyzer TEXT NOT NULL,
+    language TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    block_hash TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (analyzer, language, kind, block_hash)
+);
+"""
+
+
+def split_blocks(text: str, max_chars: int = BLOCK_MAX_CHARS) -> List[str]:
+    """Non-empty lines of the text; long lines packed into chunks of whole sentences"""
+    blocks = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) <= max_chars:
+            blocks.append(line)
+            continue
+        chunk = ""
+        for sentence in _SENTENCE_END.split(line):
+            if chunk and len(chunk) + 1 + len(sentence) > max_chars:
+                blocks.append(chunk)
+                chunk = sentence
+            else:
+                chunk = f"{chunk} {sentence}" if chunk else sentence
+        if chunk:
+            blocks.append(chunk)
+    return blocks
+
+
+def block_scheme() -> str:
+    """How transcripts are cut for analysis; part of the analyzer version"""
+    return f"blocks{BLOCK_MAX_CHARS}" if BLOCKS_ENABLED else "fulltext"
+
+
+def block_hash(block: str) -> str:
+    return hashlib.sha256(block.encode("utf-8")).hexdigest()
+
+
+def analyzer_key(emo) -> str:
+    """Analyzer version and spaCy model: a block result is reusable only under both"""
+    return f"{analyzer_version()}|{getattr(emo._tagger, 'model', type(emo._tagger).__name__)}"
+
+
+class BlockCache:
+    """LRU of block results in front of a SQLite table, keyed by (analyzer, language, kind, block hash)"""
+
+    def __init__(self, db_path: str = BLOCK_DB_PATH, max_entries: int = BLOCK_CACHE_SIZE):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str, str], object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.verified = 0
+        self.diverged = 0
+        self.max_divergence = 0.0
+        self.verify_dropped = 0
+
+    @contextmanager
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=30) as conn:
+                conn.executescript(_SCHEMA)
+            self._ready = True
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _remember(self, key: Tuple[str, str, str, str], value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, analyzer: str, language: str, kind: str, hashes: Sequence[str]) -> Dict[str, object]:
+        found = {}
+        with self._lock:
+            for digest in hashes:
+                key = (analyzer, language, kind, digest)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[digest] = self._entries[key]
+            self.memory_hits += len(found)
+        missing = [digest for digest in dict.fromkeys(hashes) if digest not in found]
+        if not missing:
+            return found
+        try:
+            rows = []
+            with self._connect() as conn:
+                for i in range(0, len(missing), _HASH_CHUNK):
+                    chunk = missing[i:i + _HASH_CHUNK]
+                    rows.extend(conn.execute(
+                        f"SELECT block_hash, value FROM analysis_blocks WHERE analyzer = ? AND language = ? "
+                        f"AND kind = ? AND block_hash IN ({', '.join('?' * len(chunk))})",
+                        [analyzer, language, kind, *chunk]
+                    ).fetchall())
+        except sqlite3.Error as e:
+            # The disk tier is an optimization: recompute rather than fail
+            print(f"⚠️ Block cache unavailable: {e}")
+            rows = []
+        with self._lock:
+            for digest, value in rows:
+                found[digest] = json.loads(value)
+                self._remember((analyzer, language, kind, digest), found[digest])
+            self.disk_hits += len(rows)
+            self.misses += len(missing) - len(rows)
+        return found
+
+    def put_many(self, analyzer: str, language: str, kind: str, values: Dict[str, object]):
+        if not values:
+            return
+        with self._lock:
+            for digest, value in values.items():
+                self._remember((analyzer, language, kind, digest), value)
+        now = datetime.now().isoformat()
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO analysis_blocks (analyzer, language, kind, block_hash, value, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(analyzer, language, kind, digest, json.dumps(value, ensure_ascii=False), now)
+                     for digest, value in values.items()]
+                )
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not store {len(values)} blocks: {e}")
+
+    def invalidate_stale(self, version: str) -> int:
+        """Drop blocks computed by a different analyzer version"""
+        prefix = f"{version}|"
+        with self._lock:
+            for key in [key for key in self._entries if not key[0].startswith(prefix)]:
+                del self._entries[key]
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM analysis_blocks WHERE substr(analyzer, 1, ?) != ?",
+                                  (len(prefix), prefix))
+            return cursor.rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": BLOCKS_ENABLED,
+                "max_chars": BLOCK_MAX_CHARS,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "verify_rate": BLOCK_VERIFY_RATE,
+                "verified": self.verified,
+                "diverged": self.diverged,
+                "verify_dropped": self.verify_dropped,
+                "max_divergence": round(self.max_divergence, 4)
+            }
+
+
+block_cache = BlockCache()
+
+
+def _per_block(emo, kind: str, blocks: List[str], compute: Callable[[List[str]], List]) -> List:
+    """Cached result of every block, computing only the blocks not seen before"""
+    analyzer = analyzer_key(emo)
+    hashes = [block_hash(block) for block in blocks]
+    found = block_cache.get_many(analyzer, emo.language, kind, hashes)
+    todo = {digest: block for digest, block in zip(hashes, blocks) if digest not in found}
+    if todo:
+        computed = dict(zip(todo, compute(list(todo.values()))))
+        block_cache.put_many(analyzer, emo.language, kind, computed)
+        found.update(computed)
+    print(f"🧱 {kind}: {len(blocks)} blocks, {len(todo)} analyzed, {len(blocks) - len(todo)} reused")
+    return [found[digest] for digest in hashes]
+
+
+def block_wordlist(emo, text: str) -> List[str]:
+    """Lemmatized tokens of the text, from the cached word lists of its blocks"""
+    blocks = split_blocks(text)
+    wordlist = [word for words in _per_block(emo, "wordlist", blocks, lambda todo: load_wordlists(emo, todo))
+                for word in words]
+    if random.random() < BLOCK_VERIFY_RATE:
+        schedule_verification(emo, text, wordlist)
+    return wordlist
+
+
+_verify_queue: "queue.Queue" = queue.Queue(maxsize=BLOCK_VERIFY_QUEUE)
+_verify_thread = None
+_verify_lock = threading.Lock()
+
+
+def _verify_loop():
+    while True:
+        emo, text, wordlist = _verify_queue.get()
+        try:
+            compare_wordlists(emo, text, wordlist)
+        except Exception as e:
+            print(f"⚠️ Block verification failed: {e}")
+
+
+def schedule_verification(emo, text: str, wordlist: List[str]):
+    """Queue a full-text comparison for the background thread; dropped when it is behind"""
+    global _verify_thread
+    with _verify_lock:
+        if _verify_thread is None:
+            _verify_thread = threading.Thread(target=_verify_loop, name="block-verify", daemon=True)
+            _verify_thread.start()
+    try:
+        _verify_queue.put_nowait((emo, text, wordlist))
+    except queue.Full:
+        with block_cache._lock:
+            block_cache.verify_dropped += 1
+
+
+def compare_wordlists(emo, text: str, wordlist: List[str]) -> Dict:
+    """Compare a block word list with a full-text pass: tokens in one list and not the other, as a share"""
+    full = load_wordlists(emo, [text])[0]
+    block_counts, full_counts = Counter(wordlist), Counter(full)
+    differing = sum(((block_counts - full_counts) + (full_counts - block_counts)).values())
+    divergence = differing / max(len(full), len(wordlist), 1)
+    with block_cache._lock:
+        block_cache.verified += 1
+        if differing:
+            block_cache.diverged += 1
+            block_cache.max_divergence = max(block_cache.max_divergence, divergence)
+    if differing:
+        print(f"🧱 Block word list differs from the full-text pass by {differing} tokens ({divergence:.2%})")
+    return {"block_tokens": len(wordlist), "full_tokens": len(full), "differing_tokens": differing,
+            "divergence": divergence}
+
+
+def _fragments(emo, blocks: List[str]) -> List[Dict]:
+    fragments = []
+    for block in blocks:
+        # Stop between blocks if the request was cancelled
+        checkpoint("network block")
+        network = emo.formamentis_network(block, multiplex=True, semantic_enrichment="")
+        fragments.append({
+            'syntactic': [list(edge) for edge in network.edges['syntactic']],
+            'vertices': sorted(network.vertices)
+        })
+    return fragments
+
+
+def block_network(emo, text: str) -> FormamentisNetwork:
+    """Typed forma mentis network of the text merged from the cached fragments of its blocks"""
+    fragments = _per_block(emo, "network", split_blocks(text), lambda todo: _fragments(emo, todo))
+    syntactic = list(dict.fromkeys(tuple(edge) for fragment in fragments for edge in fragment['syntactic']))
+    vertices = list(dict.fromkeys(vertex for fragment in fragments for vertex in fragment['vertices']))
+    return FormamentisNetwork({'syntactic': syntactic, 'synonyms': synonym_edges(vertices, emo.language)},
+                              vertices)
+
+
+_synonyms: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+_synonyms_lock = threading.Lock()
+
+
+def _word_synonyms(word: str, lang: str) -> Tuple[str, ...]:
+    key = (word, lang)
+    synonyms = _synonyms.get(key)
+    if synonyms is None:
+        from emoatlas.formamentis_edgelist import wn
+        synonyms = tuple(set(itertools.chain(*[s.lemma_names(lang) for s in wn.synsets(word, lang=lang)])))
+        with _synonyms_lock:
+            _synonyms[key] = synonyms
+    return synonyms
+
+
+def synonym_edges(vertices: Sequence[str], language: str) -> List[Tuple[str, str]]:
+    """EmoAtlas' WordNet synonym edges among ``vertices`` (pairs of a vertex's synonyms that are both vertices)"""
+    from emoatlas.formamentis_edgelist import _language_code3
+
+    lang = _language_code3(language)
+    if not lang:
+        return []
+    present = set(vertices)
+    edges = set()
+    for word in vertices:
+        found = [synonym for synonym in _word_synonyms(word, lang) if synonym in present]
+        for a, b in itertools.combinations(found, 2):
+            edges.add((a, b) if a < b else (b, a))
+    return sorted(edges)
@@ -0,0 +1,183 @@
+"""Cooperative cancellation of analyses on client disconnect or deadline.
+
+Every cancellable request carries a ``CancelToken``: it expires after the
+request deadline (``REQUEST_DEADLINE_SECONDS``, or a shorter
+``X-Request-Deadline`` header) and is cancelled when every client waiting
+on it has disconnected. Identical requests coalesced by ``SingleFlight``
+share the token of the computation they wait on, so it stops only when the
+last of them goes away.
+
+The token travels in a context variable, which ``asyncio.to_thread`` copies
+into the worker thread. Blocking code calls ``checkpoint(stage)`` between
+stages (each session of ``/emotion-trends``, each step of the semantic frame
+pipeline, each document view) and gets ``AnalysisCancelled`` once the token
+is cancelled; work already queued behind the scheduler or the thread pool is
+dropped before it starts. ``AnalysisCancelled`` derives from
+``BaseException`` so the broad ``except Exception`` fallbacks of the
+analyses don't turn it into a fallback result.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+# 0 disables the deadline
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "300"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+DEADLINE_EXCEEDED = "deadline exceeded"
+CLIENT_DISCONNECTED = "client disconnected"
+
+
+class AnalysisCancelled(BaseException):
+    def __init__(self, reason: str, stage: Optional[str] = None):
+        super().__init__(f"Analysis cancelled ({reason})" + (f" at {stage}" if stage else ""))
+        self.reason = reason
+        self.stage = stage
+
+
+class CancelToken:
+    """Cancellation state of one computation, safe to check from any thread"""
+
+    def __init__(self, deadline_seconds: Optional[float] = None):
+        self.created_at = time.perf_counter()
+        self.deadline = self.created_at + deadline_seconds if deadline_seconds else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._clients = 0
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+        return self._event.is_set()
+
+    def cancel(self, reason: str):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def check(self, stage: Optional[str] = None):
+        if self.cancelled:
+            raise AnalysisCancelled(self.reason, stage)
+
+    def remaining(self) -> Optional[float]:
+        return max(self.deadline - time.perf_counter(), 0.0) if self.deadline is not None else None
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Call ``callback`` (from the cancelling thread) once the token is cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def attach(self):
+        with self._lock:
+            self._clients += 1
+
+    def detach(self, disconnected: bool = False):
+        """A client stopped waiting; the work is abandoned when the last one disconnected"""
+        with self._lock:
+            self._clients -= 1
+            abandoned = disconnected and self._clients <= 0
+        if abandoned:
+            self.cancel(CLIENT_DISCONNECTED)
+
+
+_current_token: ContextVar[Optional[CancelToken]] = ContextVar("current_cancel_token", default=None)
+
+_stats_lock = threading.Lock()
+CANCEL_STATS: Dict[str, Dict[str, int]] = {}
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+@contextmanager
+def use_token(token: Optional[CancelToken]):
+    """Make ``token`` the one ``checkpoint`` sees here and in threads started from here"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def checkpoint(stage: Optional[str] = None):
+    """Raise ``AnalysisCancelled`` if the current request was cancelled; no-op outside one"""
+    token = _current_token.get()
+    if token is not None:
+        token.check(stage)
+
+
+def request_deadline(header: Optional[str]) -> Optional[float]:
+    """Seconds a request may run: ``X-Request-Deadline`` capped at ``REQUEST_DEADLINE_SECONDS``"""
+    limit = REQUEST_DEADLINE_SECONDS if REQUEST_DEADLINE_SECONDS > 0 else None
+    try:
+        requested = float(header) if header else None
+    except ValueError:
+        requested = None
+    if requested is None or requested <= 0:
+        return limit
+    return min(requested, limit) if limit else requested
+
+
+def record_cancellation(queue: str, error: AnalysisCancelled):
+    with _stats_lock:
+        counts = CANCEL_STATS.setdefault(queue, {})
+        counts[error.reason] = counts.get(error.reason, 0) + 1
+    print(f"🛑 Abandoned {queue} analysis: {error}")
+
+
+def cancellation_stats() -> Dict:
+    with _stats_lock:
+        return {
+            "deadline_seconds": REQUEST_DEADLINE_SECONDS or None,
+            "abandoned": {queue: dict(counts) for queue, counts in CANCEL_STATS.items()}
+        }
+
+
+@asynccontextmanager
+async def watch_client(http_request, token: CancelToken):
+    """While the block runs, cancel ``token`` at its deadline or when the client disconnects"""
+    loop = asyncio.get_running_loop()
+    token.attach()
+    disconnected = False
+
+    async def poll():
+        nonlocal disconnected
+        while not token.cancelled:
+            if await http_request.is_disconnected():
+                disconnected = True
+                token.detach(disconnected=True)
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    watcher = asyncio.ensure_future(poll())
+    remaining = token.remaining()
+    timer = loop.call_later(remaining, token.cancel, DEADLINE_EXCEEDED) if remaining is not None else None
+    try:
+        yield token
+    finally:
+        watcher.cancel()
+        if timer is not None:
+            timer.cancel()
+        if not disconnected:
+            token.detach()
@@ -0,0 +1,163 @@
+"""Centrality metrics on CSR forma mentis networks.
+
+Degree, closeness, PageRank and betweenness for every word of a network,
+computed once per network and memoized on the (already cached) CSRGraph, so
+repeated frame and "most central concepts" queries only read arrays.
+
+Betweenness uses Brandes' accumulation run level by level on the CSR arrays.
+Small networks use every word as a source (exact values); larger ones use
+``CENTRALITY_SAMPLES`` random sources and scale the result, the usual
+sampling approximation. The same breadth-first passes give closeness
+(Wasserman-Faust form, which stays meaningful on disconnected networks).
+"""
+import os
+import threading
+import weakref
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from graph_csr import CSRGraph
+
+CENTRALITY_SAMPLES = int(os.getenv("CENTRALITY_SAMPLES", "200"))
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-8
+PAGERANK_MAX_ITERATIONS = 100
+METRICS = ('degree', 'closeness', 'pagerank', 'betweenness')
+
+_memo: "weakref.WeakKeyDictionary[CSRGraph, Dict]" = weakref.WeakKeyDictionary()
+_memo_lock = threading.Lock()
+
+
+def pagerank(graph: CSRGraph, damping: float = PAGERANK_DAMPING) -> np.ndarray:
+    """Power iteration on the edge arrays (dangling words spread their rank uniformly)"""
+    n = len(graph.words)
+    if n == 0:
+        return np.zeros(0)
+    rows = np.repeat(np.arange(n), graph.degree)
+    out_share = np.where(graph.degree > 0, 1.0 / np.maximum(graph.degree, 1), 0.0)
+    dangling = graph.degree == 0
+    rank = np.full(n, 1.0 / n)
+    for _ in range(PAGERANK_MAX_ITERATIONS):
+        spread = np.bincount(graph.indices, weights=(rank * out_share)[rows], minlength=n)
+        updated = (1 - damping) / n + damping * (spread + rank[dangling].sum() / n)
+        converged = np.abs(updated - rank).sum() < PAGERANK_TOLERANCE
+        rank = updated
+        if converged:
+            break
+    return rank
+
+
+def _brandes(graph: CSRGraph, sources: np.ndarray):
+    """Betweenness contributions, reach counts and distance sums from the given BFS sources"""
+    n = len(graph.words)
+    betweenness = np.zeros(n)
+    reached = np.zeros(n)
+    distance_sum = np.zeros(n)
+    for source in sources.tolist():
+        distance = np.full(n, -1, dtype=np.int64)
+        sigma = np.zeros(n)
+        distance[source] = 0
+        sigma[source] = 1.0
+        frontier = np.array([source], dtype=np.int64)
+        levels = []
+        depth = 0
+        while len(frontier):
+            positions, rows = graph._gather(frontier)
+            cols = graph.indices[positions].astype(np.int64)
+            fresh = cols[distance[cols] == -1]
+            distance[fresh] = depth + 1
+            # Shortest-path edges into the next level, and path counts through them
+            onward = distance[cols] == depth + 1
+            rows, cols = rows[onward], cols[onward]
+            np.add.at(sigma, cols, sigma[rows])
+            levels.append((rows, cols))
+            frontier = np.unique(fresh)
+            depth += 1
+        delta = np.zeros(n)
+        for rows, cols in reversed(levels):
+            np.add.at(delta, rows, sigma[rows] / sigma[cols] * (1.0 + delta[cols]))
+        delta[source] = 0.0
+        betweenness += delta
+        hit = distance > 0
+        reached[hit] += 1
+        distance_sum[hit] += distance[hit]
+    return betweenness, reached, distance_sum
+
+
+def compute_metrics(graph: CSRGraph, samples: int = CENTRALITY_SAMPLES, seed: int = 0) -> Dict:
+    n = len(graph.words)
+    exact = n <= samples
+    if exact:
+        sources = np.arange(n)
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(n, size=samples, replace=False))
+    betweenness, reached, distance_sum = _brandes(graph, sources)
+
+    # Each unordered pair is counted from both ends; sampled sums are scaled up to all sources
+    betweenness = betweenness / 2.0 * (n / max(len(sources), 1))
+    pairs = (n - 1) * (n - 2) / 2.0
+    betweenness = betweenness / pairs if pairs > 0 else betweenness
+    # Sources other than the word itself (the word never reaches itself at distance > 0)
+    is_source = np.zeros(n, dtype=bool)
+    is_source[sources] = True
+    other_sources = len(sources) - is_source
+    closeness = np.where(
+        distance_sum > 0,
+        reached / np.maximum(distance_sum, 1) * reached / np.maximum(other_sources, 1),
+        0.0
+    )
+    return {
+        'exact': exact,
+        'samples': int(len(sources)),
+        'degree': graph.degree.astype(np.int64),
+        'degree_centrality': graph.degree / max(n - 1, 1),
+        'closeness': closeness,
+        'pagerank': pagerank(graph),
+        'betweenness': betweenness
+    }
+
+
+def network_metrics(graph: CSRGraph) -> Dict:
+    """Metrics of every word of ``graph``, computed on first use"""
+    with _memo_lock:
+        metrics = _memo.get(graph)
+    if metrics is None:
+        metrics = compute_metrics(graph)
+        with _memo_lock:
+            metrics = _memo.setdefault(graph, metrics)
+    return metrics
+
+
+def word_centrality(graph: CSRGraph, word: str) -> Optional[Dict]:
+    index = graph.index.get(word)
+    if index is None:
+        return None
+    metrics = network_metrics(graph)
+    return {
+        'degree': int(metrics['degree'][index]),
+        'degree_centrality': round(float(metrics['degree_centrality'][index]), 6),
+        'closeness': round(float(metrics['closeness'][index]), 6),
+        'pagerank': round(float(metrics['pagerank'][index]), 6),
+        'betweenness': round(float(metrics['betweenness'][index]), 6)
+    }
+
+
+def centrality_report(graph: CSRGraph, words: Optional[List[str]] = None, top_k: int = 20) -> Dict:
+    """Metrics of the requested words and the top-k words per metric"""
+    metrics = network_metrics(graph)
+    top = {}
+    for metric in METRICS:
+        values = metrics['degree_centrality' if metric == 'degree' else metric]
+        order = np.argsort(-values, kind='stable')[:top_k]
+        top[metric] = [{'word': graph.words[i], 'value': round(float(values[i]), 6)} for i in order.tolist()]
+    return {
+        'network': {
+            'vertices': len(graph.words),
+            'edges': graph.edge_count,
+            'exact': metrics['exact'],
+            'betweenness_sources': metrics['samples']
+        },
+        'words': {word: word_centrality(graph, word) for word in (words or [])},
+        'top': top
+    }
@@ -0,0 +1,87 @@
+"""Cohort statistics over stored session vectors.
+
+All reductions run on the contiguous arrays returned by
+``AnalysisStore.load_matrix`` (one row per session, one column per emotion):
+group means and percentiles, fixed-bin histograms, the share of significant
+sessions, and per-patient means ranked per emotion. Patients are grouped with
+``np.unique(..., return_inverse=True)`` and ``bincount``; there is no Python
+loop over sessions.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from emotion_stats import EMOTIONS
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+HISTOGRAM_EDGES = np.arange(-5.0, 5.5, 0.5)
+SIGNIFICANCE_THRESHOLD = 1.96
+
+
+def _histograms(z: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Per-emotion histograms in one bincount (values outside the edges go to the end bins)"""
+    n_bins = len(edges) - 1
+    bins = np.clip(np.searchsorted(edges, z, side='right') - 1, 0, n_bins - 1)
+    offsets = np.arange(z.shape[1]) * n_bins
+    return np.bincount((bins + offsets).ravel(), minlength=z.shape[1] * n_bins).reshape(z.shape[1], n_bins)
+
+
+def _round(values: np.ndarray, digits: int = 4) -> List:
+    return np.round(values, digits).tolist()
+
+
+def cohort_statistics(matrix: Dict[str, np.ndarray], percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                      top_k: int = 10) -> Dict:
+    z = matrix['z_scores']
+    valence = matrix['emotional_valence']
+    n_sessions = z.shape[0]
+    if n_sessions == 0:
+        return {'sessions': 0, 'patients': 0}
+
+    patients, inverse = np.unique(matrix['patient_ids'].astype(str), return_inverse=True)
+    sessions_per_patient = np.bincount(inverse, minlength=len(patients))
+    # Per-patient means: a weighted bincount per emotion column
+    offsets = np.arange(z.shape[1]) * len(patients)
+    sums = np.bincount((inverse[:, None] + offsets).ravel(), weights=z.ravel(),
+                       minlength=len(patients) * z.shape[1]).reshape(z.shape[1], len(patients)).T
+    patient_means = sums / sessions_per_patient[:, None]
+    patient_valence = np.bincount(inverse, weights=valence, minlength=len(patients)) / sessions_per_patient
+
+    percentile_values = np.percentile(z, percentiles, axis=0)
+    histograms = _histograms(z, HISTOGRAM_EDGES)
+    significant_share = (z >= SIGNIFICANCE_THRESHOLD).mean(axis=0)
+    order = np.argsort(-patient_means, axis=0, kind='stable')[:top_k]
+
+    emotions = {}
+    for i, emotion in enumerate(EMOTIONS):
+        emotions[emotion] = {
+            'mean': round(float(z[:, i].mean()), 4),
+            'std': round(float(z[:, i].std()), 4),
+            'percentiles': dict(zip((str(p) for p in percentiles), _round(percentile_values[:, i]))),
+            'significant_share': round(float(significant_share[i]), 4),
+            'histogram': histograms[i].tolist(),
+            'top_patients': [
+                {'patient_id': patients[j], 'mean_z_score': round(float(patient_means[j, i]), 4),
+                 'sessions': int(sessions_per_patient[j])}
+                for j in order[:, i]
+            ]
+        }
+
+    valence_order = np.argsort(patient_valence, kind='stable')
+    return {
+        'sessions': n_sessions,
+        'patients': len(patients),
+        'total_words': int(matrix['word_count'].sum()),
+        'histogram_edges': HISTOGRAM_EDGES.tolist(),
+        'emotions': emotions,
+        'emotional_valence': {
+            'mean': round(float(valence.mean()), 4),
+            'std': round(float(valence.std()), 4),
+            'percentiles': dict(zip((str(p) for p in percentiles), _round(np.percentile(valence, percentiles))))
+        },
+        'lowest_valence_patients': [
+            {'patient_id': patients[j], 'mean_valence': round(float(patient_valence[j]), 4),
+             'sessions': int(sessions_per_patient[j])}
+            for j in valence_order[:top_k]
+        ]
+    }
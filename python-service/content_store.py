@@ -0,0 +1,105 @@
+"""Transcripts and analysis results addressed by content hash.
+
+Clients may reference a transcript by ``content_hash`` (SHA-256 of its UTF-8
+text) instead of uploading it. The service keeps the transcripts it has seen
+and the results it has computed, answers what it can from them and reports
+the hashes it does not know so the client uploads only those transcripts.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional
+
+from document import content_hash
+
+# Transcripts are bounded by total size, results by count
+TRANSCRIPT_STORE_MAX_CHARS = int(os.getenv("TRANSCRIPT_STORE_MAX_CHARS", str(200 * 1024 * 1024)))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+
+
+class TranscriptStore:
+    """LRU of transcript texts keyed by content hash"""
+
+    def __init__(self, max_chars: int = TRANSCRIPT_STORE_MAX_CHARS):
+        self.max_chars = max_chars
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def put(self, text: str, digest: Optional[str] = None) -> str:
+        digest = digest or content_hash(text)
+        with self._lock:
+            if digest in self._texts:
+                self._texts.move_to_end(digest)
+                return digest
+            self._texts[digest] = text
+            self._chars += len(text)
+            while self._chars > self.max_chars and len(self._texts) > 1:
+                _, evicted = self._texts.popitem(last=False)
+                self._chars -= len(evicted)
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            text = self._texts.get(digest)
+            if text is not None:
+                self._texts.move_to_end(digest)
+            return text
+
+    def missing(self, digests: Iterable[str]) -> List[str]:
+        with self._lock:
+            return [d for d in dict.fromkeys(digests) if d not in self._texts]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"transcripts": len(self._texts), "chars": self._chars, "max_chars": self.max_chars}
+
+
+class ResultCache:
+    """LRU of computed results keyed by (content hash, analysis options)"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._results: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: Hashable, result: Dict):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"results": len(self._results), "max_results": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+transcript_store = TranscriptStore()
+result_cache = ResultCache()
+
+
+def resolve_transcript(text: Optional[str], digest: Optional[str]):
+    """(text, digest, error) for an inline or by-hash transcript; text is None when the hash is unknown"""
+    if text:
+        actual = content_hash(text)
+        if digest and digest != actual:
+            return None, digest, 'hash_mismatch'
+        transcript_store.put(text, actual)
+        return text, actual, None
+    if not digest:
+        return None, None, 'empty'
+    return transcript_store.get(digest), digest, None
@@ -0,0 +1,200 @@
+"""Parsed transcript shared by every analysis view.
+
+A ``ParsedDocument`` is created once per (transcript, language) and kept in
+an LRU cache keyed by the content hash. Raw counts, z-scores, per-token
+attributions, the emotional arc, flower data and the forma mentis network
+are all derived lazily from it, so asking for one more view of the same
+transcript only costs that view's own incremental work. The word list and
+the network are assembled from per-block results (see ``blocks``), so an
+edited transcript only re-parses the blocks that changed.
+"""
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from analyzers import get_emoscores
+from blocks import BLOCKS_ENABLED, block_network, block_wordlist
+from graph_csr import CSRGraph
+from emotion_stats import (
+    DEFAULT_ARC_STRIDE, DEFAULT_ARC_WINDOW, EMOTIONS, emotional_arc, load_wordlists, wordlist_zscores
+)
+from memory_tracking import figure_guard, memory_stage
+from cancellation import checkpoint
+
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "64"))
+SIGNIFICANCE_THRESHOLD = 1.96
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ParsedDocument:
+    def __init__(self, text: str, language: str = 'italian', digest: Optional[str] = None):
+        self.text = text
+        self.language = language
+        self.content_hash = digest or content_hash(text)
+        self._emo = get_emoscores(language)
+        self._views: Dict = {}
+        self._lock = threading.RLock()
+
+    def _view(self, key, build):
+        # Views are built at most once, even when two requests ask concurrently
+        with self._lock:
+            if key not in self._views:
+                # Views are the stages of an analysis: stop between them if the request was cancelled
+                checkpoint(f"document.{key}")
+                with memory_stage(f"document.{key}"):
+                    self._views[key] = build()
+            return self._views[key]
+
+    @property
+    def analyzer(self):
+        return self._emo
+
+    @property
+    def wordlist(self) -> List[str]:
+        """Lemmatized tokens: the single spaCy pass every emotion view is derived from"""
+        def build():
+            if BLOCKS_ENABLED:
+                return block_wordlist(self._emo, self.text)
+            return load_wordlists(self._emo, [self.text])[0]
+        return self._view('wordlist', build)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.text.split())
+
+    @property
+    def attributions(self) -> List[Dict]:
+        """Per-token emotion attributions (token index, lemma, emotions)"""
+        def build():
+            lexicon = self._emo._emotion_lexicon
+            return [
+                {'index': i, 'word': word, 'emotions': list(lexicon[word])}
+                for i, word in enumerate(self.wordlist)
+                if lexicon.get(word)
+            ]
+        return self._view('attributions', build)
+
+    @property
+    def emotion_words(self) -> Dict[str, List[str]]:
+        """Distinct words carrying each emotion (EmoAtlas return_words form)"""
+        def build():
+            words = {emotion: set() for emotion in EMOTIONS}
+            for attribution in self.attributions:
+                for emotion in attribution['emotions']:
+                    if emotion in words:
+                        words[emotion].add(attribution['word'])
+            return {emotion: sorted(found) for emotion, found in words.items()}
+        return self._view('emotion_words', build)
+
+    @property
+    def emotion_counts(self) -> Dict[str, int]:
+        """Raw counts, equivalent to ``EmoScores.emotions(text)``"""
+        return self._view('emotion_counts', lambda: {e: len(w) for e, w in self.emotion_words.items()})
+
+    @property
+    def z_scores(self) -> Dict[str, float]:
+        return self._view('z_scores', lambda: wordlist_zscores(self._emo, self.wordlist))
+
+    def arc(self, window: int = DEFAULT_ARC_WINDOW, stride: int = DEFAULT_ARC_STRIDE) -> Dict:
+        return self._view(('arc', window, stride), lambda: emotional_arc(self._emo, self.wordlist, window, stride))
+
+    @property
+    def flower_data(self) -> Dict:
+        """Everything needed to draw the Plutchik flower without recomputing z-scores"""
+        def build():
+            z_scores = self.z_scores
+            return {
+                'z_scores': z_scores,
+                'reject_range': [-SIGNIFICANCE_THRESHOLD, SIGNIFICANCE_THRESHOLD],
+                'significant_emotions': {e: s for e, s in z_scores.items() if abs(s) >= SIGNIFICANCE_THRESHOLD}
+            }
+        return self._view('flower_data', build)
+
+    @property
+    def typed_network(self):
+        """Multiplex forma mentis network: edges split by type ('syntactic', 'synonyms')"""
+        def build():
+            if BLOCKS_ENABLED:
+                return block_network(self._emo, self.text)
+            return self._emo.formamentis_network(self.text, multiplex=True)
+        return self._view('typed_network', build)
+
+    @property
+    def network(self):
+        """Forma mentis network of the whole transcript, all edge types merged (EmoAtlas' default form)"""
+        def build():
+            typed = self.typed_network
+            merged = list(dict.fromkeys(edge for edges in typed.edges.values() for edge in edges))
+            return typed._replace(edges=merged)
+        return self._view('network', build)
+
+    @property
+    def graph(self) -> CSRGraph:
+        """CSR form of the typed network, for k-hop frame queries"""
+        return self._view('graph', lambda: CSRGraph.from_formamentis(self.typed_network))
+
+    def render_flower(self) -> Optional[str]:
+        """Plutchik flower as a base64 PNG, drawn from the cached z-scores"""
+        def build():
+            import matplotlib.pyplot as plt
+            flower = self.flower_data
+            with figure_guard():
+                fig = plt.figure(figsize=(8, 8), dpi=100)
+                self._emo.draw_plutchik(flower['z_scores'], ax=fig.gca(), reject_range=flower['reject_range'])
+                buffer = io.BytesIO()
+                fig.savefig(buffer, format='png', bbox_inches='tight', facecolor='white')
+                return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        return self._view('flower_png', build)
+
+
+class DocumentCache:
+    """LRU of parsed documents keyed by (content hash, language)"""
+
+    def __init__(self, max_documents: int = DOCUMENT_CACHE_SIZE):
+        self.max_documents = max_documents
+        self._documents: "OrderedDict[tuple, ParsedDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str, language: str = 'italian') -> ParsedDocument:
+        digest = content_hash(text)
+        key = (digest, language)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return document
+            self.misses += 1
+        document = ParsedDocument(text, language, digest)
+        with self._lock:
+            # Another thread may have parsed the same text meanwhile: keep the first one
+            document = self._documents.setdefault(key, document)
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return document
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "max_documents": self.max_documents,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+document_cache = DocumentCache()
+
+
+def get_document(text: str, language: str = 'italian') -> ParsedDocument:
+    return document_cache.get(text, language)
@@ -0,0 +1,312 @@
+"""EmoAtlas-compatible emotion statistics computed from a lemmatized word list.
+
+``EmoScores.zscores`` re-tokenizes its input on every call. These helpers
+tokenize once (with the analyzer's own spaCy pipeline, idiomatic tokens and
+emoji handling) and then derive counts and z-scores from the word list, so a
+transcript can be scored as a whole and window by window from a single parse.
+
+Semantics follow ``emoatlas.emo_scores._zscores``: an emotion's count is the
+number of *distinct* words carrying it, N is the number of distinct emotion
+words, and the null model is EmoAtlas' lookup table (falling back to the
+binomial mean/std of the baseline distribution for N outside the table).
+Lexicon lookups and the null model come from the memory-mapped arrays of
+``lexicon_arrays`` when available.
+"""
+import os
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from cancellation import checkpoint
+from lexicon_arrays import ARRAYS_ENABLED, get_lexicon_arrays
+from nlp_registry import lemma_pipeline
+
+# Order used throughout the service responses
+EMOTIONS = ['joy', 'trust', 'fear', 'surprise', 'sadness', 'disgust', 'anger', 'anticipation']
+_EMOTION_INDEX = {emotion: i for i, emotion in enumerate(EMOTIONS)}
+
+DEFAULT_ARC_WINDOW = 200
+DEFAULT_ARC_STRIDE = 100
+MIN_ARC_WINDOW = 10
+# Bounds of the request fields, in tokens
+MAX_ARC_WINDOW = 100000
+MAX_ARC_STRIDE = 100000
+# Windows per arc: a finer stride is raised to stay within it
+MAX_ARC_WINDOWS = int(os.getenv("MAX_ARC_WINDOWS", "500"))
+
+
+def load_wordlist(emo, text: str) -> List[str]:
+    """Lemmatized tokens exactly as EmoAtlas sees them (one spaCy pass)"""
+    from emoatlas.textloader import _load_object
+
+    return _load_object(
+        text,
+        tagger=emo._tagger,
+        language=emo.language,
+        emojis_dict=emo._emojis_dict,
+        convert_emojis=True,
+        idiomatic_tokens=emo._idiomatic_tokens,
+    )
+
+
+def load_wordlists(emo, texts: Sequence[str], batch_size: int = 64) -> List[List[str]]:
+    """Wordlists for many texts from one batched ``nlp.pipe`` pass; same cleaning as ``load_wordlist``"""
+    from emoatlas.textloader import _clean_text, _convert_emojis
+
+    tagger = emo._tagger
+    if "spacy" not in str(tagger).lower():
+        # Stemmer-based languages have no pipeline to batch
+        return [load_wordlist(emo, text) for text in texts]
+    # Lemmas only: the parser runs for forma mentis networks, not here
+    tagger = lemma_pipeline(tagger)
+
+    pattern = _idiomatic_pattern(emo)
+    cleaned = []
+    for text in texts:
+        text = _clean_text(_convert_emojis(text, emo._emojis_dict))
+        if pattern is not None:
+            text = pattern.sub(lambda m: emo._idiomatic_tokens[m.group(0)], text)
+        cleaned.append(text)
+    from fast_scoring import learn_lemmas
+
+    wordlists = []
+    for doc in tagger.pipe(cleaned, batch_size=batch_size):
+        # Texts not yet parsed are dropped if the request was cancelled
+        checkpoint("wordlists")
+        wordlists.append([token.lemma_ for token in doc])
+        # Every full pass teaches the fast scorer how spaCy lemmatizes emotion words
+        learn_lemmas(emo, (doc,))
+    return wordlists
+
+
+_idiomatic_patterns: Dict[int, object] = {}
+
+
+def _idiomatic_pattern(emo):
+    """Compiled idiomatic-expression regex (``textloader.multiple_replace`` rebuilds it on every call)"""
+    if emo.language == "english" or not emo._idiomatic_tokens:
+        return None
+    pattern = _idiomatic_patterns.get(id(emo))
+    if pattern is None:
+        keys = sorted(emo._idiomatic_tokens, key=len, reverse=True)
+        pattern = _idiomatic_patterns[id(emo)] = re.compile("|".join(re.escape(k) for k in keys), flags=re.DOTALL)
+    return pattern
+
+
+def summarize_zscores(z_scores: Dict[str, float]) -> Dict:
+    """Valence and significant emotions, as reported for a whole session"""
+    positive = z_scores['joy'] + z_scores['trust'] + z_scores['anticipation']
+    negative = z_scores['fear'] + z_scores['sadness'] + z_scores['anger'] + z_scores['disgust']
+    return {
+        'z_scores': z_scores,
+        'emotional_valence': positive - negative,
+        'positive_score': positive,
+        'negative_score': negative,
+        'significant_emotions': {e: s for e, s in z_scores.items() if abs(s) >= 1.96}
+    }
+
+
+def emotion_mask(emotions: Sequence[str]) -> np.ndarray:
+    mask = np.zeros(len(EMOTIONS), dtype=np.int32)
+    for emotion in emotions:
+        index = _EMOTION_INDEX.get(emotion)
+        if index is not None:
+            mask[index] = 1
+    return mask
+
+
+class NullModel:
+    """Expected mean/std of each emotion count for N distinct emotion words"""
+
+    def __init__(self, emo):
+        from snapshot import _package_lookup_table
+
+        # The packaged baseline table, as for the arrays: not the analyzer's own (mutable) one
+        self.lookup = _package_lookup_table(emo.language)
+        combos, weights = emo._baseline
+        weights = np.asarray(weights, dtype=np.float64)
+        carries = np.array([emotion_mask(combo) for combo in combos], dtype=np.float64)
+        # Probability that one draw from the baseline carries each emotion
+        self.p = (carries * weights[:, None]).sum(axis=0) / weights.sum()
+        self._cache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def mean_std(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._cache.get(n)
+        if cached is not None:
+            return cached
+        row = self.lookup.get(n)
+        if row is not None:
+            mean = np.array([row[e]["mean"] for e in EMOTIONS], dtype=np.float64)
+            std = np.array([row[e]["std"] for e in EMOTIONS], dtype=np.float64)
+        else:
+            mean = n * self.p
+            std = np.sqrt(n * self.p * (1 - self.p))
+        self._cache[n] = (mean, std)
+        return mean, std
+
+
+_null_models: Dict[int, NullModel] = {}
+
+
+def null_model_for(emo):
+    """The compiled, memory-mapped null model; the analyzer's own tables if arrays are disabled"""
+    if ARRAYS_ENABLED and getattr(emo, '_stem_or_lem', 'lemmatization') == 'lemmatization':
+        try:
+            return get_lexicon_arrays(emo.language)
+        except Exception as e:
+            print(f"⚠️ Lexicon arrays unavailable for '{emo.language}': {e}")
+    model = _null_models.get(id(emo))
+    if model is None:
+        model = _null_models[id(emo)] = NullModel(emo)
+    return model
+
+
+def zscores_from_counts(counts: np.ndarray, n_words: int, null_model) -> np.ndarray:
+    """Z-scores for distinct-word emotion counts, with EmoAtlas' small-N rules"""
+    return zscores_batch(np.asarray(counts)[None, :], np.array([n_words]), null_model)[0]
+
+
+def zscores_batch(counts: np.ndarray, n_words: np.ndarray, null_model) -> np.ndarray:
+    """Z-scores of many count vectors (rows) at once; one null-model row per distinct N"""
+    counts = np.asarray(counts, dtype=np.float64).reshape(-1, len(EMOTIONS))
+    n_words = np.asarray(n_words, dtype=np.int64)
+    sizes, inverse = np.unique(n_words, return_inverse=True)
+    rows = [null_model.mean_std(int(n)) for n in sizes]
+    mean = np.array([m for m, _ in rows], dtype=np.float64).reshape(-1, len(EMOTIONS))[inverse]
+    std = np.array([sd for _, sd in rows], dtype=np.float64).reshape(-1, len(EMOTIONS))[inverse]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(std > 0, (counts - mean) / std, 0.0)
+    z = np.where((n_words == 1)[:, None], np.where(counts > 0, 2.0, 0.0), z)
+    z = np.where(((n_words > 1) & (n_words <= 5))[:, None], np.where(counts > 1, 2.0, 0.0), z)
+    return np.where((n_words == 0)[:, None], 0.0, z)
+
+
+def _encode(emo, wordlist: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Token ids into a table of distinct emotion words (-1 for words without emotions)"""
+    if not ARRAYS_ENABLED or getattr(emo, '_stem_or_lem', 'lemmatization') != 'lemmatization':
+        return _encode_with_lexicon(emo, wordlist)
+    arrays = get_lexicon_arrays(emo.language)
+    distinct = list(dict.fromkeys(wordlist))
+    lexicon_index = arrays.lookup(distinct)
+    is_emotion = lexicon_index >= 0
+    # Emotion words numbered in order of first appearance; -1 for the others
+    compact = np.where(is_emotion, np.cumsum(is_emotion) - 1, -1)
+    position = {word: i for i, word in enumerate(distinct)}
+    ids = compact[np.fromiter((position[w] for w in wordlist), dtype=np.int64, count=len(wordlist))] \
+        if len(wordlist) else np.zeros(0, dtype=np.int64)
+    word_masks = arrays.emotion_matrix(lexicon_index[is_emotion]).reshape(-1, len(EMOTIONS))
+    return ids, word_masks
+
+
+def _encode_with_lexicon(emo, wordlist: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    lexicon = emo._emotion_lexicon
+    word_ids: Dict[str, int] = {}
+    masks = []
+    ids = np.full(len(wordlist), -1, dtype=np.int64)
+    for i, word in enumerate(wordlist):
+        wid = word_ids.get(word)
+        if wid is None:
+            emotions = lexicon.get(word)
+            if not emotions:
+                continue
+            wid = word_ids[word] = len(masks)
+            masks.append(emotion_mask(emotions))
+        ids[i] = wid
+    word_masks = np.array(masks, dtype=np.int32).reshape(-1, len(EMOTIONS))
+    return ids, word_masks
+
+
+def wordlist_counts(emo, wordlist: Sequence[str]) -> Dict[str, int]:
+    """Distinct-word emotion counts, equivalent to ``emo.emotions(text, normalization_strategy='none')``"""
+    _, word_masks = _encode(emo, wordlist)
+    counts = word_masks.sum(axis=0)
+    return {emotion: int(counts[i]) for i, emotion in enumerate(EMOTIONS)}
+
+
+def wordlist_zscores(emo, wordlist: Sequence[str]) -> Dict[str, float]:
+    """Z-scores of a whole word list, equivalent to ``emo.zscores(text)``"""
+    _, word_masks = _encode(emo, wordlist)
+    z = zscores_from_counts(word_masks.sum(axis=0), len(word_masks), null_model_for(emo))
+    return {emotion: float(z[i]) for i, emotion in enumerate(EMOTIONS)}
+
+
+def _window_starts(total: int, window: int, stride: int) -> List[int]:
+    if total <= window:
+        return [0]
+    starts = list(range(0, total - window + 1, stride))
+    if starts[-1] != total - window:
+        # Always cover the tail of the session
+        starts.append(total - window)
+    return starts
+
+
+def emotional_arc(emo, wordlist: Sequence[str], window: int = DEFAULT_ARC_WINDOW,
+                  stride: int = DEFAULT_ARC_STRIDE) -> Dict:
+    """Sliding-window z-scores over a session, in time linear in the number of tokens.
+
+    Windows are measured in tokens. Distinct-word counts are kept incrementally
+    as the window slides (each token enters and leaves at most once), so every
+    window costs O(8) on top of the single pass over the text.
+    """
+    window = max(int(window), MIN_ARC_WINDOW)
+    requested_stride = stride = max(int(stride), 1)
+    ids, word_masks = _encode(emo, wordlist)
+    total = len(ids)
+    if total > window and (total - window) // stride + 2 > MAX_ARC_WINDOWS:
+        # At most MAX_ARC_WINDOWS windows (the tail window included), whatever the session length
+        stride = -(-(total - window) // max(MAX_ARC_WINDOWS - 2, 1))
+    null_model = null_model_for(emo)
+
+    occurrences = np.zeros(len(word_masks), dtype=np.int64)
+    counts = np.zeros(len(EMOTIONS), dtype=np.int64)
+    n_words = 0
+    lo = hi = 0
+
+    starts = _window_starts(total, window, stride)
+    bounds = []
+    window_counts = np.zeros((len(starts), len(EMOTIONS)), dtype=np.int64)
+    window_words = np.zeros(len(starts), dtype=np.int64)
+
+    for row, start in enumerate(starts):
+        end = min(start + window, total)
+        # Drop tokens that left the window
+        while lo < hi and lo < start:
+            wid = ids[lo]
+            if wid >= 0:
+                occurrences[wid] -= 1
+                if occurrences[wid] == 0:
+                    counts -= word_masks[wid]
+                    n_words -= 1
+            lo += 1
+        if hi < start:
+            # stride > window: tokens in the gap are never part of a window
+            lo = hi = start
+        # Add tokens that entered it
+        while hi < end:
+            wid = ids[hi]
+            if wid >= 0:
+                occurrences[wid] += 1
+                if occurrences[wid] == 1:
+                    counts += word_masks[wid]
+                    n_words += 1
+            hi += 1
+        window_counts[row] = counts
+        window_words[row] = n_words
+        bounds.append([start, end])
+
+    series = zscores_batch(window_counts, window_words, null_model)
+
+    positive = series[:, [_EMOTION_INDEX[e] for e in ('joy', 'trust', 'anticipation')]].sum(axis=1)
+    negative = series[:, [_EMOTION_INDEX[e] for e in ('fear', 'sadness', 'anger', 'disgust')]].sum(axis=1)
+
+    return {
+        'window': window,
+        'stride': stride,
+        'requested_stride': requested_stride,
+        'token_count': total,
+        'emotions': EMOTIONS,
+        'windows': bounds,
+        'z_scores': np.round(series, 4).tolist(),
+        'emotional_valence': np.round(positive - negative, 4).tolist()
+    }
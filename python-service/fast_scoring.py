@@ -0,0 +1,289 @@
+"""Lexicon-only emotion scoring without spaCy.
+
+EmoAtlas z-scores only depend on the set of distinct lemmas that carry an
+emotion, so a preview doesn't need tagging or parsing: the text is
+lower-cased, a light tokenizer yields the distinct word forms, and idiomatic
+expressions count as their tokens (as in EmoAtlas). Each form is
+mapped to a lexicon lemma by, in order, the lemma cache (form -> lemma pairs
+learned from every full spaCy pass), an exact lexicon match and suffix
+heuristics (Italian inflection, clitics, adverbs, superlatives). Counts and
+z-scores then use the same null model as the full analysis.
+
+Results are deterministic and close to EmoAtlas' (forms spaCy would lemmatize
+differently are the only difference); they serve dashboard previews and
+replace the random scores of the degraded paths.
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from emotion_stats import (
+    EMOTIONS, emotion_mask, null_model_for, summarize_zscores, zscores_from_counts
+)
+
+LEMMA_CACHE_SIZE = int(os.getenv("LEMMA_CACHE_SIZE", "200000"))
+# Optional: learned form -> lemma pairs survive restarts in this JSON file
+LEMMA_CACHE_PATH = os.getenv("LEMMA_CACHE_PATH", "")
+
+_TOKEN_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+_ITALIAN_CLITICS = ('gliele', 'glielo', 'gliela', 'glieli', 'gliene', 'gli', 'mi', 'ti', 'si', 'ci', 'vi',
+                    'lo', 'la', 'li', 'le', 'ne')
+# (suffix, replacements) tried longest first; the first candidate found in the lexicon wins
+_ITALIAN_SUFFIXES: List[Tuple[str, Tuple[str, ...]]] = sorted([
+    ('issimo', ('o', 'e')), ('issima', ('o', 'e')), ('issimi', ('o', 'e')), ('issime', ('o', 'e')),
+    ('almente', ('ale',)), ('amente', ('o', 'a')), ('emente', ('e',)), ('mente', ('e',)),
+    # Participles: the adjective (masculine singular) first, then the verb
+    ('ato', ('are',)), ('ata', ('ato', 'are')), ('ati', ('ato', 'are')), ('ate', ('ato', 'are')),
+    ('ito', ('ire',)), ('ita', ('ito', 'ire')), ('iti', ('ito', 'ire')), ('ite', ('ito', 'ire')),
+    ('uto', ('ere',)), ('uta', ('uto', 'ere')), ('uti', ('uto', 'ere')), ('ute', ('uto', 'ere')),
+    ('ando', ('are',)), ('endo', ('ere', 'ire')), ('ante', ('are',)), ('ente', ('ere', 'ire')),
+    ('avo', ('are',)), ('ava', ('are',)), ('avi', ('are',)), ('avano', ('are',)), ('avamo', ('are',)),
+    ('evo', ('ere',)), ('eva', ('ere',)), ('evi', ('ere',)), ('evano', ('ere',)), ('evamo', ('ere',)),
+    ('ivo', ('ire',)), ('iva', ('ire',)), ('ivi', ('ire',)), ('ivano', ('ire',)), ('ivamo', ('ire',)),
+    ('erò', ('are', 'ere')), ('erà', ('are', 'ere')), ('eremo', ('are', 'ere')), ('eranno', ('are', 'ere')),
+    ('irò', ('ire',)), ('irà', ('ire',)), ('iremo', ('ire',)), ('iranno', ('ire',)),
+    ('erei', ('are', 'ere')), ('erebbe', ('are', 'ere')), ('irei', ('ire',)), ('irebbe', ('ire',)),
+    ('iamo', ('are', 'ere', 'ire')), ('ano', ('are',)), ('ono', ('ere', 'ire')),
+    ('chi', ('co',)), ('ghi', ('go',)), ('che', ('ca',)), ('ghe', ('ga',)),
+    ('i', ('o', 'e', 'a', 'io', 'are', 'ere', 'ire')), ('e', ('a', 'ere', 'ire', 'o')),
+    ('a', ('o', 'are')), ('o', ('are', 'ere', 'ire', 'a')),
+], key=lambda item: -len(item[0]))
+
+_ENGLISH_SUFFIXES: List[Tuple[str, Tuple[str, ...]]] = [
+    ('ies', ('y',)), ('ied', ('y',)), ('ily', ('y',)), ('ing', ('', 'e')), ('ed', ('', 'e')),
+    ('ly', ('',)), ('es', ('', 'e')), ('s', ('',)),
+]
+
+
+def italian_candidates(word: str) -> Iterable[str]:
+    """Likely lemmas of an Italian word form, most specific first"""
+    forms = [word]
+    # Clitic pronouns on infinitives, gerunds and imperatives: dirmi -> dire, parlarne -> parlare
+    for clitic in _ITALIAN_CLITICS:
+        if word.endswith(clitic) and len(word) > len(clitic) + 2:
+            stem = word[:-len(clitic)]
+            forms.append(stem + 'e' if stem.endswith(('ar', 'er', 'ir')) else stem)
+            break
+    for form in forms:
+        yield form
+        for suffix, replacements in _ITALIAN_SUFFIXES:
+            if form.endswith(suffix) and len(form) - len(suffix) >= 2:
+                stem = form[:-len(suffix)]
+                for replacement in replacements:
+                    yield stem + replacement
+                break
+
+
+def english_candidates(word: str) -> Iterable[str]:
+    yield word
+    for suffix, replacements in _ENGLISH_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 2:
+            stem = word[:-len(suffix)]
+            for replacement in replacements:
+                yield stem + replacement
+            if len(stem) > 2 and stem[-1] == stem[-2]:
+                yield stem[:-1]  # stopped -> stop
+            break
+
+
+_CANDIDATES = {'italian': italian_candidates, 'english': english_candidates}
+
+
+class LemmaCache:
+    """Form -> lemma pairs observed in full spaCy passes, per language (bounded)"""
+
+    def __init__(self, max_entries: int = LEMMA_CACHE_SIZE, path: str = LEMMA_CACHE_PATH):
+        self.max_entries = max_entries
+        self.path = path
+        self._lemmas: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.learned = 0
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._lemmas = json.load(f)
+            print(f"📚 Loaded {sum(len(v) for v in self._lemmas.values())} cached lemmas from {self.path}")
+        except Exception as e:
+            print(f"⚠️ Could not load the lemma cache: {e}")
+
+    def table(self, language: str) -> Dict[str, str]:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+        return self._lemmas.setdefault(language, {})
+
+    def learn(self, language: str, pairs: Iterable[Tuple[str, str]]):
+        table = self.table(language)
+        for form, lemma in pairs:
+            if form not in table and len(table) < self.max_entries:
+                table[form] = lemma
+                self.learned += 1
+
+    def save(self):
+        if not self.path or not self._loaded:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self._lemmas, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"⚠️ Could not save the lemma cache: {e}")
+
+    def stats(self) -> Dict:
+        return {"entries": {lang: len(t) for lang, t in self._lemmas.items()}, "learned": self.learned,
+                "path": self.path or None}
+
+
+lemma_cache = LemmaCache()
+
+
+def learn_lemmas(emo, docs):
+    """Record the (form, lemma) pairs of parsed spaCy docs whose lemma is an emotion word"""
+    lexicon = emo._emotion_lexicon
+    lemma_cache.learn(emo.language, (
+        (token.text, token.lemma_) for doc in docs for token in doc
+        if token.text != token.lemma_ and token.lemma_ in lexicon
+    ))
+
+
+class LexiconScorer:
+    """EmoAtlas resources without the spaCy pipeline.
+
+    Uses the same attribute names as ``EmoScores`` so the emotion_stats null model accepts it.
+    """
+
+    def __init__(self, language: str):
+        from emoatlas.baselines import _load_lookup_table, _make_baseline
+        from emoatlas.resources import _load_dictionary, _load_emojis, _load_idiomatic_tokens
+
+        self.language = language
+        self._emotion_lexicon = _load_dictionary(language)
+        self._idiomatic_tokens = _load_idiomatic_tokens(language)
+        self._emojis_dict = _load_emojis(language)
+        self._baseline = _make_baseline(language=language, emotion_lexicon=self._emotion_lexicon)
+        self._lookup = _load_lookup_table(language=language)
+        self._candidates = _CANDIDATES.get(language, lambda word: (word,))
+        self._masks = {word: emotion_mask(emotions) for word, emotions in self._emotion_lexicon.items()}
+        # (expression, token, its words) for the idiomatic expressions EmoAtlas replaces
+        self._idioms = [] if language == 'english' else [
+            (phrase, token, tuple(_TOKEN_RE.findall(phrase))) for phrase, token in self._idiomatic_tokens.items()
+        ]
+        # Resolved forms (lemma or None), so each form is only inflected once
+        self._resolved: Dict[str, Optional[str]] = {}
+
+    def lemma(self, form: str) -> Optional[str]:
+        """The lexicon lemma of a word form, or None if it carries no emotion"""
+        resolved = self._resolved.get(form, False)
+        if resolved is not False:
+            return resolved
+        learned = lemma_cache.table(self.language).get(form)
+        if learned is not None and learned in self._masks:
+            resolved = learned
+        else:
+            resolved = next((c for c in self._candidates(form) if c in self._masks), None)
+        if len(self._resolved) < LEMMA_CACHE_SIZE:
+            self._resolved[form] = resolved
+        return resolved
+
+    def forms(self, text: str) -> Tuple[set, int]:
+        """Distinct word forms of a text (idiomatic expressions as their tokens) and its token count.
+
+        Only distinct whitespace-separated chunks go through the word regex, and idiomatic
+        expressions are looked up only when all of their words occur in the text.
+        """
+        from emoatlas.textloader import _convert_emojis
+
+        if self._emojis_dict and not text.isascii():
+            text = _convert_emojis(text, self._emojis_dict)
+        lowered = text.replace("’", "'").lower()
+        chunks = lowered.split()
+        words_of = {chunk: _TOKEN_RE.findall(chunk) for chunk in set(chunks)}
+        forms = set().union(*words_of.values()) if words_of else set()
+
+        found: Dict[str, int] = {}
+        consumed: Dict[str, int] = {}
+        for phrase, token, words in self._idioms:
+            if all(word in forms for word in words):
+                occurrences = lowered.count(phrase)
+                if occurrences:
+                    found[token] = occurrences
+                    for word in words:
+                        consumed[word] = consumed.get(word, 0) + occurrences
+        if consumed:
+            # Words only seen inside idiomatic expressions are replaced by them, as in EmoAtlas
+            counts: Dict[str, int] = {}
+            for chunk, n in Counter(chunks).items():
+                for word in words_of[chunk]:
+                    counts[word] = counts.get(word, 0) + n
+            forms = {word for word in forms if counts[word] > consumed.get(word, 0)}
+        forms.update(found)
+        return forms, len(chunks)
+
+    def emotion_words(self, text: str) -> List[str]:
+        forms, _ = self.forms(text)
+        return sorted({lemma for lemma in map(self.lemma, forms) if lemma is not None})
+
+    def score(self, text: str) -> Dict:
+        forms, token_count = self.forms(text)
+        words = {lemma for lemma in map(self.lemma, forms) if lemma is not None}
+        masks = np.array([self._masks[w] for w in words], dtype=np.int32).reshape(-1, len(EMOTIONS))
+        counts = masks.sum(axis=0)
+        z = zscores_from_counts(counts, len(masks), null_model_for(self))
+        return {
+            'z_scores': {emotion: float(z[i]) for i, emotion in enumerate(EMOTIONS)},
+            'emotion_counts': {emotion: int(counts[i]) for i, emotion in enumerate(EMOTIONS)},
+            'emotion_word_count': len(masks),
+            'token_count': token_count
+        }
+
+
+_scorers: Dict[str, LexiconScorer] = {}
+_scorers_lock = threading.Lock()
+
+
+def get_fast_scorer(language: str = 'italian') -> LexiconScorer:
+    scorer = _scorers.get(language)
+    if scorer is None:
+        with _scorers_lock:
+            scorer = _scorers.get(language)
+            if scorer is None:
+                scorer = _scorers[language] = LexiconScorer(language)
+    return scorer
+
+
+def fast_zscores(text: str, language: str = 'italian') -> Dict[str, float]:
+    """Lexicon-only z-scores; all zeros if the EmoAtlas lexicon itself can't be loaded"""
+    try:
+        return get_fast_scorer(language).score(text)['z_scores']
+    except Exception as e:
+        print(f"⚠️ Fast scoring unavailable for '{language}': {e}")
+        return {emotion: 0.0 for emotion in EMOTIONS}
+
+
+def fast_analysis(text: str, language: str = 'italian') -> Dict:
+    """Session analysis in the shape of ``analyze_session`` results, from the lexicon only"""
+    try:
+        scored = get_fast_scorer(language).score(text)
+        z_scores, counts = scored['z_scores'], scored['emotion_counts']
+    except Exception as e:
+        print(f"⚠️ Fast scoring unavailable for '{language}': {e}")
+        z_scores, counts = {emotion: 0.0 for emotion in EMOTIONS}, None
+    return {
+        **summarize_zscores(z_scores),
+        'language': language,
+        'word_count': len(text.split()),
+        'emotion_counts': counts,
+        'mode': 'fast'
+    }
@@ -0,0 +1,170 @@
+"""Integer-indexed CSR form of forma mentis networks.
+
+A network is converted once into NumPy arrays: ``indptr``/``indices`` for the
+(symmetric) adjacency, and per half-edge ``weights`` and ``types`` (a bitmask
+over edge types, e.g. syntactic | synonyms). Frame queries then run as
+vectorized breadth-first expansion over those arrays instead of scanning the
+edge list of namedtuples: k-hop ego networks with edge-weight, edge-type and
+hub-degree pruning and a bound on the number of vertices, so large frames can
+be cut down before they are rendered.
+"""
+import os
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EDGE_TYPES = ('syntactic', 'synonyms')
+# Frames larger than this are cut (closest, strongest vertices first) before rendering
+SEMANTIC_FRAME_MAX_NODES = int(os.getenv("SEMANTIC_FRAME_MAX_NODES", "200"))
+
+# Same shape as EmoAtlas' namedtuple, so draw_formamentis accepts the extracted frame
+FormamentisNetwork = namedtuple("FormamentisNetwork", "edges vertices")
+
+EgoNetwork = namedtuple("EgoNetwork", "edges vertices distances weights types")
+
+
+class CSRGraph:
+    def __init__(self, words: List[str], indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                 types: np.ndarray, edge_types: Sequence[str] = EDGE_TYPES):
+        self.words = words
+        self.index: Dict[str, int] = {word: i for i, word in enumerate(words)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.types = types
+        self.edge_types = tuple(edge_types)
+        self.degree = np.diff(indptr)
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Tuple[str, str, str, float]],
+                   edge_types: Sequence[str] = EDGE_TYPES) -> "CSRGraph":
+        """Build from (source, target, type, weight) edges; repeated pairs merge types and keep the max weight"""
+        edges = list(edges)
+        type_bits = {name: 1 << i for i, name in enumerate(edge_types)}
+        words = sorted({word for a, b, _, _ in edges for word in (a, b)})
+        index = {word: i for i, word in enumerate(words)}
+        n = len(words)
+        if not edges:
+            empty = np.zeros(0, dtype=np.int32)
+            return cls(words, np.zeros(n + 1, dtype=np.int64), empty, empty.astype(np.float32),
+                       empty.astype(np.uint8), edge_types)
+
+        src = np.fromiter((index[a] for a, _, _, _ in edges), dtype=np.int64, count=len(edges))
+        dst = np.fromiter((index[b] for _, b, _, _ in edges), dtype=np.int64, count=len(edges))
+        bits = np.fromiter((type_bits.get(t, 0) for _, _, t, _ in edges), dtype=np.uint8, count=len(edges))
+        weight = np.fromiter((w for _, _, _, w in edges), dtype=np.float32, count=len(edges))
+        keep = src != dst
+        src, dst, bits, weight = src[keep], dst[keep], bits[keep], weight[keep]
+
+        # Both directions, then one entry per (row, column) pair
+        rows = np.concatenate([src, dst])
+        cols = np.concatenate([dst, src])
+        bits = np.concatenate([bits, bits])
+        weight = np.concatenate([weight, weight])
+        pair = rows * n + cols
+        unique_pairs, inverse = np.unique(pair, return_inverse=True)
+        merged_bits = np.zeros(len(unique_pairs), dtype=np.uint8)
+        np.bitwise_or.at(merged_bits, inverse, bits)
+        merged_weight = np.zeros(len(unique_pairs), dtype=np.float32)
+        np.maximum.at(merged_weight, inverse, weight)
+
+        rows = unique_pairs // n
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return cls(words, indptr, (unique_pairs % n).astype(np.int32), merged_weight, merged_bits, edge_types)
+
+    @classmethod
+    def from_formamentis(cls, fmnt) -> "CSRGraph":
+        """From a plain or multiplex EmoAtlas network; an edge's weight is the number of layers it appears in"""
+        if isinstance(fmnt.edges, dict):
+            layers = fmnt.edges.items()
+        else:
+            layers = [('syntactic', fmnt.edges)]
+        typed = {}
+        for edge_type, pairs in layers:
+            for a, b in pairs:
+                typed.setdefault((a, b) if a < b else (b, a), set()).add(edge_type)
+        return cls.from_edges((a, b, t, len(ts)) for (a, b), ts in typed.items() for t in ts)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.index
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices) // 2
+
+    def _type_mask(self, edge_types: Optional[Sequence[str]]) -> int:
+        if not edge_types:
+            return 0xFF
+        return sum(1 << self.edge_types.index(t) for t in edge_types if t in self.edge_types)
+
+    def _gather(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions of all half-edges leaving ``rows`` and the row each one leaves from"""
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        owner = np.repeat(np.arange(len(rows)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        return starts[owner] + offsets, rows[owner]
+
+    def ego(self, word: str, depth: int = 1, min_weight: float = 0, max_degree: Optional[int] = None,
+            max_nodes: Optional[int] = None, edge_types: Optional[Sequence[str]] = None) -> EgoNetwork:
+        """Vertices within ``depth`` hops of ``word`` and the edges among them.
+
+        Edges lighter than ``min_weight`` or of other types are ignored; vertices with more than
+        ``max_degree`` neighbors are kept but not expanded further; with ``max_nodes`` the closest
+        and most strongly connected vertices are kept first.
+        """
+        if word not in self.index:
+            return EgoNetwork([], [], {}, [], [])
+        mask = self._type_mask(edge_types)
+        usable = (self.weights >= min_weight) & ((self.types & mask) != 0)
+        n = len(self.words)
+        center = self.index[word]
+
+        distance = np.full(n, -1, dtype=np.int32)
+        strength = np.zeros(n, dtype=np.float32)
+        distance[center] = 0
+        frontier = np.array([center], dtype=np.int64)
+        for hop in range(1, max(depth, 0) + 1):
+            if max_degree is not None and hop > 1:
+                frontier = frontier[self.degree[frontier] <= max_degree]
+            positions, _ = self._gather(frontier)
+            positions = positions[usable[positions]]
+            targets = self.indices[positions]
+            fresh = distance[targets] == -1
+            np.maximum.at(strength, targets[fresh], self.weights[positions[fresh]])
+            frontier = np.unique(targets[fresh]).astype(np.int64)
+            if len(frontier) == 0:
+                break
+            distance[frontier] = hop
+
+        selected = np.flatnonzero(distance >= 0)
+        if max_nodes is not None and len(selected) > max_nodes:
+            # Center first, then by hop distance, connection strength and degree
+            order = np.lexsort((-self.degree[selected], -strength[selected], distance[selected]))
+            selected = selected[order[:max(max_nodes, 1)]]
+
+        inside = np.zeros(n, dtype=bool)
+        inside[selected] = True
+        positions, rows = self._gather(np.sort(selected))
+        cols = self.indices[positions].astype(np.int64)
+        keep = usable[positions] & inside[cols] & (rows < cols)
+        positions, rows, cols = positions[keep], rows[keep], cols[keep]
+
+        words = self.words
+        return EgoNetwork(
+            edges=[(words[a], words[b]) for a, b in zip(rows.tolist(), cols.tolist())],
+            vertices=[words[i] for i in selected.tolist()],
+            distances={words[i]: int(distance[i]) for i in selected.tolist()},
+            weights=self.weights[positions].tolist(),
+            types=[[t for i, t in enumerate(self.edge_types) if bits & (1 << i)] for bits in self.types[positions].tolist()]
+        )
+
+
+def ego_formamentis(ego: EgoNetwork) -> FormamentisNetwork:
+    """The ego network as an EmoAtlas-style network (for draw_formamentis)"""
+    return FormamentisNetwork(ego.edges, ego.vertices)
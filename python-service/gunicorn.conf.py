@@ -0,0 +1,33 @@
+"""Gunicorn config: preload models once in the parent, then fork uvicorn workers.
+
+Start with ``gunicorn -c gunicorn.conf.py main:app``. The parent imports
+``main`` with PRELOAD_MODELS=1, so EmoAtlas, spaCy and matplotlib are loaded
+and warmed up before ``fork()`` and every worker shares those pages
+copy-on-write instead of loading its own copy.
+"""
+import multiprocessing
+import os
+
+# Must be set before gunicorn imports the app in the parent process
+os.environ.setdefault("PRELOAD_MODELS", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8001')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", max(2, multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    import analyzers
+    report = analyzers.startup_report()
+    server.log.info(
+        "Models preloaded in pid %s: imports %s, warmup %s",
+        report["preloaded_in_pid"], report["import_timings"], report["warmup_timings"]
+    )
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s forked from preloaded parent", worker.pid)
@@ -0,0 +1,135 @@
+"""Precompute-on-ingest: warm the caches as soon as a transcript is final.
+
+The transcription pipeline posts a finalized transcript to ``/ingest``; the
+request returns at once and the session's views (emotion vector, topics,
+forma mentis network, preview renders) are computed in the background so the
+first interactive view is served from the caches.
+
+Warming is low priority. A single background coroutine per worker process
+takes one step at a time and only hands it to the fair-share scheduler (as
+queue ``ingest``) while the scheduler is idle: no request waiting and a free
+slot. Interactive requests therefore never queue behind a whole backlog of
+ingested sessions, at most behind the one step in progress. It runs in the
+API process on purpose: the document, result and render caches live in its
+memory, which the job worker processes can't fill. Under several gunicorn
+workers only the worker that received the call has warm memory caches; the
+SQLite layers (blocks, stored vectors, patient networks) are shared.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+from scheduler import FairScheduler
+
+INGEST_ENABLED = os.getenv("INGEST_ENABLED", "true").lower() in ("1", "true", "yes")
+INGEST_QUEUE_LIMIT = int(os.getenv("INGEST_QUEUE_LIMIT", "256"))
+INGEST_IDLE_POLL_SECONDS = float(os.getenv("INGEST_IDLE_POLL_SECONDS", "0.5"))
+# Scheduler user the background steps are accounted to
+INGEST_USER = "ingest"
+
+# A step: name, blocking function and its arguments
+Step = Tuple[str, Callable, tuple]
+
+
+class IngestQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Ingest queue full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class IngestQueue:
+    def __init__(self, scheduler: FairScheduler, runner: Callable[..., Awaitable],
+                 limit: int = INGEST_QUEUE_LIMIT):
+        self.scheduler = scheduler
+        # Runs a blocking step off the event loop (main.run_blocking)
+        self.runner = runner
+        self.limit = limit
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: set = set()
+        self._worker: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.failed_steps = 0
+        self.recent = deque(maxlen=50)
+        self._durations = deque(maxlen=50)
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.limit)
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def submit(self, key: Hashable, label: str, steps: Sequence[Step]) -> Dict:
+        """Queue the steps of one transcript; a transcript already waiting isn't queued twice"""
+        if self._queue is None:
+            raise RuntimeError("Ingest queue not started")
+        if key in self._pending:
+            self.duplicates += 1
+            return {"status": "already_queued", "position": self._queue.qsize()}
+        try:
+            self._queue.put_nowait((key, label, list(steps), time.time()))
+        except asyncio.QueueFull:
+            raise IngestQueueFull(self.retry_after())
+        self._pending.add(key)
+        self.submitted += 1
+        return {"status": "queued", "position": self._queue.qsize(), "steps": [name for name, _, _ in steps]}
+
+    async def _run(self):
+        while True:
+            key, label, steps, queued_at = await self._queue.get()
+            started = time.time()
+            results: Dict[str, str] = {}
+            try:
+                for name, func, args in steps:
+                    # Yield to interactive requests before every step
+                    while not self.scheduler.idle():
+                        await asyncio.sleep(INGEST_IDLE_POLL_SECONDS)
+                    step_start = time.perf_counter()
+                    try:
+                        await self.scheduler.run("ingest", INGEST_USER, lambda: self.runner(func, *args))
+                        results[name] = f"ok ({time.perf_counter() - step_start:.2f}s)"
+                    except Exception as e:
+                        # One failed step doesn't stop the others
+                        self.failed_steps += 1
+                        results[name] = f"failed: {e}"
+                        print(f"⚠️ Ingest step '{name}' failed for {label}: {e}")
+                self.completed += 1
+                self._durations.append(time.time() - started)
+                print(f"🔥 Warmed {label} in {time.time() - started:.2f}s "
+                      f"(waited {started - queued_at:.2f}s): {results}")
+                self.recent.append({"session": label, "queued_seconds": round(started - queued_at, 3),
+                                    "steps": results, "finished_at": datetime.now().isoformat()})
+            finally:
+                self._pending.discard(key)
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely room again"""
+        mean = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(1, math.ceil(mean))
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": INGEST_ENABLED,
+            "running": self._worker is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "limit": self.limit,
+            "submitted": self.submitted,
+            "duplicates": self.duplicates,
+            "completed": self.completed,
+            "failed_steps": self.failed_steps,
+            "mean_seconds": round(sum(self._durations) / len(self._durations), 3) if self._durations else None,
+            "recent": list(self.recent)[-10:]
+        }
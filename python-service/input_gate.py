@@ -0,0 +1,113 @@
+"""Pre-analysis gate for transcripts.
+
+Cheap checks that run before any EmoScores or spaCy work, so transcripts that
+are empty, still encrypted or not in the requested language are rejected in
+microseconds with a structured reason instead of producing all-zero scores.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional
+
+MIN_TRANSCRIPT_CHARS = 20
+MIN_ENCRYPTED_CHARS = 100
+# Only a prefix is inspected: enough tokens for a stable ratio, bounded cost on huge transcripts
+LANGUAGE_SAMPLE_CHARS = 4000
+ENCRYPTION_SAMPLE_CHARS = 4096
+MIN_STOPWORD_RATIO = 0.12
+MIN_SAMPLE_TOKENS = 8
+
+# Same alphabet as decryptIfEncrypted() in src/lib/encryption.ts
+_BASE64_RE = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+_WHITESPACE_RE = re.compile(r'\s')
+_TOKEN_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+STOPWORDS: Dict[str, FrozenSet[str]] = {
+    'italian': frozenset("""
+        a ad al alla alle agli ai anche ancora avere aveva avevo bene c che chi ci ciao come con cosa cosi così
+        da dal dalla dei del della delle dello di dire dopo e è ed era ero essere fa fare gli grazie ha hai ho
+        i ieri il in io la le lei lo loro lui ma male me mi mia mie miei mio molto ne nei nel nella no noi non
+        nostro o oggi per perché però piu più poi quando quello questo qui se sempre sento si sì sia siamo sono
+        sta stato su sua sue suo te ti tra tu tutto un una uno va vi voi
+        paziente terapeuta
+    """.split()),
+    'english': frozenset("""
+        a about after all also am an and any are as at be because been but by can could did do does for from
+        had has have he her him his how i if in into is it its just me my no not now of on one or our out she
+        so some that the their them then there they this to up was we were what when which who will with would
+        you your
+    """.split()),
+}
+
+SKIP_REASON_MESSAGES = {
+    'empty': "transcript is empty",
+    'too_short': "transcript too short",
+    'encrypted': "transcript appears to be encrypted/encoded and must be decrypted before analysis",
+    'wrong_language': "transcript doesn't seem to be in the requested language",
+}
+
+
+@dataclass(frozen=True)
+class GateResult:
+    accepted: bool
+    reason: Optional[str] = None
+    details: Dict = field(default_factory=dict)
+
+    @property
+    def message(self) -> str:
+        return SKIP_REASON_MESSAGES.get(self.reason, "accepted")
+
+    def to_dict(self) -> Dict:
+        return {"accepted": self.accepted, "reason": self.reason, "message": self.message, **self.details}
+
+
+def looks_encrypted(text: str) -> bool:
+    """Encrypted transcripts are one base64 blob: no whitespace, base64 alphabet only"""
+    if len(text) <= MIN_ENCRYPTED_CHARS:
+        return False
+    head = text[:ENCRYPTION_SAMPLE_CHARS]
+    if _WHITESPACE_RE.search(head):
+        return False
+    return _BASE64_RE.fullmatch(head) is not None and _BASE64_RE.fullmatch(text[-ENCRYPTION_SAMPLE_CHARS:]) is not None
+
+
+def stopword_ratios(text: str) -> Dict:
+    """Single pass over a lowercase token sample, scored against every stopword set"""
+    tokens = _TOKEN_RE.findall(text[:LANGUAGE_SAMPLE_CHARS].lower())
+    total = len(tokens)
+    ratios = {}
+    for language, stopwords in STOPWORDS.items():
+        hits = sum(1 for token in tokens if token in stopwords)
+        ratios[language] = hits / total if total else 0.0
+    return {"sample_tokens": total, "ratios": ratios}
+
+
+def check_transcript(text: Optional[str], language: str = 'italian') -> GateResult:
+    """Decide whether a transcript is worth sending to EmoAtlas"""
+    if not text or not text.strip():
+        return GateResult(False, 'empty')
+
+    stripped = text.strip()
+    if len(stripped) < MIN_TRANSCRIPT_CHARS:
+        return GateResult(False, 'too_short', {"length": len(stripped), "min_length": MIN_TRANSCRIPT_CHARS})
+
+    if looks_encrypted(stripped):
+        return GateResult(False, 'encrypted', {"length": len(stripped)})
+
+    if language not in STOPWORDS:
+        # No stopword list for this language: nothing more we can check cheaply
+        return GateResult(True, details={"language_checked": False})
+
+    scores = stopword_ratios(stripped)
+    ratios = scores["ratios"]
+    detected = max(ratios, key=ratios.get)
+    details = {
+        "language_checked": True,
+        "sample_tokens": scores["sample_tokens"],
+        "stopword_ratio": round(ratios[language], 4),
+        "detected_language": detected if ratios[detected] >= MIN_STOPWORD_RATIO else None
+    }
+    if scores["sample_tokens"] >= MIN_SAMPLE_TOKENS and (
+        ratios[language] < MIN_STOPWORD_RATIO or (detected != language and ratios[detected] > 2 * ratios[language])
+    ):
+        return GateResult(False, 'wrong_language', details)
+    return GateResult(True, details=details)
@@ -0,0 +1,31 @@
+"""Dedicated job worker service: ``python job_worker.py``.
+
+Runs the worker pool of ``jobs.py`` (``JOB_WORKERS`` processes and their
+supervisor) once per deployment, next to the API. The API processes only
+queue jobs and read their results from the shared SQLite queue
+(``JOBS_DB_PATH``), so neither the models nor the supervisor are duplicated
+per gunicorn worker.
+"""
+import signal
+import threading
+
+import jobs
+
+
+def main():
+    if not jobs.JOBS_ENABLED:
+        print("⏸️ Jobs disabled (JOBS_ENABLED=false), job worker not started")
+        return
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    jobs.job_pool.start()
+    print(f"👷 Job worker service running {jobs.job_pool.workers} workers on {jobs.job_pool.db_path}")
+    while not stop.wait(1.0):
+        pass
+    print("⏹️ Stopping job workers")
+    jobs.job_pool.stop()
+
+
+if __name__ == "__main__":
+    main()
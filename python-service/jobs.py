@@ -0,0 +1,398 @@
+"""Background jobs for analyses that can outlive an HTTP request.
+
+Jobs are rows in a local SQLite queue. A pool of worker processes claims them
+by priority (higher first, then oldest), runs the registered handler for the
+job kind and stores the JSON result in the same table, so results survive a
+restart. A supervisor thread respawns dead workers, requeues jobs orphaned by
+a crash or restart, and enforces cancellation of running jobs by terminating
+the worker that holds them.
+
+The pool runs once per deployment, in the dedicated ``job_worker.py``
+service: the API processes (one per gunicorn worker) only submit to and read
+from the queue. ``JOB_WORKERS_IN_API=true`` runs the pool inside the API
+process instead, for a single-process setup.
+"""
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite3"))
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() in ("1", "true", "yes")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_WORKERS_IN_API = os.getenv("JOB_WORKERS_IN_API", "false").lower() in ("1", "true", "yes")
+JOB_START_METHOD = os.getenv("JOB_START_METHOD", "spawn")
+# Module whose import registers the job kinds (main.py registers them next to the endpoints)
+JOB_HANDLER_MODULE = os.getenv("JOB_HANDLER_MODULE", "main")
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+# A worker pool is considered gone when its supervisor hasn't beaten for this long
+JOB_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("JOB_HEARTBEAT_TIMEOUT_SECONDS", "15"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    worker_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS job_supervisors (
+    pid INTEGER PRIMARY KEY,
+    workers INTEGER NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+class JobKind:
+    def __init__(self, handler: Callable, model=None):
+        self.handler = handler
+        self.model = model
+
+    def validate(self, payload: Dict) -> Dict:
+        """Reject bad payloads at submit time rather than in the worker"""
+        if self.model is not None:
+            return self.model.model_validate(payload).model_dump()
+        return payload
+
+    def run(self, payload: Dict):
+        result = self.handler(self.model(**payload) if self.model is not None else payload)
+        return result.model_dump() if hasattr(result, "model_dump") else result
+
+
+JOB_KINDS: Dict[str, JobKind] = {}
+
+
+def register_job_kind(kind: str, handler: Callable, model=None):
+    """Make ``handler`` runnable as a background job; ``model`` validates and rebuilds the payload"""
+    JOB_KINDS[kind] = JobKind(handler, model)
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, db_path: str = JOBS_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kind: str, payload: Dict, priority: int = 0) -> Dict:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, priority, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), priority, QUEUED, _now())
+            )
+        return self.get(job_id)
+
+    def claim(self, worker_pid: int) -> Optional[sqlite3.Row]:
+        """Atomically take the highest-priority queued job"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, worker_pid = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (RUNNING, _now(), worker_pid, row["id"])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def finish(self, job_id: str, worker_pid: int, result=None, error: Optional[str] = None):
+        """Store the outcome, unless the job was cancelled or reassigned meanwhile"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? "
+                "WHERE id = ? AND status = ? AND worker_pid = ?",
+                (FAILED if error else SUCCEEDED, _now(),
+                 None if error else json.dumps(result, default=str), error, job_id, RUNNING, worker_pid)
+            )
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Queued jobs are cancelled at once; running ones are flagged for the supervisor"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, cancel_requested = 1 WHERE id = ? AND status = ?",
+                (CANCELLED, _now(), job_id, QUEUED)
+            )
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def mark_cancelled(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, _now(), job_id, RUNNING)
+            )
+
+    def requeue_orphans(self, is_orphaned: Callable[[int], bool]) -> int:
+        """Running jobs whose worker is gone go back to the queue (or fail after too many attempts)"""
+        requeued = 0
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, worker_pid, attempts, cancel_requested FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            for row in rows:
+                if not is_orphaned(row["worker_pid"]):
+                    continue
+                if row["cancel_requested"]:
+                    conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                                 (CANCELLED, _now(), row["id"]))
+                elif row["attempts"] >= JOB_MAX_ATTEMPTS:
+                    conn.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                                 (FAILED, _now(), "worker died while running the job", row["id"]))
+                else:
+                    conn.execute("UPDATE jobs SET status = ?, worker_pid = NULL WHERE id = ?", (QUEUED, row["id"]))
+                    requeued += 1
+        return requeued
+
+    def cancel_requested(self) -> List[sqlite3.Row]:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, worker_pid FROM jobs WHERE status = ? AND cancel_requested = 1", (RUNNING,)
+            ).fetchall()
+
+    def purge(self, older_than_days: int = JOB_RETENTION_DAYS) -> int:
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        with self._connect() as conn:
+            placeholders = ",".join("?" * len(FINISHED_STATUSES))
+            cursor = conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?",
+                (*FINISHED_STATUSES, cutoff)
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, priority, status, created_at, started_at, finished_at, worker_pid, attempts, "
+                "cancel_requested, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def result(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["result"]) if row is not None and row["result"] is not None else None
+
+    def heartbeat(self, pid: int, workers: int):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO job_supervisors (pid, workers, heartbeat_at) VALUES (?, ?, ?)",
+                         (pid, workers, time.time()))
+
+    def clear_heartbeat(self, pid: int):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_supervisors WHERE pid = ?", (pid,))
+
+    def live_workers(self, timeout: float = JOB_HEARTBEAT_TIMEOUT_SECONDS) -> int:
+        """Worker processes of the pools whose supervisor beat recently (in any process)"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT COALESCE(SUM(workers), 0) FROM job_supervisors WHERE heartbeat_at >= ?",
+                               (time.time() - timeout,)).fetchone()
+        return row[0]
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def recent(self, limit: int = 50, status: Optional[str] = None) -> List[Dict]:
+        query = "SELECT id FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            ids = [row["id"] for row in conn.execute(query, params).fetchall()]
+        return [self.get(job_id) for job_id in ids]
+
+
+def worker_main(db_path: str, handler_module: str, stop_event):
+    """Worker process: claim jobs and run them until told to stop"""
+    try:
+        # Models load on the first job: preloading only pays off in a parent that forks
+        os.environ["PRELOAD_MODELS"] = "false"
+        # Importing the handler module registers the job kinds in this process
+        importlib.import_module(handler_module)
+        queue = JobQueue(db_path)
+        pid = os.getpid()
+        print(f"👷 Job worker {pid} ready ({', '.join(sorted(JOB_KINDS))})")
+        while not stop_event.is_set():
+            row = queue.claim(pid)
+            if row is None:
+                stop_event.wait(JOB_POLL_SECONDS)
+                continue
+            start = time.perf_counter()
+            print(f"👷 Job {row['id']} ({row['kind']}, priority {row['priority']}) started on worker {pid}")
+            try:
+                kind = JOB_KINDS.get(row["kind"])
+                if kind is None:
+                    raise ValueError(f"Unknown job kind '{row['kind']}'")
+                result = kind.run(json.loads(row["payload"]))
+                queue.finish(row["id"], pid, result=result)
+                print(f"✅ Job {row['id']} done in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e)
+                print(f"❌ Job {row['id']} failed: {detail}\n{traceback.format_exc()}")
+                queue.finish(row["id"], pid, error=str(detail))
+    except KeyboardInterrupt:
+        pass
+
+
+class JobWorkerPool:
+    """Worker processes plus a supervisor thread in the API process"""
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS,
+                 start_method: str = JOB_START_METHOD, handler_module: str = JOB_HANDLER_MODULE):
+        self.db_path = db_path
+        self.workers = workers
+        self.handler_module = handler_module
+        self._context = multiprocessing.get_context(start_method)
+        self._stop_event = self._context.Event()
+        self._processes: List = []
+        self._supervisor: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.queue: Optional[JobQueue] = None
+        self.restarts = 0
+
+    def attach(self):
+        """Open the queue without running workers: they run in the dedicated worker service"""
+        if self.queue is None:
+            self.queue = JobQueue(self.db_path)
+
+    def start(self):
+        if self._supervisor is not None or self.workers <= 0:
+            return
+        self.queue = JobQueue(self.db_path)
+        purged = self.queue.purge()
+        # Jobs left running by a previous process (restart, crash) are picked up again
+        requeued = self.queue.requeue_orphans(lambda pid: not _pid_alive(pid))
+        print(f"🗂️ Job queue at {self.db_path}: {requeued} jobs requeued, {purged} old jobs purged")
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        self.queue.heartbeat(os.getpid(), self.workers)
+        self._supervisor = threading.Thread(target=self._supervise, name="job-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _spawn(self):
+        process = self._context.Process(
+            target=worker_main, args=(self.db_path, self.handler_module, self._stop_event), daemon=True
+        )
+        process.start()
+        return process
+
+    def _supervise(self):
+        while not self._stopping.wait(1.0):
+            try:
+                self._enforce_cancellations()
+                for i, process in enumerate(self._processes):
+                    if not process.is_alive() and not self._stopping.is_set():
+                        print(f"⚠️ Job worker {process.pid} exited ({process.exitcode}), restarting")
+                        self._processes[i] = self._spawn()
+                        self.restarts += 1
+                own_pids = {p.pid for p in self._processes}
+                # Only this pool's dead workers: other API processes supervise their own
+                self.queue.requeue_orphans(lambda pid: pid not in own_pids and not _pid_alive(pid))
+                # Lets API processes tell that someone is consuming the queue
+                self.queue.heartbeat(os.getpid(), sum(p.is_alive() for p in self._processes))
+            except Exception as e:
+                print(f"❌ Job supervisor error: {e}")
+
+    def _enforce_cancellations(self):
+        by_pid = {p.pid: p for p in self._processes}
+        for row in self.queue.cancel_requested():
+            process = by_pid.get(row["worker_pid"])
+            if process is None:
+                continue
+            # A running handler can't be interrupted in place: stop its process, a fresh one replaces it
+            print(f"🛑 Cancelling job {row['id']}: terminating worker {process.pid}")
+            process.terminate()
+            process.join(5)
+            self.queue.mark_cancelled(row["id"])
+
+    def stop(self):
+        self._stopping.set()
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._supervisor = None
+        if self.queue is not None:
+            self.queue.clear_heartbeat(os.getpid())
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self._supervisor is not None,
+            "workers": [{"pid": p.pid, "alive": p.is_alive()} for p in self._processes],
+            "restarts": self.restarts,
+            "counts": self.queue.counts() if self.queue else {}
+        }
+
+
+job_pool = JobWorkerPool()
@@ -0,0 +1,234 @@
+"""Compiled, memory-mapped lexicon and z-score baseline arrays.
+
+``python lexicon_arrays.py build`` compiles, per language, the EmoAtlas
+emotion lexicon and null model into flat ``.npy`` files under
+``warm_state/<language>.arrays/``:
+
+- ``words.npy``: sorted lexicon words (fixed-width unicode), searched with
+  ``np.searchsorted`` for vectorized lookups
+- ``masks.npy``: one emotion bitmask (uint8) per word
+- ``null_mean.npy`` / ``null_std.npy``: expected count mean/std per number of
+  distinct emotion words (row N, one column per emotion), from EmoAtlas'
+  lookup table and the binomial model of the baseline beyond it
+- ``meta.json``: format and EmoAtlas versions
+
+At runtime every worker maps the files read-only (``mmap_mode='r'``), so the
+pages are shared through the OS page cache instead of each process holding
+its own dict copies, and z-scores are computed as array operations (``emotion_stats``).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+ARRAYS_FORMAT_VERSION = 1
+ARRAYS_DIR = os.getenv(
+    "LEXICON_ARRAYS_DIR",
+    os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_state"))
+)
+ARRAYS_ENABLED = os.getenv("LEXICON_ARRAYS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Rows of the null model table; N beyond it uses the binomial model directly
+MAX_TABLE_N = 10000
+
+# Same order as emotion_stats.EMOTIONS (kept here so the build has no service imports)
+EMOTIONS = ['joy', 'trust', 'fear', 'surprise', 'sadness', 'disgust', 'anger', 'anticipation']
+_BITS = np.array([1 << i for i in range(len(EMOTIONS))], dtype=np.uint8)
+
+
+def arrays_path(language: str, directory: str = ARRAYS_DIR) -> str:
+    return os.path.join(directory, f"{language}.arrays")
+
+
+def _emoatlas_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("emoatlas")
+    except Exception:
+        return "unknown"
+
+
+def compile_arrays(language: str) -> Dict[str, np.ndarray]:
+    """Lexicon and null model of a language as arrays (no spaCy needed)"""
+    from emoatlas.resources import _load_dictionary
+    from snapshot import _package_lookup_table
+
+    lexicon = _load_dictionary(language)
+    words = sorted(word for word, emotions in lexicon.items() if emotions)
+    index = {emotion: i for i, emotion in enumerate(EMOTIONS)}
+    masks = np.zeros(len(words), dtype=np.uint8)
+    for i, word in enumerate(words):
+        for emotion in lexicon[word]:
+            if emotion in index:
+                masks[i] |= 1 << index[emotion]
+
+    # Baseline = the lexicon's emotion distribution (EmoAtlas' default): share of all lexicon
+    # entries (including those without emotions) carrying each emotion
+    carries = (masks[:, None] & _BITS) != 0
+    p = carries.sum(axis=0) / max(len(lexicon), 1)
+    n = np.arange(MAX_TABLE_N + 1, dtype=np.float64)[:, None]
+    mean = n * p
+    std = np.sqrt(n * p * (1 - p))
+    for size, row in _package_lookup_table(language).items():
+        if 0 <= size <= MAX_TABLE_N:
+            mean[size] = [row[e]["mean"] for e in EMOTIONS]
+            std[size] = [row[e]["std"] for e in EMOTIONS]
+
+    width = max((len(w) for w in words), default=1)
+    return {
+        'words': np.array(words, dtype=f"<U{width}"),
+        'masks': masks,
+        'null_mean': mean,
+        'null_std': std,
+        'baseline_p': p
+    }
+
+
+def build_arrays(language: str, directory: str = ARRAYS_DIR) -> str:
+    start = time.perf_counter()
+    arrays = compile_arrays(language)
+    path = arrays_path(language, directory)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), values, allow_pickle=False)
+    meta = {
+        "format_version": ARRAYS_FORMAT_VERSION,
+        "emoatlas_version": _emoatlas_version(),
+        "language": language,
+        "words": int(len(arrays['words'])),
+        "table_rows": int(len(arrays['null_mean']))
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    if os.path.isdir(path):
+        # Replace the whole directory: workers that mapped the old files keep their inodes
+        old_path = f"{path}.old.{os.getpid()}"
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        for name in os.listdir(old_path):
+            os.remove(os.path.join(old_path, name))
+        os.rmdir(old_path)
+    else:
+        os.replace(tmp_path, path)
+    size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    print(f"📦 Lexicon arrays for '{language}' written to {path} ({size / 1024:.0f} KB, "
+          f"{time.perf_counter() - start:.2f}s)")
+    return path
+
+
+class LexiconArrays:
+    """Read-only views of a language's compiled arrays"""
+
+    def __init__(self, language: str, arrays: Dict[str, np.ndarray], source: str):
+        self.language = language
+        self.words = arrays['words']
+        self.masks = arrays['masks']
+        self.null_mean = arrays['null_mean']
+        self.null_std = arrays['null_std']
+        self.baseline_p = np.asarray(arrays['baseline_p'], dtype=np.float64)
+        self.source = source
+
+    def lookup(self, words: Sequence[str]) -> np.ndarray:
+        """Lexicon index of each word, -1 when it carries no emotion"""
+        if len(words) == 0:
+            return np.zeros(0, dtype=np.int64)
+        query = np.asarray(words, dtype=object)
+        lengths = np.fromiter((len(w) for w in words), dtype=np.int64, count=len(words))
+        # Longer than any lexicon word: can't match (and would be truncated by the fixed width)
+        fits = lengths <= self.words.dtype.itemsize // 4
+        fixed = np.where(fits, query, '').astype(self.words.dtype)
+        positions = np.searchsorted(self.words, fixed)
+        positions = np.minimum(positions, len(self.words) - 1)
+        found = fits & (self.words[positions] == fixed)
+        return np.where(found, positions, -1)
+
+    def emotion_matrix(self, indices: np.ndarray) -> np.ndarray:
+        """0/1 matrix (words x emotions) for lexicon indices"""
+        return ((self.masks[indices][:, None] & _BITS) != 0).astype(np.int32)
+
+    def mean_std(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        if n < len(self.null_mean):
+            return self.null_mean[n], self.null_std[n]
+        p = self.baseline_p
+        return n * p, np.sqrt(n * p * (1 - p))
+
+
+def _read(path: str) -> Optional[Dict[str, np.ndarray]]:
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format_version") != ARRAYS_FORMAT_VERSION or meta.get("emoatlas_version") != _emoatlas_version():
+            return None
+        return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r', allow_pickle=False)
+                for name in ('words', 'masks', 'null_mean', 'null_std', 'baseline_p')}
+    except (OSError, ValueError):
+        return None
+
+
+_loaded: Dict[str, LexiconArrays] = {}
+_load_lock = threading.Lock()
+
+
+def get_lexicon_arrays(language: str = 'italian', directory: str = ARRAYS_DIR) -> LexiconArrays:
+    """Memory-mapped arrays of a language, compiled first if missing or stale"""
+    arrays = _loaded.get(language)
+    if arrays is not None:
+        return arrays
+    with _load_lock:
+        arrays = _loaded.get(language)
+        if arrays is not None:
+            return arrays
+        path = arrays_path(language, directory)
+        mapped = _read(path)
+        source = "mmap"
+        if mapped is None:
+            try:
+                build_arrays(language, directory)
+                mapped = _read(path)
+            except OSError as e:
+                # Read-only filesystem: keep them in memory
+                print(f"⚠️ Could not write lexicon arrays for '{language}': {e}")
+            if mapped is None:
+                mapped, source = compile_arrays(language), "memory"
+        arrays = _loaded[language] = LexiconArrays(language, mapped, source)
+        return arrays
+
+
+def arrays_stats() -> Dict:
+    return {
+        "enabled": ARRAYS_ENABLED,
+        "directory": ARRAYS_DIR,
+        "languages": {
+            language: {"source": arrays.source, "words": int(len(arrays.words)),
+                       "table_rows": int(len(arrays.null_mean))}
+            for language, arrays in list(_loaded.items())
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile or inspect memory-mapped lexicon arrays')
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--languages', type=str, default='italian', help='Comma-separated languages')
+    parser.add_argument('--dir', type=str, default=ARRAYS_DIR, help='Output directory')
+    args = parser.parse_args()
+
+    for language in [l.strip() for l in args.languages.split(',') if l.strip()]:
+        path = arrays_path(language, args.dir)
+        if args.command == 'build':
+            build_arrays(language, args.dir)
+        else:
+            if _read(path) is None:
+                print(f"❌ No current lexicon arrays for '{language}' in {args.dir}")
+                sys.exit(1)
+            with open(os.path.join(path, "meta.json")) as f:
+                print(json.dumps(json.load(f), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,52 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict
-import numpy as np
+from fastapi.responses import FileResponse, JSONResponse
+from pydantic import BaseModel, confloat, conint, conlist, model_validator
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime
-import openai
 import os
 import json
 from dotenv import load_dotenv
 import base64
 import io
+import asyncio
+from profiling import PROFILING_ENABLED, ProfilingMiddleware, debug_token_valid, profile_current_thread, profile_store
+from scheduler import SCHEDULER_ENABLED, SchedulerBusy, analysis_scheduler
+from ingest import INGEST_ENABLED, IngestQueue, IngestQueueFull
+from cancellation import (CLIENT_DISCONNECTED, AnalysisCancelled, CancelToken, cancellation_stats, checkpoint,
+                          record_cancellation, request_deadline, use_token, watch_client)
+from memory_tracking import (MemoryAccountingMiddleware, guard_figures, memory_report, memory_stage, memory_store,
+                             start_tracing, stop_tracing, take_baseline, top_allocations)
+from readiness import ReadinessMonitor
+from input_gate import check_transcript
+from emotion_stats import (DEFAULT_ARC_STRIDE, DEFAULT_ARC_WINDOW, EMOTIONS, MAX_ARC_STRIDE, MAX_ARC_WINDOW,
+                           MIN_ARC_WINDOW, emotional_arc, summarize_zscores,
+                           wordlist_counts, wordlist_zscores)
+from speakers import analyze_speaker_sessions, normalize_speaker, speaker_trends, split_speaker_turns
+from document import content_hash, document_cache, get_document
+from blocks import BLOCKS_ENABLED, block_cache
+from content_store import resolve_transcript, result_cache, transcript_store
+from singleflight import SingleFlight, request_key
+import jobs
+from analysis_store import ANALYSIS_STORE_ENABLED, analysis_store
+from cohort import DEFAULT_PERCENTILES, cohort_statistics
+from trend_series import (DOWNSAMPLING_METHODS, TRENDS_MAX_PAGE_SIZE, TRENDS_MAX_POINTS, TRENDS_PAGE_SIZE,
+                          series_summaries, series_trends)
+from patient_network import formamentis_edges, patient_network_store
+from graph_csr import SEMANTIC_FRAME_MAX_NODES, ego_formamentis
+from centrality import centrality_report, network_metrics, word_centrality
+from fast_scoring import fast_analysis, fast_zscores, lemma_cache
+from lexicon_arrays import arrays_stats
 
 # Load environment variables
 load_dotenv()
 
-# EmoAtlas imports - Reliable initialization (data pre-downloaded in Docker)
-try:
-    from emoatlas import EmoScores
-    import matplotlib
-    matplotlib.use('Agg')  # Use non-interactive backend
-    import matplotlib.pyplot as plt
-    import spacy
-    
-    EMOATLAS_AVAILABLE = True
-    print("✅ EmoAtlas successfully imported (data should be pre-initialized)")
-    
-    # Test basic functionality
-    try:
-        test_emo = EmoScores(language='italian')
-        print("✅ EmoAtlas ready for semantic analysis")
-    except Exception as e:
-        print(f"⚠️ EmoAtlas test failed: {e}")
-        EMOATLAS_AVAILABLE = False
-    
-    # Load Italian spacy model for lemmatization
-    try:
-        nlp_it = spacy.load("it_core_news_sm")  # Using small model from Docker
-        print("✅ Italian Spacy model loaded for lemmatization")
-    except OSError:
-        nlp_it = None
-        print("⚠️ Italian Spacy model not available for lemmatization")
-        
-except ImportError as e:
-    print(f"⚠️ EmoAtlas or dependencies not available: {e}")
-    EMOATLAS_AVAILABLE = False
-    nlp_it = None
+# EmoAtlas, matplotlib and spaCy are loaded lazily (or preloaded by gunicorn.conf.py)
+import analyzers
+from analyzers import get_emoscores
+
+if analyzers.PRELOAD_MODELS:
+    analyzers.preload_for_fork()
 
 app = FastAPI(title="Single Document Analysis Service", version="1.0.0")
 
@@ -56,10 +58,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in profiling (PROFILING_ENABLED and the X-Debug-Token admin token): send "X-Profile: 1" or "?profile=1"
+app.add_middleware(ProfilingMiddleware)
+
+# Per-request peak/retained memory while tracemalloc runs; closes stray matplotlib figures
+app.add_middleware(MemoryAccountingMiddleware)
+
 def lemmatize_word(word: str, language: str = 'italian') -> str:
     """Lemmatize a word using Spacy to match EmoAtlas normalization"""
     try:
-        if language == 'italian' and nlp_it is not None:
+        nlp_it = analyzers.get_lemmatizer() if language == 'italian' else None
+        if nlp_it is not None:
             doc = nlp_it(word.lower())
             if len(doc) > 0:
                 lemmatized = doc[0].lemma_
@@ -90,15 +99,40 @@ class SingleDocumentResponse(BaseModel):
     analysis_timestamp: str
 
 # EmoAtlas Models
+class SpeakerSegment(BaseModel):
+    speaker: str
+    text: str
+
 class SessionData(BaseModel):
     id: str
     title: str
-    transcript: str
+    # Either the transcript or the SHA-256 of it (UTF-8) when the service has already seen it
+    transcript: Optional[str] = None
+    content_hash: Optional[str] = None
     sessionDate: str
+    # Diarized turns; when omitted in speaker mode they are split from the "Paziente:"/"Terapeuta:" labels
+    segments: Optional[List[SpeakerSegment]] = None
+
+    @model_validator(mode='after')
+    def require_text(self):
+        if not self.transcript and not self.content_hash and not self.segments:
+            raise ValueError("session needs a transcript, a content_hash or segments")
+        return self
 
 class EmotionAnalysisRequest(BaseModel):
     sessions: List[SessionData]
     language: str = 'italian'
+    # Intra-session emotional arc: sliding-window z-scores (window and stride in tokens)
+    include_arc: bool = False
+    # The stride is raised server-side when the session would have more than MAX_ARC_WINDOWS windows
+    arc_window: conint(ge=MIN_ARC_WINDOW, le=MAX_ARC_WINDOW) = DEFAULT_ARC_WINDOW
+    arc_stride: conint(ge=1, le=MAX_ARC_STRIDE) = DEFAULT_ARC_STRIDE
+    # Speaker mode: separate patient/therapist vectors and arcs from one batched pass
+    by_speaker: bool = False
+    # When set, each session's emotion vector is kept in the analysis store
+    patient_id: Optional[str] = None
+    # 'fast': lexicon-only scores without spaCy (previews); arcs and speaker split need 'full'
+    mode: str = 'full'
 
 class EmotionScoresModel(BaseModel):
     joy: float
@@ -123,6 +157,59 @@ class EmotionTrendsResponse(BaseModel):
     combined_analysis: Optional[Dict] = None
     trends: Optional[Dict] = None
     summary: Optional[Dict] = None
+    skipped_sessions: List[Dict] = []
+    speaker_trends: Optional[Dict] = None
+    # Hashes the service doesn't know: resend those sessions with their transcript
+    missing_hashes: List[str] = []
+    # Paged stored trends: cursor of the next page of individual_sessions (None on the last one)
+    next_cursor: Optional[str] = None
+
+class CohortRequest(BaseModel):
+    # A therapist's caseload; every stored patient when omitted
+    patient_ids: Optional[List[str]] = None
+    language: str = 'italian'
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    # Each in [0, 100]; out-of-range values are rejected with a 422 instead of failing in NumPy
+    percentiles: conlist(confloat(ge=0, le=100), min_length=1, max_length=101) = list(DEFAULT_PERCENTILES)
+    top_k: conint(ge=1, le=200) = 10
+
+class PatientNetworkSessionRequest(BaseModel):
+    session_id: str
+    # Either the transcript or the SHA-256 of a transcript the service has already seen
+    transcript: Optional[str] = None
+    content_hash: Optional[str] = None
+    session_date: Optional[str] = None
+    language: str = 'italian'
+
+class NetworkCentralityRequest(BaseModel):
+    text: Optional[str] = None
+    text_hash: Optional[str] = None
+    language: str = 'italian'
+    # Words to report; the top_k words per metric are always returned
+    words: List[str] = []
+    top_k: int = 20
+
+INGEST_TASKS = ('emotions', 'network', 'renders', 'topics')
+
+class IngestRequest(BaseModel):
+    session_id: str
+    # Either the final transcript or the SHA-256 of a transcript the service has already seen
+    transcript: Optional[str] = None
+    content_hash: Optional[str] = None
+    title: str = ''
+    session_date: Optional[str] = None
+    language: str = 'italian'
+    # When set, the session vector is stored and the patient network extended as well
+    patient_id: Optional[str] = None
+    # What to precompute; everything by default
+    tasks: List[str] = list(INGEST_TASKS)
+
+class JobSubmitRequest(BaseModel):
+    kind: str
+    payload: Dict
+    # Higher runs first
+    priority: int = 0
 
 class HealthCheckResponse(BaseModel):
     healthy: bool
@@ -132,10 +219,18 @@ class HealthCheckResponse(BaseModel):
 
 class DocumentAnalysisService:
     def __init__(self):
+        # Il client OpenAI viene creato al primo utilizzo (import costoso)
+        self._client = None
+    
+    @property
+    def client(self):
         # Configurazione OpenAI GPT-3.5
-        self.client = openai.OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY", "sk-your-key-here")
-        )
+        if self._client is None:
+            openai = analyzers.timed_import("openai")
+            self._client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY", "sk-your-key-here")
+            )
+        return self._client
     
     def extract_topics_gpt(self, text):
         """Usa GPT-3.5 per identificare topic semantici nel testo"""
@@ -208,32 +303,36 @@ analysis_service = DocumentAnalysisService()
 
 class EmoAtlasAnalysisService:
     def __init__(self):
-        self.available = EMOATLAS_AVAILABLE
-        print(f"🔧 EmoAtlasAnalysisService initialized - EmoAtlas available: {self.available}")
-        
-        # Don't test EmoAtlas during initialization to avoid startup crashes
-        if self.available:
-            print("✅ EmoAtlas is available for analysis")
-        else:
-            print("⚠️ EmoAtlas not available - using fallback analysis")
+        # EmoAtlas is loaded on first use (or by the warmup), not here
+        print("🔧 EmoAtlasAnalysisService initialized - EmoAtlas loads on first use")
     
-    def analyze_session(self, text: str, language: str = 'italian') -> Dict:
-        """Analyze a single session using EmoAtlas"""
-        print(f"🔍 Starting analysis for text length: {len(text)} characters")
-        print(f"🔍 Text preview: {text[:200]}...")
-        
+    @property
+    def available(self) -> bool:
+        return analyzers.emoatlas_available()
+    
+    def analyze_session(self, text: str, language: str = 'italian', arc: Optional[Tuple[int, int]] = None,
+                        wordlist: Optional[List[str]] = None) -> Dict:
+        """Analyze a single session using EmoAtlas; arc=(window, stride) adds the intra-session emotional arc"""
+        text = text or ''
         if not self.available:
             print("⚠️ EmoAtlas not available, using fallback")
-            return self._generate_fallback_analysis(text)
+            return self._generate_fallback_analysis(text, language)
         
         try:
-            # Initialize EmoScores for the language
-            print(f"🌍 Initializing EmoScores for language: {language}")
-            emo = EmoScores(language=language)
+            print(f"🔍 Starting analysis for text length: {len(text)} characters")
+            print(f"🔍 Text preview: {text[:200]}...")
             
-            # Get z-scores for the text
-            print("📊 Calling EmoScores.zscores()...")
-            z_scores_data = emo.zscores(text)
+            if wordlist is not None:
+                # Already lemmatized by a batched pass (speaker mode)
+                emo = get_emoscores(language)
+                z_scores_data = wordlist_zscores(emo, wordlist)
+                emotion_counts = wordlist_counts(emo, wordlist)
+                document = None
+            else:
+                # Parsed once per transcript: z-scores, arc and network all derive from it
+                document = get_document(text, language)
+                z_scores_data = document.z_scores
+                emotion_counts = document.emotion_counts
             print(f"📊 Raw z_scores_data: {z_scores_data}")
             
             # Get emotion scores (z-scores)
@@ -277,9 +376,15 @@ class EmoAtlasAnalysisService:
                 'language': language,
                 'word_count': len(text.split()),
                 'significant_emotions': significant_emotions,
-                'original_text': text  # Store original text for combined analysis
+                'emotion_counts': emotion_counts
             }
             
+            if arc is not None:
+                if document is not None:
+                    result['emotional_arc'] = document.arc(window=arc[0], stride=arc[1])
+                else:
+                    result['emotional_arc'] = emotional_arc(emo, wordlist, window=arc[0], stride=arc[1])
+            
             print(f"✅ Analysis completed successfully")
             print(f"📊 Final result: emotional_valence={emotional_valence}, positive_score={positive_score}, negative_score={negative_score}")
             print(f"📊 Significant emotions: {significant_emotions}")
@@ -291,81 +396,175 @@ class EmoAtlasAnalysisService:
             print(f"❌ Error type: {type(e)}")
             import traceback
             print(f"❌ Traceback: {traceback.format_exc()}")
-            return self._generate_fallback_analysis(text)
+            return self._generate_fallback_analysis(text, language)
     
-    def _generate_fallback_analysis(self, text: str) -> Dict:
-        """Generate fallback analysis when EmoAtlas is not available"""
-        import random
-        
-        # Generate random but realistic emotion scores
-        z_scores = {
-            'joy': random.uniform(-2, 2),
-            'trust': random.uniform(-2, 2),
-            'fear': random.uniform(-1, 3),
-            'surprise': random.uniform(-1, 1),
-            'sadness': random.uniform(-1, 3),
-            'disgust': random.uniform(-2, 2),
-            'anger': random.uniform(-1, 2),
-            'anticipation': random.uniform(-2, 2)
-        }
-        
-        positive_score = z_scores['joy'] + z_scores['trust'] + z_scores['anticipation']
-        negative_score = z_scores['fear'] + z_scores['sadness'] + z_scores['anger'] + z_scores['disgust']
-        
-        significant_emotions = {
-            emotion: score for emotion, score in z_scores.items() 
-            if abs(score) >= 1.96
-        }
-        
+    def _generate_fallback_analysis(self, text: str, language: str = 'italian') -> Dict:
+        """Lexicon-only scores when the full EmoAtlas pipeline is not available"""
         return {
-            'z_scores': z_scores,
-            'emotional_valence': positive_score - negative_score,
-            'positive_score': positive_score,
-            'negative_score': negative_score,
-            'language': 'italian',
-            'word_count': len(text.split()),
-            'significant_emotions': significant_emotions
+            **fast_analysis(text, language),
+            'fallback': True  # Never cached: not a full EmoAtlas result
         }
 
 # Initialize EmoAtlas service
 emoatlas_service = EmoAtlasAnalysisService()
 
+def run_readiness_self_test() -> Dict:
+    """Self-test executed by the background readiness task, never by a probe"""
+    analyzers.warmup()
+    if not emoatlas_service.available:
+        raise RuntimeError("EmoAtlas initialization failed")
+    test_result = emoatlas_service.analyze_session("Test di prova EmoAtlas.")
+    return {"emoatlas_test_result": test_result.get('emotional_valence', 'N/A')}
+
+def model_load_state() -> Dict:
+    return analyzers.load_state()
+
+readiness_monitor = ReadinessMonitor(run_readiness_self_test, model_load_state)
+
+@app.on_event("startup")
+async def start_readiness_monitor():
+    readiness_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_readiness_monitor():
+    await readiness_monitor.stop()
+
+@app.on_event("startup")
+async def invalidate_stale_vectors():
+    if ANALYSIS_STORE_ENABLED:
+        try:
+            removed = await asyncio.to_thread(analysis_store.invalidate_stale, analyzers.analyzer_version())
+            if removed:
+                print(f"🧹 Removed {removed} stored vectors from an older analyzer version")
+        except Exception as e:
+            print(f"⚠️ Analysis store unavailable: {e}")
+
+@app.on_event("startup")
+async def invalidate_stale_blocks():
+    if BLOCKS_ENABLED:
+        try:
+            removed = await asyncio.to_thread(block_cache.invalidate_stale, analyzers.analyzer_version())
+            if removed:
+                print(f"🧹 Removed {removed} transcript blocks from an older analyzer version")
+        except Exception as e:
+            print(f"⚠️ Block cache unavailable: {e}")
+
+@app.on_event("startup")
+async def start_job_workers():
+    if not jobs.JOBS_ENABLED:
+        return
+    if jobs.JOB_WORKERS_IN_API:
+        jobs.job_pool.start()
+    else:
+        # One pool per deployment (job_worker.py), not one per gunicorn worker
+        jobs.job_pool.attach()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await asyncio.to_thread(jobs.job_pool.stop)
+
+@app.on_event("shutdown")
+async def save_lemma_cache():
+    lemma_cache.save()
+
+# Identical concurrent analyses (two tabs, frontend retries) share one computation
+emotion_trends_flight = SingleFlight("emotion-trends")
+semantic_frame_flight = SingleFlight("semantic-frame-analysis")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run CPU-bound analysis in a worker thread so the event loop (and probes) stay responsive"""
+    def call():
+        # Dropped here if the request was cancelled while this call waited for a thread
+        checkpoint("start")
+        with profile_current_thread(), memory_stage(getattr(func, '__name__', 'blocking')):
+            return func(*args, **kwargs)
+    return await asyncio.to_thread(call)
+
+def request_user(http_request: Request) -> str:
+    """Who a request counts against for fair sharing: the app's X-User-Id, else the client address"""
+    user = http_request.headers.get("x-user-id", "").strip()
+    if user:
+        return user[:128]
+    return http_request.client.host if http_request.client else "anonymous"
+
+async def run_scheduled(queue: str, http_request: Request, func, *args, cost: float = 1.0,
+                        token: Optional[CancelToken] = None):
+    """``run_blocking`` behind the fair-share scheduler; 429 with Retry-After when the queue is full"""
+    user = request_user(http_request)
+    try:
+        # Worker threads inherit the token, so the analysis' checkpoints see it
+        with use_token(token):
+            if not SCHEDULER_ENABLED:
+                return await run_blocking(func, *args)
+            return await analysis_scheduler.run(queue, user, lambda: run_blocking(func, *args), cost, token)
+    except SchedulerBusy as e:
+        print(f"🚦 Rejected {queue} request from {user}: queue full (retry in {e.retry_after}s)")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except AnalysisCancelled as e:
+        record_cancellation(queue, e)
+        raise
+
+async def run_cancellable(flight: SingleFlight, key: str, http_request: Request, func):
+    """Run ``func(token)`` through ``flight``, abandoning it on deadline or when every waiting client left.
+
+    504 when the deadline passed, 499 (client closed request) when the clients disconnected.
+    """
+    token = flight.token(key) or CancelToken(request_deadline(http_request.headers.get("x-request-deadline")))
+    try:
+        async with watch_client(http_request, token):
+            return await flight.do(key, lambda: func(token), token)
+    except AnalysisCancelled as e:
+        if e.reason == CLIENT_DISCONNECTED:
+            raise HTTPException(status_code=499, detail=str(e))
+        raise HTTPException(status_code=504, detail=str(e))
+
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and the event loop is responding"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: cached result of the last scheduled self-test"""
+    state = readiness_monitor.snapshot()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
 @app.get("/health")
 async def health_check():
-    try:
-        health_info = {
-            "status": "healthy",
-            "python_service_status": "running",
-            "emoatlas_available": emoatlas_service.available
-        }
-        
-        if emoatlas_service.available:
-            health_info["emoatlas_version"] = "integrated"
-            # Test EmoAtlas with a simple analysis
-            try:
-                test_result = emoatlas_service.analyze_session("Test di prova EmoAtlas.")
-                health_info["emoatlas_test"] = "success"
-                health_info["emoatlas_test_result"] = test_result.get('emotional_valence', 'N/A')
-            except Exception as e:
-                health_info["emoatlas_test"] = "failed"
-                health_info["emoatlas_test_error"] = str(e)
+    """Legacy health check, now served from the cached readiness state"""
+    state = readiness_monitor.snapshot()
+    emoatlas_available = bool(state["models"]["emoatlas_available"])
+    health_info = {
+        "status": "healthy",
+        "python_service_status": "running",
+        "emoatlas_available": emoatlas_available,
+        "readiness": state["status"],
+        "last_check": state["last_check"]
+    }
+    
+    if emoatlas_available or state["models"]["emoatlas_available"] is None:
+        health_info["emoatlas_version"] = "integrated"
+        if state["status"] == "ready":
+            health_info["emoatlas_test"] = "success"
+            health_info["emoatlas_test_result"] = (state["last_result"] or {}).get('emoatlas_test_result', 'N/A')
+        elif state["status"] in ("failed", "timeout"):
+            health_info["emoatlas_test"] = state["status"]
+            health_info["emoatlas_test_error"] = state["last_error"]
         else:
-            health_info["emoatlas_error"] = "EmoAtlas initialization failed"
-        
-        return health_info
-    except Exception as e:
-        return {
-            "status": "error",
-            "error": str(e),
-            "python_service_status": "error",
-            "emoatlas_available": False
-        }
+            health_info["emoatlas_test"] = "pending"
+    else:
+        health_info["emoatlas_error"] = "EmoAtlas initialization failed"
+    
+    return health_info
 
 @app.get("/debug/emoatlas")
 async def debug_emoatlas():
     """Debug endpoint to test EmoAtlas functionality"""
+    return await run_blocking(run_emoatlas_debug)
+
+def run_emoatlas_debug() -> Dict:
     try:
-        if not EMOATLAS_AVAILABLE:
+        if not analyzers.emoatlas_available():
             return {
                 "status": "emoatlas_not_available",
                 "error": "EmoAtlas is not initialized",
@@ -374,7 +573,7 @@ async def debug_emoatlas():
         
         # Test basic EmoAtlas functionality
         print("🧪 Testing EmoAtlas basic functionality...")
-        emo = EmoScores(language='italian')
+        emo = get_emoscores('italian')
         
         # Test text analysis
         test_text = "Sono felice di essere qui oggi con voi."
@@ -408,12 +607,106 @@ async def debug_emoatlas():
         return {
             "status": "error",
             "error": str(e),
-            "emoatlas_available": EMOATLAS_AVAILABLE,
+            "emoatlas_available": analyzers.load_state()["emoatlas_available"],
             "timestamp": datetime.now().isoformat()
         }
 
+@app.get("/debug/startup")
+async def debug_startup():
+    """Import timings, warmup timings and whether models are shared with a preloading parent"""
+    return {
+        **analyzers.startup_report(),
+        "document_cache": document_cache.stats(),
+        "block_cache": block_cache.stats(),
+        "transcript_store": transcript_store.stats(),
+        "result_cache": result_cache.stats(),
+        "lemma_cache": lemma_cache.stats(),
+        "lexicon_arrays": arrays_stats()
+    }
+
+@app.get("/debug/singleflight")
+async def debug_singleflight():
+    """How many requests were coalesced onto an identical in-flight computation"""
+    return {
+        "emotion_trends": emotion_trends_flight.stats(),
+        "semantic_frame_analysis": semantic_frame_flight.stats()
+    }
+
+@app.get("/debug/scheduler")
+async def debug_scheduler():
+    """Queue depth, wait times, rejections and per-user usage of the fair-share scheduler, and abandoned analyses"""
+    return {**analysis_scheduler.stats(), "cancellations": cancellation_stats()}
+
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    """Debug routes exposing code paths or process-wide switches: admin token only (404 otherwise)"""
+    if not debug_token_valid(x_debug_token):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def require_profiling(x_debug_token: Optional[str] = Header(None)):
+    """Profile routes: the admin token and profiling turned on"""
+    require_debug_token(x_debug_token)
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/debug/profiles", dependencies=[Depends(require_profiling)])
+async def list_profiles():
+    """List the most recent request profiles"""
+    return {"profiles": profile_store.list()}
+
+@app.get("/debug/profiles/{profile_id}", dependencies=[Depends(require_profiling)])
+async def get_profile(profile_id: str):
+    """Top cumulative functions of a stored request profile"""
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return profile.summary()
+
+@app.get("/debug/profiles/{profile_id}/artifact", dependencies=[Depends(require_profiling)])
+async def download_profile(profile_id: str):
+    """Download the full pstats file (open with snakeviz or pstats)"""
+    profile = profile_store.get(profile_id)
+    if profile is None or not profile.artifact_path or not os.path.exists(profile.artifact_path):
+        raise HTTPException(status_code=404, detail=f"Profile artifact {profile_id} not found")
+    return FileResponse(profile.artifact_path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/debug/memory", dependencies=[Depends(require_debug_token)])
+async def debug_memory(recent: int = 20):
+    """Traced and resident memory, matplotlib figures, per-path and recent per-request peak/retained memory"""
+    return memory_report(recent)
+
+@app.get("/debug/memory/top", dependencies=[Depends(require_debug_token)])
+async def debug_memory_top(limit: int = 25, group_by: str = "lineno", compare: bool = False):
+    """Top allocation sites (``compare=true``: growth since the baseline snapshot)"""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return await run_blocking(top_allocations, limit, group_by, compare)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/debug/memory/baseline", dependencies=[Depends(require_debug_token)])
+async def debug_memory_baseline():
+    """Take the snapshot later ``/debug/memory/top?compare=true`` reports are diffed against"""
+    try:
+        return await run_blocking(take_baseline)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/debug/memory/tracing", dependencies=[Depends(require_debug_token)])
+async def debug_memory_tracing(enabled: bool = True):
+    """Start or stop tracemalloc (it slows allocation-heavy code while running)"""
+    if enabled:
+        start_tracing()
+    else:
+        stop_tracing()
+        memory_store.clear()
+    return memory_report(recent=0)
+
 @app.post("/single-document-analysis")
-async def single_document_analysis(request: SingleDocumentRequest):
+async def single_document_analysis(request: SingleDocumentRequest, http_request: Request):
+    return await run_scheduled("single-document", http_request, compute_single_document_analysis, request)
+
+def compute_single_document_analysis(request: SingleDocumentRequest) -> SingleDocumentResponse:
     try:
         print(f"DEBUG: Received request for session: {request.session_id}")
         
@@ -422,6 +715,13 @@ async def single_document_analysis(request: SingleDocumentRequest):
         if not request.transcript or len(words) < 20:
             raise HTTPException(status_code=400, detail="Transcript troppo breve per un'analisi significativa. Minimo 20 parole richieste.")
         
+        # Topic di una trascrizione già vista (es. precalcolati all'ingest)
+        cache_key = ('topics', content_hash(request.transcript))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            print(f"♻️ Topics for session {request.session_id} answered from stored results")
+            return SingleDocumentResponse(**{**cached, 'session_id': request.session_id})
+        
         # Usa solo GPT-3.5 per identificare topic semantici
         topics_data = analysis_service.extract_topics_gpt(request.transcript)
         
@@ -437,20 +737,31 @@ async def single_document_analysis(request: SingleDocumentRequest):
         # Summary semplice
         summary = ""#f"Analisi di {len(words)} parole. Identificati {len(topics)} temi principali utilizzando GPT-3.5."
         
-        return SingleDocumentResponse(
+        response = SingleDocumentResponse(
             session_id=request.session_id,
             topics=topics,
             summary=summary,
             analysis_timestamp=datetime.now().isoformat()
         )
+        if topics_data != analysis_service._fallback_topics():
+            result_cache.put(cache_key, response.model_dump())
+        return response
         
     except Exception as e:
         print(f"ERROR: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 @app.post("/emotion-trends")
-async def analyze_emotion_trends(request: EmotionAnalysisRequest):
+async def analyze_emotion_trends(request: EmotionAnalysisRequest, http_request: Request):
     """Analyze emotion trends across multiple sessions using EmoAtlas"""
+    return await run_cancellable(
+        emotion_trends_flight, request_key(request.model_dump()), http_request,
+        lambda token: run_scheduled("emotion-trends", http_request, compute_emotion_trends, request,
+                                    cost=max(len(request.sessions), 1), token=token)
+    )
+
+def compute_emotion_trends(request: EmotionAnalysisRequest) -> EmotionTrendsResponse:
+    skipped_sessions = []
     try:
         import time
         start_time = time.time()
@@ -461,48 +772,118 @@ async def analyze_emotion_trends(request: EmotionAnalysisRequest):
             raise HTTPException(status_code=400, detail="No sessions provided")
         
         individual_sessions = []
+        arc = (request.arc_window, request.arc_stride) if request.include_arc else None
         
+        accepted_sessions = []
+        cached_analyses = {}
+        missing_hashes = []
         for session in request.sessions:
+            if not session.transcript and not session.content_hash and session.segments:
+                # Diarized turns only: the transcript is the text of the turns
+                text, digest, error = resolve_transcript("\n".join(s.text for s in session.segments), None)
+            else:
+                text, digest, error = resolve_transcript(session.transcript, session.content_hash)
             print(f"🔍 Processing session {session.id}: {session.title}")
-            print(f"🔍 Session transcript length: {len(session.transcript) if session.transcript else 0}")
-            print(f"🔍 Session transcript preview: {session.transcript[:200] if session.transcript else 'None'}...")
+            print(f"🔍 Session transcript length: {len(text) if text else 0} (hash {digest[:12] if digest else 'None'})")
             
-            if not session.transcript or len(session.transcript.strip()) < 20:
-                print(f"⚠️ Skipping session {session.id}: transcript too short")
+            if error == 'hash_mismatch':
+                print(f"⚠️ Skipping session {session.id}: content_hash doesn't match the transcript")
+                skipped_sessions.append({
+                    "session_id": session.id, "accepted": False, "reason": error,
+                    "message": "content_hash doesn't match the SHA-256 of the transcript"
+                })
                 continue
             
-            # Skip if transcript looks like encrypted data
-            import re
-            base64_pattern = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
-            if base64_pattern.match(session.transcript) and len(session.transcript) > 100:
-                print(f"⚠️ Skipping session {session.id}: transcript appears to be encrypted/encoded")
-                print(f"⚠️ This needs to be decrypted before analysis")
+            # Results for known content are answered without touching the transcript
+            cache_key = emotion_cache_key(digest, request) if digest and not session.segments else None
+            cached = result_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                print(f"♻️ Session {session.id} answered from stored results")
+                cached_analyses[session.id] = cached
+                accepted_sessions.append((session, text, digest, cache_key))
+                continue
+            if text is None and digest:
+                missing_hashes.append(digest)
                 continue
             
-            # Check if transcript contains Italian words
-            italian_words = ['ciao', 'sono', 'mi', 'sento', 'oggi', 'ieri', 'bene', 'male', 'paziente', 'terapeuta', 'grazie', 'però', 'anche', 'quando', 'come', 'cosa', 'perché']
-            transcript_lower = session.transcript.lower()
-            italian_word_count = sum(1 for word in italian_words if word in transcript_lower)
-            
-            if italian_word_count < 2:
-                print(f"⚠️ WARNING: Session {session.id} transcript doesn't seem to contain Italian words")
-                print(f"⚠️ Italian word count: {italian_word_count}")
-                print(f"⚠️ This might cause EmoAtlas to return all zeros")
-                print(f"⚠️ Transcript sample: {session.transcript[:200]}...")
-            else:
-                print(f"✅ Session {session.id} transcript appears to be valid Italian text")
-                print(f"✅ Italian word count: {italian_word_count}")
+            # Cheap pre-analysis gate: empty, encrypted or wrong-language transcripts never reach EmoAtlas
+            gated_text = text
+            if request.by_speaker and session.segments:
+                gated_text = " ".join(segment.text for segment in session.segments)
+            gate = check_transcript(gated_text, request.language)
+            if not gate.accepted:
+                print(f"⚠️ Skipping session {session.id}: {gate.message} ({gate.details})")
+                skipped_sessions.append({"session_id": session.id, **gate.to_dict()})
+                continue
+            accepted_sessions.append((session, text, digest, cache_key))
+        
+        if missing_hashes:
+            # Incomplete request: ask for the unknown transcripts before aggregating anything
+            print(f"📭 {len(missing_hashes)} unknown content hashes, asking the client to upload them")
+            return EmotionTrendsResponse(
+                success=True,
+                individual_sessions=[],
+                skipped_sessions=skipped_sessions,
+                missing_hashes=list(dict.fromkeys(missing_hashes))
+            )
+        
+        to_analyze = [(session, text) for session, text, _, _ in accepted_sessions if session.id not in cached_analyses]
+        speaker_results = {}
+        batch_time_per_char = 0.0
+        if request.by_speaker and request.mode != 'fast' and to_analyze and emoatlas_service.available:
+            # Every turn of every session goes through spaCy in one batched pass
+            checkpoint("speaker batch")
+            segments = [
+                [(normalize_speaker(s.speaker), s.text) for s in session.segments] if session.segments
+                else split_speaker_turns(text)
+                for session, text in to_analyze
+            ]
+            batch_start = time.time()
+            results = analyze_speaker_sessions(get_emoscores(request.language), segments, arc)
+            batch_chars = sum(len(t) for turns in segments for _, t in turns) or 1
+            batch_time_per_char = (time.time() - batch_start) / batch_chars
+            speaker_results = {session.id: result for (session, _), result in zip(to_analyze, results)}
+            print(f"🗣️ Speaker analysis of {len(to_analyze)} sessions in {time.time() - batch_start:.2f}s")
+        
+        for session, text, digest, cache_key in accepted_sessions:
+            # Nobody is waiting any more: stop before the next session (finished ones stay cached)
+            checkpoint(f"session {session.id}")
+            if session.id in cached_analyses:
+                individual_sessions.append(SessionAnalysis(
+                    session_id=session.id,
+                    session_title=session.title,
+                    analysis=cached_analyses[session.id],
+                    processing_time=0.0
+                ))
+                continue
             
             session_start_time = time.time()
+            speaker_result = speaker_results.get(session.id)
             
             # Analyze single session
             print(f"🔍 Starting analysis for session {session.id}")
-            analysis = emoatlas_service.analyze_session(
-                session.transcript, 
-                language=request.language
-            )
+            if request.mode == 'fast':
+                analysis = fast_analysis(text, request.language)
+            else:
+                analysis = emoatlas_service.analyze_session(
+                    text, 
+                    language=request.language,
+                    arc=arc,
+                    wordlist=speaker_result['wordlist'] if speaker_result else None
+                )
             
             processing_time = time.time() - session_start_time
+            if speaker_result:
+                analysis['speakers'] = speaker_result['speakers']
+                # Share of the batched pass, proportional to the session's text
+                session_chars = (
+                    sum(len(segment.text) for segment in session.segments) if session.segments
+                    else len(text)
+                )
+                processing_time += batch_time_per_char * session_chars
+            
+            if cache_key and not analysis.get('fallback'):
+                result_cache.put(cache_key, analysis)
             
             # Log analysis results
             print(f"📊 Session {session.id} analysis results:")
@@ -521,6 +902,9 @@ async def analyze_emotion_trends(request: EmotionAnalysisRequest):
             individual_sessions.append(session_analysis)
             print(f"✅ Session {session.id} analyzed in {processing_time:.2f}s")
         
+        if request.patient_id:
+            store_session_vectors(request.patient_id, accepted_sessions, individual_sessions)
+        
         if not individual_sessions:
             raise HTTPException(status_code=400, detail="No valid sessions to analyze")
         
@@ -539,7 +923,11 @@ async def analyze_emotion_trends(request: EmotionAnalysisRequest):
             individual_sessions=individual_sessions,
             combined_analysis=combined_analysis,
             trends=trends,
-            summary=summary
+            summary=summary,
+            skipped_sessions=skipped_sessions,
+            speaker_trends=speaker_trends(
+                [(s.session_id, s.analysis['speakers']) for s in individual_sessions if 'speakers' in s.analysis]
+            ) if request.by_speaker else None
         )
         
     except Exception as e:
@@ -547,9 +935,38 @@ async def analyze_emotion_trends(request: EmotionAnalysisRequest):
         return EmotionTrendsResponse(
             success=False,
             error=str(e),
-            individual_sessions=[]
+            individual_sessions=[],
+            skipped_sessions=skipped_sessions
         )
 
+def store_session_vectors(patient_id: str, accepted_sessions: List, individual_sessions: List[SessionAnalysis]):
+    """Keep each full (not fallback, not fast-mode) session vector in the analysis store"""
+    if not ANALYSIS_STORE_ENABLED:
+        return
+    analyses = {s.session_id: s.analysis for s in individual_sessions}
+    version = analyzers.analyzer_version()
+    stored = 0
+    try:
+        for session, _, digest, _ in accepted_sessions:
+            analysis = analyses.get(session.id)
+            if analysis is None or analysis.get('fallback') or analysis.get('mode') == 'fast':
+                continue
+            stored += analysis_store.upsert(patient_id, session.id, analysis, version,
+                                            session_date=session.sessionDate, session_title=session.title,
+                                            content_hash=digest)
+        print(f"💾 Stored {stored} session vectors for patient {patient_id} "
+              f"({len(analyses) - stored} not stored: fallback or fast mode)")
+    except Exception as e:
+        # The store is an optimization: never fail the analysis because of it
+        print(f"⚠️ Could not store session vectors for patient {patient_id}: {e}")
+
+def emotion_cache_key(digest: str, request: EmotionAnalysisRequest) -> Tuple:
+    """Stored-result key: the content plus every option that changes a session's analysis"""
+    arc = (request.arc_window, request.arc_stride) if request.include_arc else None
+    if request.mode == 'fast':
+        return ('emotion', digest, request.language, 'fast')
+    return ('emotion', digest, request.language, arc, request.by_speaker)
+
 def calculate_emotion_trends(sessions: List[SessionAnalysis]) -> Dict:
     """Calculate emotion trends across sessions"""
     if not sessions:
@@ -628,98 +1045,108 @@ def generate_analysis_summary(sessions: List[SessionAnalysis]) -> Dict:
         return {}
 
 @app.post("/semantic-frame-analysis")
-async def semantic_frame_analysis(request: Dict):
+async def semantic_frame_analysis(request: Dict, http_request: Request):
     """Perform semantic frame analysis using EmoAtlas"""
+    return await run_cancellable(
+        semantic_frame_flight, request_key(request), http_request,
+        lambda token: run_scheduled("semantic-frame", http_request, compute_semantic_frame_analysis, request,
+                                    token=token)
+    )
+
+def semantic_frame_options(request: Dict) -> Dict:
+    """Ego-network bounds of a frame query: hops, minimum edge weight, hub degree and vertex cap"""
+    def optional_int(key):
+        value = request.get(key)
+        return int(value) if value is not None else None
+    return {
+        'depth': int(request.get('depth', 1)),
+        'min_weight': float(request.get('min_weight', 0)),
+        'max_degree': optional_int('max_degree'),
+        'max_nodes': optional_int('max_nodes') or SEMANTIC_FRAME_MAX_NODES,
+        'edge_types': tuple(request['edge_types']) if request.get('edge_types') else None
+    }
+
+def compute_semantic_frame_analysis(request: Dict) -> Dict:
     try:
-        text = request.get('text', '')
         target_word = request.get('target_word', '')
         session_id = request.get('session_id', 'unknown')
         language = request.get('language', 'italian')
         
+        # The text may be referenced by its SHA-256 instead of being uploaded again
+        text, digest, error = resolve_transcript(request.get('text', ''), request.get('text_hash'))
+        if error == 'hash_mismatch':
+            raise HTTPException(status_code=400, detail="text_hash doesn't match the SHA-256 of the text")
+        if text is None and digest:
+            print(f"📭 Unknown text_hash {digest[:12]}, asking the client to upload the text")
+            return {
+                "success": False,
+                "error": "Unknown text_hash: send the text",
+                "session_id": session_id,
+                "target_word": target_word,
+                "missing_hashes": [digest]
+            }
+        
         if not text or not target_word:
             raise HTTPException(status_code=400, detail="Text and target_word are required")
         
+        frame_options = semantic_frame_options(request)
+        cache_key = ('semantic_frame', digest, target_word, language, tuple(sorted(frame_options.items())))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            print(f"♻️ Semantic frame for '{target_word}' answered from stored results")
+            return {**cached, "session_id": session_id}
+        
         print(f"🔍 Starting semantic frame analysis for word '{target_word}'")
         
-        if not EMOATLAS_AVAILABLE:
+        if not analyzers.emoatlas_available():
             print("🔄 EmoAtlas not available, using fallback semantic analysis")
             return generate_fallback_semantic_analysis(text, target_word, session_id, language)
         
         try:
-            # Initialize EmoScores for the language with timeout protection
-            print(f"🌍 Initializing EmoScores for language: {language}")
-            emo = EmoScores(language=language)
-            print("✅ EmoScores initialized successfully")
+            document = get_document(text, language)
+            emo = document.analyzer
         except Exception as e:
             print(f"❌ Error initializing EmoScores with language '{language}': {e}")
             print("🔄 Falling back to semantic analysis without EmoAtlas")
             return generate_fallback_semantic_analysis(text, target_word, session_id, language)
         
-        # Generate the forma mentis network
+        # Forma mentis network, built once per transcript (as CSR arrays) and reused for every target word
         print(f"🕸️ Generating forma mentis network...")
-        fmnt = emo.formamentis_network(text)
+        checkpoint("network")
+        graph = document.graph
         
         # Extract semantic frame for the target word
         print(f"🎯 Extracting semantic frame for '{target_word}'...")
         try:
-            # Check if word exists in the full network first
-            print(f"🔍 Checking if '{target_word}' exists in full network...")
-            if hasattr(fmnt, 'vertices'):
-                all_words = list(fmnt.vertices)
-                print(f"📝 Total words in network: {len(all_words)}")
-                word_found = target_word in all_words
-                print(f"🎯 Word '{target_word}' found in network: {word_found}")
-                
-                # Debug: show similar words in the network
-                similar_words = [w for w in all_words if target_word.lower() in w.lower() or w.lower() in target_word.lower()]
-                print(f"🔍 Similar words in network: {similar_words[:10]}")
-                
-                # If not found, try to lemmatize the target word
-                actual_target_word = target_word
-                if not word_found:
-                    print(f"🔧 Word not found, attempting lemmatization...")
-                    lemmatized_word = lemmatize_word(target_word, language)
-                    print(f"📝 Lemmatized '{target_word}' -> '{lemmatized_word}'")
-                    
-                    if lemmatized_word in all_words:
-                        actual_target_word = lemmatized_word
-                        print(f"✅ Found lemmatized word '{lemmatized_word}' in network!")
-                    else:
-                        # Try case-insensitive search for both original and lemmatized
-                        similar_words = [w for w in all_words if w.lower() == target_word.lower()]
-                        lemmatized_similar = [w for w in all_words if w.lower() == lemmatized_word.lower()]
-                        print(f"🔤 Case-insensitive matches for '{target_word}': {similar_words}")
-                        print(f"🔤 Case-insensitive matches for '{lemmatized_word}': {lemmatized_similar}")
-                        
-                        # Use the first match found
-                        if similar_words:
-                            actual_target_word = similar_words[0]
-                            print(f"🎯 Using case-insensitive match: '{actual_target_word}'")
-                        elif lemmatized_similar:
-                            actual_target_word = lemmatized_similar[0]
-                            print(f"🎯 Using lemmatized case-insensitive match: '{actual_target_word}'")
+            print(f"📝 Total words in network: {len(graph.words)}")
+            actual_target_word = target_word
+            if target_word in graph:
+                print(f"✅ Word '{target_word}' found directly in network")
+            else:
+                # If not found, try the lemma, then case-insensitive matches of both
+                print(f"🔧 Word not found, attempting lemmatization...")
+                lemmatized_word = lemmatize_word(target_word, language)
+                print(f"📝 Lemmatized '{target_word}' -> '{lemmatized_word}'")
+                if lemmatized_word in graph:
+                    actual_target_word = lemmatized_word
+                    print(f"✅ Found lemmatized word '{lemmatized_word}' in network!")
                 else:
-                    print(f"✅ Word '{target_word}' found directly in network")
+                    lowered = {w.lower(): w for w in reversed(graph.words)}
+                    match = lowered.get(target_word.lower()) or lowered.get(lemmatized_word.lower())
+                    if match:
+                        actual_target_word = match
+                        print(f"🎯 Using case-insensitive match: '{actual_target_word}'")
             
             print(f"🔍 Final target word to extract: '{actual_target_word}'")
             
-            # Debug: check edges in full network that involve our target word
-            if hasattr(fmnt, 'edges'):
-                related_edges = [edge for edge in fmnt.edges if actual_target_word in edge]
-                print(f"🕸️ Edges in full network involving '{actual_target_word}': {len(related_edges)}")
-                print(f"🕸️ Related edges: {related_edges[:5]}...")  # Show first 5
-            
-            fmnt_word = emo.extract_word_from_formamentis(fmnt, actual_target_word)
-            print(f"🎭 Extracted subnetwork type: {type(fmnt_word)}")
-            print(f"🎭 Subnetwork object: {fmnt_word}")
-            
-            # Debug: check edges in extracted subnetwork
-            if hasattr(fmnt_word, 'edges'):
-                print(f"🔗 Edges in extracted subnetwork: {len(fmnt_word.edges)}")
-                print(f"🔗 Subnetwork edges: {list(fmnt_word.edges)}")
+            # k-hop ego network on the CSR arrays, pruned and bounded before rendering
+            checkpoint("ego network")
+            ego = graph.ego(actual_target_word, **frame_options)
+            fmnt_word = ego_formamentis(ego)
+            print(f"🔗 Edges in extracted subnetwork: {len(ego.edges)}")
             
             # Get connected words (vertices in the semantic frame)
-            connected_words = list(fmnt_word.vertices) if hasattr(fmnt_word, 'vertices') else []
+            connected_words = list(ego.vertices)
             print(f"🔗 Connected words found: {len(connected_words)}")
             print(f"🔗 Connected words list: {connected_words[:10]}...")  # Show first 10
             
@@ -732,8 +1159,8 @@ async def semantic_frame_analysis(request: Dict):
                 return generate_fallback_semantic_analysis(text, target_word, session_id, language)
             
             # Analyze emotions of the semantic frame
-            frame_emo = EmoScores(language=language)
-            frame_z_scores_data = frame_emo.zscores(sem_frame_text)
+            checkpoint("frame scores")
+            frame_z_scores_data = emo.zscores(sem_frame_text)
             
             frame_z_scores = {
                 'joy': float(frame_z_scores_data.get('joy', 0)),
@@ -757,16 +1184,16 @@ async def semantic_frame_analysis(request: Dict):
                 if abs(score) >= 1.96
             }
             
-            # Calculate semantic similarity (based on number of connections)
-            total_words = len(text.split())
-            connected_ratio = len(connected_words) / max(total_words, 1)
-            semantic_similarity = min(1.0, connected_ratio * 10)  # Normalize
+            # Position of the word in the whole network (memoized per network)
+            word_metrics = word_centrality(graph, actual_target_word) or {}
+            semantic_similarity = word_metrics.get('degree_centrality', 0.0)
             
             # Generate semantic network visualization using EmoAtlas
             # Pass the extracted subnetwork instead of the full network
+            checkpoint("render")
             network_plot = generate_semantic_network_plot(fmnt_word, actual_target_word, connected_words, frame_z_scores)
             
-            return {
+            result = {
                 "success": True,
                 "session_id": session_id,
                 "target_word": target_word,  # Keep original for user display
@@ -794,12 +1221,15 @@ async def semantic_frame_analysis(request: Dict):
                     "connected_words": len(connected_words),
                     "total_connections": len(connected_words),
                     "emotional_valence": emotional_valence,
-                    "semantic_centrality": semantic_similarity
+                    "semantic_centrality": word_metrics.get('closeness', 0.0),
+                    "centrality": word_metrics
                 },
                 "language": language,
                 "timestamp": datetime.now().isoformat(),
                 "network_plot": network_plot
             }
+            result_cache.put(cache_key, result)
+            return result
             
         except Exception as e:
             print(f"⚠️ Word '{target_word}' not found in forma mentis network: {e}")
@@ -815,6 +1245,7 @@ async def semantic_frame_analysis(request: Dict):
             "target_word": target_word
         }
 
+@guard_figures
 def generate_semantic_network_plot(fmnt_word, target_word: str, connected_words: list, frame_z_scores: dict) -> str:
     """Generate a network plot using EmoAtlas native draw_formamentis function on the extracted subnetwork"""
     try:
@@ -830,8 +1261,8 @@ def generate_semantic_network_plot(fmnt_word, target_word: str, connected_words:
         # Use EmoAtlas native draw_formamentis function
         print(f"🎨 Drawing forma mentis subnetwork using EmoAtlas...")
         
-        # Initialize EmoScores to access draw_formamentis
-        emo = EmoScores(language='italian')
+        # Shared EmoScores, used here only to access draw_formamentis
+        emo = get_emoscores('italian')
         
         # Check if we have a valid subnetwork
         if fmnt_word is not None:
@@ -880,6 +1311,7 @@ def generate_semantic_network_plot(fmnt_word, target_word: str, connected_words:
         print(f"🔄 Falling back to simple NetworkX plot...")
         return generate_fallback_network_plot(target_word, connected_words, frame_z_scores)
 
+@guard_figures
 def generate_fallback_network_plot(target_word: str, connected_words: list, frame_z_scores: dict) -> str:
     """Fallback network plot using NetworkX when EmoAtlas fails"""
     try:
@@ -996,6 +1428,7 @@ def generate_fallback_network_plot(target_word: str, connected_words: list, fram
         print(f"❌ Error generating fallback network plot: {e}")
         return None
 
+@guard_figures
 def generate_no_frame_placeholder_image(target_word: str) -> str:
     """Generate a placeholder image when no semantic frame is found"""
     try:
@@ -1079,23 +1512,13 @@ def generate_fallback_semantic_analysis(text: str, target_word: str, session_id:
             target_contexts.extend(words)
     
     # Remove duplicates and the target word itself
-    connected_words = list(set([w.strip('.,!?;:') for w in target_contexts if w.lower() != target_word.lower()]))
+    connected_words = sorted(set([w.strip('.,!?;:') for w in target_contexts if w.lower() != target_word.lower()]))
     
     # Generate placeholder image for no semantic frame
     placeholder_image = generate_no_frame_placeholder_image(target_word)
     
-    # Generate mock but realistic emotion scores
-    import random
-    frame_z_scores = {
-        'joy': random.uniform(-2, 2),
-        'trust': random.uniform(-2, 2),
-        'fear': random.uniform(-2, 2),
-        'surprise': random.uniform(-1, 1),
-        'sadness': random.uniform(-2, 2),
-        'disgust': random.uniform(-2, 2),
-        'anger': random.uniform(-2, 2),
-        'anticipation': random.uniform(-2, 2)
-    }
+    # Lexicon-only scores of the words around the target
+    frame_z_scores = fast_zscores(" ".join(connected_words), language)
     
     positive_score = frame_z_scores['joy'] + frame_z_scores['trust'] + frame_z_scores['anticipation']
     negative_score = frame_z_scores['fear'] + frame_z_scores['sadness'] + frame_z_scores['anger'] + frame_z_scores['disgust']
@@ -1133,7 +1556,7 @@ def generate_fallback_semantic_analysis(text: str, target_word: str, session_id:
         "language": language,
         "timestamp": datetime.now().isoformat(),
         "network_plot": placeholder_image,
-        "note": "Fallback analysis - EmoAtlas not available or word not found in network"
+        "note": "Fallback analysis - EmoAtlas not available or word not found in network (lexicon-only scores)"
     }
 
 def generate_combined_analysis(sessions: List[SessionAnalysis], language: str = 'italian') -> Dict:
@@ -1191,6 +1614,380 @@ def generate_combined_analysis(sessions: List[SessionAnalysis], language: str =
         print(f"❌ Error generating combined analysis: {e}")
         return None
 
+@app.get("/patients/{patient_id}/emotion-trends", response_model=EmotionTrendsResponse)
+def patient_emotion_trends(patient_id: str, language: str = 'italian', date_from: Optional[str] = None,
+                           date_to: Optional[str] = None, cursor: Optional[str] = None,
+                           limit: Optional[int] = None, points: Optional[int] = None, method: str = 'lttb'):
+    """Trends, summary and combined analysis from stored session vectors, without re-analysis.
+
+    With ``points`` the charted series are downsampled on the server (``method``: 'lttb' or 'mean'
+    buckets) and sessions are paged with ``cursor``/``limit`` (none unless asked for).
+    """
+    version = analyzers.analyzer_version()
+    if points is None and cursor is None and limit is None:
+        vectors = analysis_store.query(patient_id, version, language, date_from, date_to)
+        if not vectors:
+            raise HTTPException(status_code=404, detail="No stored sessions for this patient")
+        sessions = [session_from_vector(v) for v in vectors]
+        return EmotionTrendsResponse(
+            success=True,
+            individual_sessions=sessions,
+            combined_analysis=generate_combined_analysis(sessions, language),
+            trends=calculate_emotion_trends(sessions),
+            summary=generate_analysis_summary(sessions)
+        )
+
+    if method not in DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(DOWNSAMPLING_METHODS)}")
+    if points is not None and not 2 <= points <= TRENDS_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"points must be between 2 and {TRENDS_MAX_POINTS}")
+    series = analysis_store.load_series(patient_id, version, language, date_from, date_to)
+    if not len(series['session_ids']):
+        raise HTTPException(status_code=404, detail="No stored sessions for this patient")
+
+    page_size = min(limit if limit is not None else (TRENDS_PAGE_SIZE if cursor or points is None else 0),
+                    TRENDS_MAX_PAGE_SIZE)
+    vectors, next_cursor = [], None
+    if page_size > 0:
+        try:
+            vectors, next_cursor = analysis_store.page(patient_id, version, language, date_from, date_to,
+                                                       cursor, page_size)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    summary, combined = series_summaries(series, language)
+    return EmotionTrendsResponse(
+        success=True,
+        individual_sessions=[session_from_vector(v) for v in vectors],
+        combined_analysis=combined,
+        trends=series_trends(series, points, method),
+        summary=summary,
+        next_cursor=next_cursor
+    )
+
+def session_from_vector(vector: Dict) -> SessionAnalysis:
+    return SessionAnalysis(
+        session_id=vector['session_id'],
+        session_title=vector['session_title'] or '',
+        analysis=vector['analysis'],
+        processing_time=0.0
+    )
+
+@app.get("/patients/{patient_id}/sessions")
+def patient_session_vectors(patient_id: str, language: str = 'italian', date_from: Optional[str] = None,
+                            date_to: Optional[str] = None):
+    """Stored emotion vectors of a patient, in date order"""
+    vectors = analysis_store.query(patient_id, analyzers.analyzer_version(), language, date_from, date_to)
+    return {"patient_id": patient_id, "analyzer_version": analyzers.analyzer_version(), "sessions": vectors}
+
+@app.delete("/patients/{patient_id}/sessions/{session_id}")
+def delete_patient_session(patient_id: str, session_id: str):
+    """Forget a stored session (e.g. when it is deleted in the app)"""
+    return {"deleted": analysis_store.delete(patient_id, session_id)}
+
+@app.post("/cohort/emotion-stats")
+def cohort_emotion_stats(request: CohortRequest):
+    """Aggregate emotion statistics across many patients from stored session vectors"""
+    import time
+    start = time.perf_counter()
+    matrix = analysis_store.load_matrix(analyzers.analyzer_version(), request.language, request.patient_ids,
+                                        request.date_from, request.date_to)
+    loaded = time.perf_counter()
+    stats = cohort_statistics(matrix, request.percentiles, request.top_k)
+    print(f"👥 Cohort of {stats['sessions']} sessions: loaded in {loaded - start:.3f}s, "
+          f"aggregated in {time.perf_counter() - loaded:.3f}s")
+    return {"success": True, "language": request.language, **stats}
+
+def add_patient_network_session(patient_id: str, request: PatientNetworkSessionRequest) -> Dict:
+    """Merge one session's forma mentis network into the patient network"""
+    text, digest, error = resolve_transcript(request.transcript or '', request.content_hash)
+    if error == 'hash_mismatch':
+        raise HTTPException(status_code=400, detail="content_hash doesn't match the SHA-256 of the transcript")
+    if text is None and digest:
+        return {"success": False, "error": "Unknown content_hash: send the transcript", "missing_hashes": [digest]}
+    if not text:
+        raise HTTPException(status_code=400, detail="transcript or content_hash is required")
+
+    version = analyzers.analyzer_version()
+    if patient_network_store.has_session(patient_id, request.language, request.session_id, digest, version):
+        print(f"♻️ Session {request.session_id} already merged into the network of patient {patient_id}")
+        network = patient_network_store.get(patient_id, request.language, version)
+        return {"success": True, "merged": False, **network.summary(top_edges=0)}
+
+    gate = check_transcript(text, request.language)
+    if not gate.accepted:
+        return {"success": False, "error": gate.message, "skipped": gate.to_dict()}
+    if not analyzers.emoatlas_available():
+        raise HTTPException(status_code=503, detail="EmoAtlas not available")
+
+    edges = formamentis_edges(get_document(text, request.language).typed_network)
+    network = patient_network_store.add_session(patient_id, request.language, request.session_id, edges, version,
+                                                content_hash=digest, session_date=request.session_date)
+    print(f"🕸️ Merged {len(edges)} edges of session {request.session_id} into the network of patient {patient_id}")
+    return {"success": True, "merged": True, **network.summary(top_edges=0)}
+
+def patient_network_session_job(payload: Dict) -> Dict:
+    return add_patient_network_session(payload['patient_id'], PatientNetworkSessionRequest(**payload['session']))
+
+@app.post("/network-centrality")
+async def network_centrality(request: NetworkCentralityRequest, http_request: Request):
+    """Degree, closeness, PageRank and betweenness of a session's forma mentis network"""
+    return await run_scheduled("network-centrality", http_request, compute_network_centrality, request)
+
+def compute_network_centrality(request: NetworkCentralityRequest) -> Dict:
+    text, digest, error = resolve_transcript(request.text or '', request.text_hash)
+    if error == 'hash_mismatch':
+        raise HTTPException(status_code=400, detail="text_hash doesn't match the SHA-256 of the text")
+    if text is None and digest:
+        return {"success": False, "error": "Unknown text_hash: send the text", "missing_hashes": [digest]}
+    if not text:
+        raise HTTPException(status_code=400, detail="text or text_hash is required")
+    if not analyzers.emoatlas_available():
+        raise HTTPException(status_code=503, detail="EmoAtlas not available")
+    graph = get_document(text, request.language).graph
+    return {"success": True, "language": request.language,
+            **centrality_report(graph, request.words, min(request.top_k, 200))}
+
+def compute_patient_network_centrality(patient_id: str, language: str, requested: List[str], top_k: int) -> Dict:
+    network = patient_network_store.get(patient_id, language, analyzers.analyzer_version())
+    return {"success": True, "patient_id": patient_id, "language": language,
+            **centrality_report(network.graph(), requested, min(top_k, 200))}
+
+@app.get("/patients/{patient_id}/network/centrality")
+async def patient_network_centrality(patient_id: str, http_request: Request, language: str = 'italian',
+                                     words: Optional[str] = None, top_k: int = 20):
+    """Most central concepts across the patient's sessions (``words`` is comma-separated)"""
+    requested = [w.strip() for w in words.split(',') if w.strip()] if words else []
+    return await run_scheduled("patient-network", http_request, compute_patient_network_centrality,
+                               patient_id, language, requested, top_k)
+
+@app.post("/patients/{patient_id}/network/sessions")
+async def patient_network_add_session(patient_id: str, request: PatientNetworkSessionRequest, http_request: Request):
+    """Extend the patient's cross-session network with one session (no rebuild of earlier sessions)"""
+    return await run_scheduled("patient-network", http_request, add_patient_network_session, patient_id, request)
+
+@app.get("/patients/{patient_id}/network")
+def patient_network_summary(patient_id: str, language: str = 'italian', top_edges: int = 20):
+    """Sessions, size and heaviest edges (seen in the most sessions) of the patient network"""
+    network = patient_network_store.get(patient_id, language, analyzers.analyzer_version())
+    return network.summary(top_edges=min(top_edges, 500))
+
+@app.delete("/patients/{patient_id}/network/sessions/{session_id}")
+def patient_network_remove_session(patient_id: str, session_id: str, language: str = 'italian'):
+    return {"deleted": patient_network_store.remove_session(patient_id, language, session_id,
+                                                            analyzers.analyzer_version())}
+
+@app.get("/patients/{patient_id}/semantic-frame")
+async def patient_semantic_frame(patient_id: str, target_word: str, http_request: Request, language: str = 'italian',
+                                 min_weight: int = 1, depth: int = 1, max_nodes: int = SEMANTIC_FRAME_MAX_NODES):
+    """Semantic frame of a word across all sessions, with the sessions each association comes from"""
+    return await run_scheduled("patient-network", http_request, compute_patient_semantic_frame,
+                               patient_id, target_word, language, min_weight, depth, max_nodes)
+
+def compute_patient_semantic_frame(patient_id: str, target_word: str, language: str, min_weight: int,
+                                   depth: int, max_nodes: int) -> Dict:
+    network = patient_network_store.get(patient_id, language, analyzers.analyzer_version())
+    if not network.sessions:
+        raise HTTPException(status_code=404, detail="No sessions in this patient's network")
+
+    actual_target_word = target_word
+    if target_word not in network:
+        lemmatized_word = lemmatize_word(target_word, language)
+        print(f"📝 Lemmatized '{target_word}' -> '{lemmatized_word}'")
+        actual_target_word = lemmatized_word
+    ego = network.graph().ego(actual_target_word, depth=depth, min_weight=min_weight, max_nodes=max_nodes)
+    if len(ego.vertices) <= 1:
+        return {"success": False, "error": f"'{target_word}' has no associations in this patient's network",
+                "target_word": target_word, "actual_target_word": actual_target_word}
+    neighbors = network.neighbors(actual_target_word, min_weight)
+
+    emo = get_emoscores(language)
+    def frame_scores(words: List[str]) -> Dict:
+        z = emo.zscores(" ".join(words))
+        return {emotion: float(z.get(emotion, 0)) for emotion in EMOTIONS}
+
+    # How the word was framed in each session, in date order
+    timeline = []
+    for entry in network.summary(top_edges=0)['sessions']:
+        checkpoint(f"frame of session {entry['session_id']}")
+        words = network.session_neighbors(actual_target_word, entry['session_id'])
+        if words:
+            timeline.append({'session_id': entry['session_id'], 'session_date': entry.get('session_date'),
+                             'connected_words': words, 'z_scores': frame_scores(words)})
+
+    # Direct associations carry their provenance; farther words (depth > 1) their hop distance
+    connected_words = sorted((w for w in ego.vertices if w != actual_target_word),
+                             key=lambda w: (ego.distances[w], -neighbors.get(w, {}).get('weight', 0), w))
+    return {
+        "success": True,
+        "patient_id": patient_id,
+        "target_word": target_word,
+        "actual_target_word": actual_target_word,
+        "sessions_in_network": len(network.sessions),
+        "semantic_frame": {
+            "connected_words": connected_words,
+            "associations": [{'word': w, 'distance': ego.distances[w], **neighbors.get(w, {})}
+                             for w in connected_words],
+            "total_connections": len(connected_words)
+        },
+        "emotional_analysis": summarize_zscores(frame_scores(connected_words)),
+        "timeline": timeline,
+        "language": language,
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Background jobs: the same analyses, run by the worker processes in jobs.py
+jobs.register_job_kind("emotion_trends", compute_emotion_trends, EmotionAnalysisRequest)
+jobs.register_job_kind("semantic_frame_analysis", compute_semantic_frame_analysis)
+jobs.register_job_kind("single_document_analysis", compute_single_document_analysis, SingleDocumentRequest)
+jobs.register_job_kind("patient_network_session", patient_network_session_job)
+
+def get_job_queue() -> jobs.JobQueue:
+    if jobs.job_pool.queue is None:
+        raise HTTPException(status_code=503, detail="Job queue not enabled")
+    return jobs.job_pool.queue
+
+@app.post("/jobs", status_code=202)
+def submit_job(request: JobSubmitRequest):
+    """Queue a heavy analysis; poll GET /jobs/{job_id} and fetch GET /jobs/{job_id}/result"""
+    kind = jobs.JOB_KINDS.get(request.kind)
+    if kind is None:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind '{request.kind}'. Use: {sorted(jobs.JOB_KINDS)}")
+    try:
+        payload = kind.validate(request.payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload for '{request.kind}': {e}")
+    queue = get_job_queue()
+    if not queue.live_workers():
+        # Nothing consumes the queue: the job would stay queued forever
+        raise HTTPException(status_code=503, detail="No job worker running (start job_worker.py)")
+    job = queue.submit(request.kind, payload, request.priority)
+    print(f"🗂️ Job {job['id']} queued ({request.kind}, priority {request.priority})")
+    return job
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """Recent jobs and per-status counts"""
+    queue = get_job_queue()
+    return {"counts": queue.counts(), "jobs": queue.recent(min(limit, 500), status), "pool": jobs.job_pool.stats(),
+            "live_workers": queue.live_workers()}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """The job's result once it succeeded; 202 while it is queued or running"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in (jobs.QUEUED, jobs.RUNNING):
+        return JSONResponse(status_code=202, content=job)
+    if job["status"] != jobs.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job {job['status']}: {job['error'] or 'no result'}")
+    return queue.result(job_id)
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in jobs.FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return queue.cancel(job_id)
+
+# Precompute on ingest: the transcription pipeline announces final transcripts, idle capacity warms the caches
+def warm_emotions(request: IngestRequest, text: str):
+    """Session analysis with the default options, kept in the result cache (and the store, for a patient)"""
+    result = compute_emotion_trends(EmotionAnalysisRequest(
+        sessions=[SessionData(id=request.session_id, title=request.title, transcript=text,
+                              sessionDate=request.session_date or datetime.now().date().isoformat())],
+        language=request.language,
+        patient_id=request.patient_id
+    ))
+    if not result.success:
+        raise RuntimeError(result.error or "analysis failed")
+
+def warm_network(request: IngestRequest, text: str):
+    """Forma mentis network, its CSR graph and centrality metrics; the patient network when there is a patient"""
+    network_metrics(get_document(text, request.language).graph)
+    if request.patient_id:
+        add_patient_network_session(request.patient_id, PatientNetworkSessionRequest(
+            session_id=request.session_id, transcript=text, session_date=request.session_date,
+            language=request.language
+        ))
+
+def warm_renders(request: IngestRequest, text: str):
+    """Plutchik flower preview"""
+    if get_document(text, request.language).render_flower() is None:
+        raise RuntimeError("flower not rendered")
+
+def warm_topics(request: IngestRequest, text: str):
+    compute_single_document_analysis(SingleDocumentRequest(session_id=request.session_id, transcript=text))
+
+INGEST_STEPS = {'emotions': warm_emotions, 'network': warm_network, 'renders': warm_renders, 'topics': warm_topics}
+
+ingest_queue = IngestQueue(analysis_scheduler, run_blocking)
+
+@app.on_event("startup")
+async def start_ingest_queue():
+    if INGEST_ENABLED:
+        ingest_queue.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    await ingest_queue.stop()
+
+@app.post("/ingest", status_code=202)
+async def ingest_transcript(request: IngestRequest):
+    """Hook for the transcription pipeline: a transcript is final, precompute its views in the background"""
+    if not INGEST_ENABLED:
+        raise HTTPException(status_code=503, detail="Ingest warming is disabled")
+    unknown = [task for task in request.tasks if task not in INGEST_STEPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tasks {unknown}. Use: {list(INGEST_TASKS)}")
+    text, digest, error = resolve_transcript(request.transcript or '', request.content_hash)
+    if error == 'hash_mismatch':
+        raise HTTPException(status_code=400, detail="content_hash doesn't match the SHA-256 of the transcript")
+    if text is None and digest:
+        return {"success": False, "error": "Unknown content_hash: send the transcript", "missing_hashes": [digest]}
+    if not text:
+        raise HTTPException(status_code=400, detail="transcript or content_hash is required")
+
+    tasks = [task for task in INGEST_TASKS if task in request.tasks]
+    if 'topics' in tasks and len(text.split()) < 20:
+        tasks.remove('topics')  # too short for topic extraction
+    steps = [(task, INGEST_STEPS[task], (request, text)) for task in tasks]
+    try:
+        queued = ingest_queue.submit((digest, request.language, request.patient_id, request.session_id),
+                                     f"session {request.session_id}", steps)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    print(f"📥 Ingested session {request.session_id} ({digest[:12]}): {queued['status']}")
+    return {"success": True, "session_id": request.session_id, "content_hash": digest, **queued}
+
+@app.get("/documents/{digest}/flower")
+async def document_flower(digest: str, http_request: Request, language: str = 'italian'):
+    """Plutchik flower of a transcript the service has seen, as a base64 PNG (rendered ahead on ingest)"""
+    text = transcript_store.get(digest)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Unknown content hash: send the transcript first")
+    if not analyzers.emoatlas_available():
+        raise HTTPException(status_code=503, detail="EmoAtlas not available")
+    image = await run_scheduled("flower", http_request, lambda: get_document(text, language).render_flower())
+    return {"success": image is not None, "content_hash": digest, "language": language, "image": image}
+
+@app.get("/debug/ingest")
+async def debug_ingest():
+    """Background warming queued by /ingest"""
+    return ingest_queue.stats()
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8001))  # Usa PORT di Railway, default 8001 per locale
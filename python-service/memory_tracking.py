@@ -0,0 +1,367 @@
+"""Per-request memory accounting, allocation-site reports and a matplotlib figure guard.
+
+With ``MEMORY_TRACKING=true`` (or after ``POST /debug/memory/tracing``)
+tracemalloc runs for the whole process and every request records the peak
+and the retained traced memory (what it allocated and did not free), in
+total and per stage: each blocking computation and each parsed-document view
+(wordlist, network, flower, ...) is a stage. ``/debug/memory/top`` lists the
+top allocation sites, optionally as growth since a baseline snapshot, which
+is what points at a leak. Peaks and retained sizes are process-wide during
+the request, so concurrent requests see part of each other's allocations.
+
+pyplot keeps every figure alive until it is closed. Renders run inside
+``figure_guard``, which serializes pyplot use and closes any figure opened
+in the block; figures still open after a request are closed and counted.
+"""
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+MEMORY_TRACKING = os.getenv("MEMORY_TRACKING", "false").lower() in ("1", "true", "yes")
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+MEMORY_TOP_N = int(os.getenv("MEMORY_TOP_N", "25"))
+MAX_MEMORY_RECORDS = int(os.getenv("MAX_MEMORY_RECORDS", "200"))
+# Requests that retain more than this are logged
+MEMORY_RETAINED_WARN_MB = float(os.getenv("MEMORY_RETAINED_WARN_MB", "50"))
+
+_KB = 1024
+_MB = 1024 * 1024
+
+# Allocations of the tracing machinery itself are not interesting
+_IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>",
+                  "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            # Peak, not current, where /proc is not available (kilobytes on Linux, bytes on macOS)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except Exception:
+            return None
+
+
+class _Scope:
+    """Traced memory at the start of a request or stage, and the highest value seen since"""
+
+    def __init__(self):
+        self.start = 0
+        self.high = 0
+        self.started = time.perf_counter()
+
+
+class _PeakTracker:
+    """Shares tracemalloc's single peak counter between nested and concurrent scopes.
+
+    Before the peak is reset it is folded into every open scope, so each scope
+    still sees the highest traced memory reached while it was open.
+    """
+
+    def __init__(self):
+        self._open: List[_Scope] = []
+        self._lock = threading.Lock()
+
+    def _checkpoint(self) -> int:
+        current, peak = tracemalloc.get_traced_memory()
+        for scope in self._open:
+            scope.high = max(scope.high, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def open(self) -> _Scope:
+        scope = _Scope()
+        with self._lock:
+            current = self._checkpoint()
+            scope.start = scope.high = current
+            self._open.append(scope)
+        return scope
+
+    def close(self, scope: _Scope) -> Dict:
+        with self._lock:
+            current = self._checkpoint()
+            self._open.remove(scope)
+        return {
+            "peak_kb": round((scope.high - scope.start) / _KB, 1),
+            "retained_kb": round((current - scope.start) / _KB, 1),
+            "seconds": round(time.perf_counter() - scope.started, 4)
+        }
+
+
+_tracker = _PeakTracker()
+
+
+class RequestMemory:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now().isoformat()
+        self.stages: Dict[str, Dict] = {}
+        self.totals: Dict = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, measured: Dict):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "peak_kb": 0.0, "retained_kb": 0.0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["peak_kb"] = max(stage["peak_kb"], measured["peak_kb"])
+            stage["retained_kb"] = round(stage["retained_kb"] + measured["retained_kb"], 1)
+            stage["seconds"] = round(stage["seconds"] + measured["seconds"], 4)
+
+    def record(self) -> Dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            **self.totals,
+            "stages": dict(self.stages)
+        }
+
+
+_current_request: ContextVar[Optional[RequestMemory]] = ContextVar("current_request_memory", default=None)
+
+
+class MemoryStore:
+    """Recent request records and per-path aggregates"""
+
+    def __init__(self, max_records: int = MAX_MEMORY_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._paths: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, memory: RequestMemory):
+        record = memory.record()
+        key = f"{memory.method} {memory.path}"
+        with self._lock:
+            self._records.append(record)
+            path = self._paths.setdefault(key, {"requests": 0, "max_peak_kb": 0.0, "retained_kb": 0.0, "stages": {}})
+            path["requests"] += 1
+            path["max_peak_kb"] = max(path["max_peak_kb"], record["peak_kb"])
+            path["retained_kb"] = round(path["retained_kb"] + record["retained_kb"], 1)
+            for name, stage in record["stages"].items():
+                total = path["stages"].setdefault(name, {"calls": 0, "max_peak_kb": 0.0, "retained_kb": 0.0})
+                total["calls"] += stage["calls"]
+                total["max_peak_kb"] = max(total["max_peak_kb"], stage["peak_kb"])
+                total["retained_kb"] = round(total["retained_kb"] + stage["retained_kb"], 1)
+
+    def stats(self, recent: int = 20) -> Dict:
+        with self._lock:
+            paths = {key: {**value, "stages": dict(value["stages"])} for key, value in self._paths.items()}
+            records = list(self._records)[-recent:] if recent > 0 else []
+        return {"paths": paths, "recent": list(reversed(records))}
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._paths.clear()
+
+
+memory_store = MemoryStore()
+_baseline: Dict = {"snapshot": None, "taken_at": None}
+
+
+def tracing() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def start_tracing(frames: int = MEMORY_TRACE_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        print(f"🧮 tracemalloc started ({frames} frames per allocation)")
+
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        _baseline.update(snapshot=None, taken_at=None)
+        print("🧮 tracemalloc stopped")
+
+
+@contextmanager
+def memory_stage(name: str):
+    """Account the block's peak and retained memory to the current request; no-op when not tracing"""
+    memory = _current_request.get()
+    if memory is None or not tracemalloc.is_tracing():
+        yield
+        return
+    scope = _tracker.open()
+    try:
+        yield
+    finally:
+        memory.add_stage(name, _tracker.close(scope))
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES]
+    )
+
+
+def take_baseline() -> Dict:
+    """Snapshot to compare later reports against (leak detection)"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    _baseline.update(snapshot=_snapshot(), taken_at=datetime.now().isoformat())
+    return {"taken_at": _baseline["taken_at"]}
+
+
+def top_allocations(limit: int = MEMORY_TOP_N, group_by: str = "lineno", compare: bool = False) -> Dict:
+    """Largest allocation sites now, or the largest growth since the baseline"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    snapshot = _snapshot()
+    sites = []
+    if compare:
+        if _baseline["snapshot"] is None:
+            raise RuntimeError("no baseline snapshot taken")
+        for stat in snapshot.compare_to(_baseline["snapshot"], group_by)[:limit]:
+            sites.append({
+                "site": _format_traceback(stat.traceback, group_by),
+                "size_kb": round(stat.size / _KB, 1),
+                "size_diff_kb": round(stat.size_diff / _KB, 1),
+                "count": stat.count,
+                "count_diff": stat.count_diff
+            })
+    else:
+        for stat in snapshot.statistics(group_by)[:limit]:
+            sites.append({
+                "site": _format_traceback(stat.traceback, group_by),
+                "size_kb": round(stat.size / _KB, 1),
+                "count": stat.count
+            })
+    current, _ = tracemalloc.get_traced_memory()
+    return {
+        "group_by": group_by,
+        "compared_to_baseline": _baseline["taken_at"] if compare else None,
+        "traced_mb": round(current / _MB, 2),
+        "sites": sites
+    }
+
+
+def _format_traceback(traceback: tracemalloc.Traceback, group_by: str):
+    if group_by == "traceback":
+        return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+    frame = traceback[0]
+    return frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}"
+
+
+# pyplot's figure registry is global and not thread-safe: every render holds this lock
+_pyplot_lock = threading.RLock()
+FIGURE_STATS = {"guarded_renders": 0, "figures_closed": 0, "stray_figures_closed": 0}
+
+
+@contextmanager
+def figure_guard():
+    """Serialize pyplot use and close every figure the block leaves open"""
+    import matplotlib.pyplot as plt
+
+    with _pyplot_lock:
+        before = set(plt.get_fignums())
+        try:
+            yield
+        finally:
+            leftover = [number for number in plt.get_fignums() if number not in before]
+            for number in leftover:
+                plt.close(number)
+            FIGURE_STATS["guarded_renders"] += 1
+            FIGURE_STATS["figures_closed"] += len(leftover)
+
+
+def guard_figures(func):
+    """Decorator form of ``figure_guard``"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with figure_guard():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _pyplot():
+    """pyplot if something already imported it (a half-initialized module while another thread imports it counts as not)"""
+    plt = sys.modules.get("matplotlib.pyplot")
+    return plt if hasattr(plt, "get_fignums") else None
+
+
+def open_figures() -> int:
+    plt = _pyplot()
+    return len(plt.get_fignums()) if plt is not None else 0
+
+
+def sweep_figures() -> int:
+    """Close figures left open outside any render; skipped while a render holds pyplot"""
+    plt = _pyplot()
+    if plt is None or not _pyplot_lock.acquire(blocking=False):
+        return 0
+    try:
+        stray = len(plt.get_fignums())
+        if stray:
+            plt.close("all")
+            FIGURE_STATS["stray_figures_closed"] += stray
+            print(f"⚠️ Closed {stray} matplotlib figures left open after a request")
+        return stray
+    finally:
+        _pyplot_lock.release()
+
+
+def memory_report(recent: int = 20) -> Dict:
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    rss = rss_bytes()
+    return {
+        "tracing": tracemalloc.is_tracing(),
+        "trace_frames": tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None,
+        "traced_mb": round(current / _MB, 2),
+        "traced_peak_since_last_request_mb": round(peak / _MB, 2),
+        "process_rss_mb": round(rss / _MB, 1) if rss else None,
+        "baseline_taken_at": _baseline["taken_at"],
+        "figures": {"open": open_figures(), **FIGURE_STATS},
+        **memory_store.stats(recent)
+    }
+
+
+class MemoryAccountingMiddleware:
+    """Pure ASGI middleware: per-request memory records while tracing, figure sweep after every request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not tracemalloc.is_tracing():
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                sweep_figures()
+            return
+
+        memory = RequestMemory(scope.get("method", ""), scope.get("path", ""))
+        token = _current_request.set(memory)
+        measured = _tracker.open()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_request.reset(token)
+            stray = sweep_figures()
+            memory.totals = {**_tracker.close(measured), "stray_figures": stray}
+            memory_store.add(memory)
+            retained_mb = memory.totals["retained_kb"] / 1024
+            if retained_mb > MEMORY_RETAINED_WARN_MB:
+                print(f"⚠️ {memory.method} {memory.path} retained {retained_mb:.1f} MB "
+                      f"(peak {memory.totals['peak_kb'] / 1024:.1f} MB)")
+
+
+if MEMORY_TRACKING:
+    start_tracing()
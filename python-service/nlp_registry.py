@@ -0,0 +1,145 @@
+"""Process-wide registry of spaCy pipelines.
+
+Every spaCy model is loaded at most once per process and shared by all its
+users: the EmoAtlas analyzers, ``lemmatize_word`` and the batched wordlist
+extraction. Users get a ``TaskPipeline``, a thin view of the shared pipeline
+that disables the components its task doesn't need on each call (lemmas
+don't need the dependency parser; only forma mentis networks do), without
+mutating the shared pipeline. Components no task uses (``NLP_EXCLUDE``,
+named entities by default) are never loaded.
+
+The resident memory added by loading each model is recorded, and the current
+process RSS is reported next to it.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from memory_tracking import rss_bytes
+
+NLP_EXCLUDE = [c.strip() for c in os.getenv("NLP_EXCLUDE", "ner").split(",") if c.strip()]
+
+# Components each task can skip
+TASK_DISABLED = {
+    "lemmas": ("parser", "senter", "ner"),
+    "network": ("ner",),
+    "full": (),
+}
+
+
+def model_for_language(language: str, default: Optional[str] = None) -> str:
+    """spaCy model of a language: ``SPACY_MODEL_<LANGUAGE>``, else EmoAtlas' choice"""
+    override = os.getenv(f"SPACY_MODEL_{language.upper()}")
+    if override:
+        return override
+    if default:
+        return default
+    from emoatlas.resources import _spacy_model_by_language
+    return _spacy_model_by_language(language)
+
+
+class TaskPipeline:
+    """A shared spaCy pipeline restricted to the components of one task"""
+
+    def __init__(self, nlp, model: str, task: str):
+        self.nlp = nlp
+        self.model = model
+        self.task = task
+        self.disabled: List[str] = [c for c in TASK_DISABLED[task] if c in nlp.pipe_names]
+
+    def __call__(self, text):
+        return self.nlp(text, disable=self.disabled)
+
+    def pipe(self, texts: Iterable, **kwargs):
+        return self.nlp.pipe(texts, disable=self.disabled, **kwargs)
+
+    def for_task(self, task: str) -> "TaskPipeline":
+        return nlp_registry.task(self.model, task)
+
+    def __getattr__(self, name):
+        # vocab, meta, pipe_names, ... of the shared pipeline
+        return getattr(self.nlp, name)
+
+    def __repr__(self) -> str:
+        # EmoAtlas picks its tokenization path by looking for "spacy" in str(tagger)
+        return f"<spacy pipeline {self.model} task={self.task} disabled={self.disabled}>"
+
+
+class NLPRegistry:
+    def __init__(self):
+        self._pipelines: Dict[str, object] = {}
+        self._info: Dict[str, Dict] = {}
+        self._tasks: Dict[tuple, TaskPipeline] = {}
+        self._lock = threading.RLock()
+
+    def pipeline(self, model: str):
+        """The shared pipeline of a model, loaded on first use (raises OSError if not installed)"""
+        nlp = self._pipelines.get(model)
+        if nlp is not None:
+            return nlp
+        with self._lock:
+            nlp = self._pipelines.get(model)
+            if nlp is not None:
+                return nlp
+            import spacy
+
+            rss_before = rss_bytes()
+            start = time.perf_counter()
+            nlp = spacy.load(model, exclude=NLP_EXCLUDE)
+            self._register(model, nlp, time.perf_counter() - start, rss_before, "loaded")
+            return nlp
+
+    def adopt(self, model: str, nlp):
+        """Share a pipeline someone else already loaded, or drop it in favor of the registered one"""
+        with self._lock:
+            registered = self._pipelines.get(model)
+            if registered is not None:
+                return registered
+            for component in NLP_EXCLUDE:
+                if component in nlp.pipe_names:
+                    nlp.remove_pipe(component)
+            self._register(model, nlp, None, None, "adopted")
+            return nlp
+
+    def _register(self, model: str, nlp, seconds: Optional[float], rss_before: Optional[int], origin: str):
+        rss_after = rss_bytes()
+        self._pipelines[model] = nlp
+        self._info[model] = {
+            "origin": origin,
+            "components": list(nlp.pipe_names),
+            "load_seconds": round(seconds, 4) if seconds is not None else None,
+            # RSS growth while the model loaded (None when it was loaded elsewhere)
+            "rss_mb": round((rss_after - rss_before) / 2 ** 20, 1) if rss_before and rss_after else None,
+            "vectors": int(nlp.vocab.vectors.shape[0])
+        }
+        print(f"✅ spaCy model '{model}' registered ({origin}, components: {', '.join(nlp.pipe_names)})")
+
+    def task(self, model: str, task: str = "full") -> TaskPipeline:
+        key = (model, task)
+        view = self._tasks.get(key)
+        if view is None:
+            with self._lock:
+                view = self._tasks.get(key)
+                if view is None:
+                    view = self._tasks[key] = TaskPipeline(self.pipeline(model), model, task)
+        return view
+
+    def stats(self) -> Dict:
+        rss = rss_bytes()
+        return {
+            "process_rss_mb": round(rss / 2 ** 20, 1) if rss else None,
+            "excluded_components": NLP_EXCLUDE,
+            "models": {model: dict(info) for model, info in self._info.items()},
+            "tasks": sorted(f"{model}:{task}" for model, task in self._tasks)
+        }
+
+
+def lemma_pipeline(tagger):
+    """The lemmas-only view of an analyzer's pipeline (the pipeline itself if it isn't registered)"""
+    if isinstance(tagger, TaskPipeline):
+        return tagger.for_task("lemmas")
+    return tagger
+
+
+nlp_registry = NLPRegistry()
@@ -0,0 +1,325 @@
+"""Patient-level forma mentis network merged incrementally from session networks.
+
+Each session's (typed) forma mentis network is stored once, edge by edge, with
+its session id. The patient network is the union of those edges: an edge's
+weight is the number of sessions it appears in, and the session ids are its
+provenance. Adding a session only inserts that session's edges into the
+cached network; the concatenated corpus is never re-parsed. Networks built
+by another analyzer version are dropped when loaded.
+
+Every write bumps a per-patient revision row in the same transaction, and a
+cached network is checked against it on each read: sessions added by a job
+worker or another API process are picked up by reloading the network.
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from analysis_store import ANALYSIS_DB_PATH
+from graph_csr import CSRGraph
+
+PATIENT_NETWORK_CACHE_SIZE = int(os.getenv("PATIENT_NETWORK_CACHE_SIZE", "32"))
+
+# Same shape as EmoAtlas' namedtuple, so draw/extract helpers accept it
+FormamentisNetwork = namedtuple("FormamentisNetwork", "edges vertices")
+
+TypedEdge = Tuple[str, str, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS network_sessions (
+    patient_id TEXT NOT NULL,
+    language TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    content_hash TEXT,
+    session_date TEXT,
+    analyzer_version TEXT NOT NULL,
+    edge_count INTEGER NOT NULL,
+    added_at TEXT NOT NULL,
+    PRIMARY KEY (patient_id, language, session_id)
+);
+CREATE TABLE IF NOT EXISTS network_edges (
+    patient_id TEXT NOT NULL,
+    language TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    edge_type TEXT NOT NULL,
+    PRIMARY KEY (patient_id, language, session_id, source, target, edge_type)
+);
+CREATE TABLE IF NOT EXISTS network_revisions (
+    patient_id TEXT NOT NULL,
+    language TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, language)
+);
+"""
+
+
+def formamentis_edges(fmnt) -> List[TypedEdge]:
+    """(source, target, type) edges of a plain or multiplex forma mentis network, source < target"""
+    if isinstance(fmnt.edges, dict):
+        groups = fmnt.edges.items()
+    else:
+        groups = [("syntactic", fmnt.edges)]
+    edges = []
+    for edge_type, pairs in groups:
+        for a, b in pairs:
+            if a == b:
+                continue
+            edges.append((a, b, edge_type) if a < b else (b, a, edge_type))
+    return list(dict.fromkeys(edges))
+
+
+class PatientNetwork:
+    """In-memory union of session networks with per-edge provenance"""
+
+    def __init__(self, patient_id: str, language: str):
+        self.patient_id = patient_id
+        self.language = language
+        self.sessions: Dict[str, Dict] = {}
+        # (source, target) -> {session_id: {edge types}}
+        self.edges: Dict[Tuple[str, str], Dict[str, Set[str]]] = {}
+        self._adjacency: Dict[str, Set[str]] = {}
+        # Bumped on every change: derived structures are memoized against it
+        self.revision = 0
+        # Revision of the stored network this copy reflects
+        self.stored_revision = 0
+        self._graph: Optional[Tuple[int, CSRGraph]] = None
+
+    def add_session(self, session_id: str, edges: Iterable[TypedEdge], info: Optional[Dict] = None):
+        if session_id in self.sessions:
+            self.remove_session(session_id)
+        count = 0
+        for a, b, edge_type in edges:
+            self.edges.setdefault((a, b), {}).setdefault(session_id, set()).add(edge_type)
+            self._adjacency.setdefault(a, set()).add(b)
+            self._adjacency.setdefault(b, set()).add(a)
+            count += 1
+        self.sessions[session_id] = {**(info or {}), 'edge_count': count}
+        self.revision += 1
+
+    def remove_session(self, session_id: str):
+        if self.sessions.pop(session_id, None) is None:
+            return
+        for (a, b) in [pair for pair, sessions in self.edges.items() if session_id in sessions]:
+            provenance = self.edges[(a, b)]
+            del provenance[session_id]
+            if not provenance:
+                del self.edges[(a, b)]
+                self._adjacency[a].discard(b)
+                self._adjacency[b].discard(a)
+        self.revision += 1
+
+    def __contains__(self, word: str) -> bool:
+        return bool(self._adjacency.get(word))
+
+    @property
+    def vertices(self) -> List[str]:
+        return [word for word, neighbors in self._adjacency.items() if neighbors]
+
+    def weight(self, a: str, b: str) -> int:
+        return len(self.edges.get((a, b) if a < b else (b, a), {}))
+
+    def edge_list(self, min_weight: int = 1) -> List[Tuple[str, str, int, List[str]]]:
+        """(source, target, weight, edge types) for edges seen in at least ``min_weight`` sessions"""
+        return [
+            (a, b, len(provenance), sorted(set().union(*provenance.values())))
+            for (a, b), provenance in self.edges.items()
+            if len(provenance) >= min_weight
+        ]
+
+    def neighbors(self, word: str, min_weight: int = 1) -> Dict[str, Dict]:
+        result = {}
+        for other in self._adjacency.get(word, ()):
+            provenance = self.edges[(word, other) if word < other else (other, word)]
+            if len(provenance) >= min_weight:
+                result[other] = {
+                    'weight': len(provenance),
+                    'sessions': sorted(provenance),
+                    'types': sorted(set().union(*provenance.values()))
+                }
+        return result
+
+    def session_neighbors(self, word: str, session_id: str) -> List[str]:
+        return sorted(
+            other for other in self._adjacency.get(word, ())
+            if session_id in self.edges[(word, other) if word < other else (other, word)]
+        )
+
+    def graph(self) -> CSRGraph:
+        """CSR form of the merged network (edge weight = number of sessions), rebuilt only after changes"""
+        if self._graph is None or self._graph[0] != self.revision:
+            graph = CSRGraph.from_edges(
+                (a, b, edge_type, len(provenance))
+                for (a, b), provenance in self.edges.items()
+                for edge_type in set().union(*provenance.values())
+            )
+            self._graph = (self.revision, graph)
+        return self._graph[1]
+
+    def to_formamentis(self, min_weight: int = 1) -> FormamentisNetwork:
+        edges = [(a, b) for a, b, _, _ in self.edge_list(min_weight)]
+        vertices = sorted({word for edge in edges for word in edge})
+        return FormamentisNetwork(edges, vertices)
+
+    def summary(self, top_edges: int = 20) -> Dict:
+        edges = sorted(self.edge_list(), key=lambda e: (-e[2], e[0], e[1]))
+        return {
+            'patient_id': self.patient_id,
+            'language': self.language,
+            'sessions': [{'session_id': sid, **info} for sid, info in
+                         sorted(self.sessions.items(), key=lambda item: (item[1].get('session_date') or '', item[0]))],
+            'vertex_count': len(self.vertices),
+            'edge_count': len(edges),
+            'revision': self.revision,
+            'top_edges': [{'source': a, 'target': b, 'weight': w, 'types': t} for a, b, w, t in edges[:top_edges]]
+        }
+
+
+class PatientNetworkStore:
+    """Session edges in SQLite plus an LRU of merged patient networks"""
+
+    def __init__(self, db_path: str = ANALYSIS_DB_PATH, max_networks: int = PATIENT_NETWORK_CACHE_SIZE):
+        self.db_path = db_path
+        self.max_networks = max_networks
+        self._networks: "OrderedDict[Tuple[str, str], PatientNetwork]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=30) as conn:
+                conn.executescript(_SCHEMA)
+            self._ready = True
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _stored_revision(conn, patient_id: str, language: str) -> int:
+        row = conn.execute("SELECT revision FROM network_revisions WHERE patient_id = ? AND language = ?",
+                           (patient_id, language)).fetchone()
+        return row[0] if row else 0
+
+    @classmethod
+    def _bump_revision(cls, conn, patient_id: str, language: str) -> int:
+        conn.execute(
+            "INSERT INTO network_revisions (patient_id, language, revision) VALUES (?, ?, 1) "
+            "ON CONFLICT (patient_id, language) DO UPDATE SET revision = revision + 1",
+            (patient_id, language)
+        )
+        return cls._stored_revision(conn, patient_id, language)
+
+    def get(self, patient_id: str, language: str, analyzer_version: str) -> PatientNetwork:
+        key = (patient_id, language)
+        with self._lock:
+            network = self._networks.get(key)
+            if network is not None:
+                with self._connect() as conn:
+                    stored = self._stored_revision(conn, patient_id, language)
+                if stored != network.stored_revision:
+                    # Written by a job worker or another API process since it was cached
+                    print(f"🔄 Network of patient {patient_id} changed in another process, reloading")
+                    network = None
+            if network is None:
+                network = self._load(patient_id, language, analyzer_version)
+                self._networks[key] = network
+                while len(self._networks) > self.max_networks:
+                    self._networks.popitem(last=False)
+            self._networks.move_to_end(key)
+            return network
+
+    def _load(self, patient_id: str, language: str, analyzer_version: str) -> PatientNetwork:
+        network = PatientNetwork(patient_id, language)
+        with self._connect() as conn:
+            stale = conn.execute(
+                "SELECT session_id FROM network_sessions WHERE patient_id = ? AND language = ? "
+                "AND analyzer_version != ?", (patient_id, language, analyzer_version)
+            ).fetchall()
+            for (session_id,) in stale:
+                self._delete_rows(conn, patient_id, language, session_id)
+            if stale:
+                self._bump_revision(conn, patient_id, language)
+                print(f"🧹 Dropped {len(stale)} network sessions of patient {patient_id} from an older analyzer")
+            network.stored_revision = self._stored_revision(conn, patient_id, language)
+            sessions = conn.execute(
+                "SELECT session_id, content_hash, session_date FROM network_sessions "
+                "WHERE patient_id = ? AND language = ?", (patient_id, language)
+            ).fetchall()
+            edges: Dict[str, List[TypedEdge]] = {}
+            for session_id, source, target, edge_type in conn.execute(
+                "SELECT session_id, source, target, edge_type FROM network_edges WHERE patient_id = ? AND language = ?",
+                (patient_id, language)
+            ):
+                edges.setdefault(session_id, []).append((source, target, edge_type))
+        for session_id, digest, session_date in sessions:
+            network.add_session(session_id, edges.get(session_id, []),
+                                {'content_hash': digest, 'session_date': session_date})
+        return network
+
+    @staticmethod
+    def _delete_rows(conn, patient_id: str, language: str, session_id: str):
+        conn.execute("DELETE FROM network_edges WHERE patient_id = ? AND language = ? AND session_id = ?",
+                     (patient_id, language, session_id))
+        conn.execute("DELETE FROM network_sessions WHERE patient_id = ? AND language = ? AND session_id = ?",
+                     (patient_id, language, session_id))
+
+    def has_session(self, patient_id: str, language: str, session_id: str, content_hash: str,
+                    analyzer_version: str) -> bool:
+        info = self.get(patient_id, language, analyzer_version).sessions.get(session_id)
+        return info is not None and info.get('content_hash') == content_hash
+
+    def add_session(self, patient_id: str, language: str, session_id: str, edges: List[TypedEdge],
+                    analyzer_version: str, content_hash: Optional[str] = None,
+                    session_date: Optional[str] = None) -> PatientNetwork:
+        """Merge one session's network into the patient network (replacing a previous version of it)"""
+        with self._lock:
+            network = self.get(patient_id, language, analyzer_version)
+            with self._connect() as conn:
+                self._delete_rows(conn, patient_id, language, session_id)
+                conn.execute(
+                    "INSERT INTO network_sessions (patient_id, language, session_id, content_hash, session_date, "
+                    "analyzer_version, edge_count, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (patient_id, language, session_id, content_hash, session_date, analyzer_version,
+                     len(edges), datetime.now().isoformat())
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO network_edges (patient_id, language, session_id, source, target, edge_type) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(patient_id, language, session_id, a, b, t) for a, b, t in edges]
+                )
+                stored = self._bump_revision(conn, patient_id, language)
+            if stored != network.stored_revision + 1:
+                # Another process wrote in between: reload rather than patch a stale copy
+                network.stored_revision = -1
+                return self.get(patient_id, language, analyzer_version)
+            network.add_session(session_id, edges, {'content_hash': content_hash, 'session_date': session_date})
+            network.stored_revision = stored
+            return network
+
+    def remove_session(self, patient_id: str, language: str, session_id: str, analyzer_version: str) -> bool:
+        with self._lock:
+            network = self.get(patient_id, language, analyzer_version)
+            with self._connect() as conn:
+                self._delete_rows(conn, patient_id, language, session_id)
+                stored = self._bump_revision(conn, patient_id, language)
+            existed = session_id in network.sessions
+            if stored != network.stored_revision + 1:
+                network.stored_revision = -1
+                self.get(patient_id, language, analyzer_version)
+                return existed
+            network.remove_session(session_id)
+            network.stored_revision = stored
+            return existed
+
+
+patient_network_store = PatientNetworkStore()
@@ -0,0 +1,265 @@
+"""Opt-in per-request profiling for the analysis service.
+
+A request is profiled only when it carries the ``X-Profile`` header or the
+``profile`` query flag. Unflagged requests go straight through to the app,
+so they pay nothing beyond a header lookup.
+
+Profiles expose function names and source paths, so profiling is off unless
+``PROFILING_ENABLED`` is set, and both profiling a request and reading the
+stored profiles require the ``X-Debug-Token`` header to match ``DEBUG_TOKEN``.
+Without a configured token nothing is profiled or served.
+"""
+import hmac
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/python-service-profiles")
+MAX_STORED_PROFILES = int(os.getenv("MAX_STORED_PROFILES", "20"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+# Admin token for profiling and the profile debug routes; unset means nobody
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """Collects cProfile data for one request, across every thread it runs on"""
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now().isoformat()
+        self.wall_time = 0.0
+        self.artifact_path: Optional[str] = None
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def thread_scope(self):
+        """Profile the calling thread for the duration of the block"""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiles.append(profiler)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        return stats
+
+    def summary(self, top_n: int = PROFILE_TOP_N) -> Dict:
+        """Top functions by cumulative time, in a JSON-friendly shape"""
+        stats = self.stats()
+        top_functions = []
+        if stats is not None:
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            for (filename, line, function), (_, ncalls, tottime, cumtime, _) in rows[:top_n]:
+                top_functions.append({
+                    "function": f"{os.path.basename(filename)}:{line}({function})",
+                    "ncalls": ncalls,
+                    "tottime": round(tottime, 6),
+                    "cumtime": round(cumtime, 6)
+                })
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "wall_time": round(self.wall_time, 6),
+            "artifact_available": self.artifact_path is not None,
+            "top_cumulative": top_functions
+        }
+
+    def dump(self, directory: str = PROFILE_DIR) -> Optional[str]:
+        """Write the merged pstats file so it can be fetched later"""
+        stats = self.stats()
+        if stats is None:
+            return None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.profile_id}.prof")
+            stats.dump_stats(path)
+            self.artifact_path = path
+        except OSError as e:
+            print(f"⚠️ Could not save profile {self.profile_id}: {e}")
+        return self.artifact_path
+
+
+class ProfileStore:
+    """Keeps the most recent profiles in memory; older artifacts are deleted"""
+
+    def __init__(self, max_profiles: int = MAX_STORED_PROFILES):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles[profile.profile_id] = profile
+            while len(self._profiles) > self.max_profiles:
+                _, evicted = self._profiles.popitem(last=False)
+                if evicted.artifact_path and os.path.exists(evicted.artifact_path):
+                    try:
+                        os.remove(evicted.artifact_path)
+                    except OSError:
+                        pass
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [
+            {
+                "profile_id": p.profile_id,
+                "method": p.method,
+                "path": p.path,
+                "started_at": p.started_at,
+                "wall_time": round(p.wall_time, 6)
+            }
+            for p in reversed(profiles)
+        ]
+
+
+profile_store = ProfileStore()
+
+# cProfile hooks are per thread and the event loop runs on a single one,
+# so only one request at a time can profile the loop thread.
+_loop_profiler_lock = threading.Lock()
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+@contextmanager
+def profile_current_thread():
+    """Profile the calling thread if the current request asked for it; no-op otherwise"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.thread_scope():
+        yield
+
+
+def debug_token_valid(token: Optional[str]) -> bool:
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+
+def _scope_debug_token(scope: Dict) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-debug-token":
+            return value.decode("latin-1").strip()
+    return None
+
+
+def profiling_requested(scope: Dict) -> bool:
+    if not debug_token_valid(_scope_debug_token(scope)):
+        return False
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile":
+            return value.decode("latin-1").strip().lower() in _TRUE_VALUES
+    query_string = scope.get("query_string", b"")
+    if query_string and b"profile" in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get("profile", [])
+        return any(v.strip().lower() in _TRUE_VALUES or v == "" for v in values)
+    return False
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware that profiles flagged requests.
+
+    The handler is profiled with cProfile; the top cumulative functions are
+    added to JSON object responses under ``profile`` and the full pstats
+    artifact is kept for ``/debug/profiles/{profile_id}``.
+    """
+
+    def __init__(self, app, enabled: bool = PROFILING_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not profiling_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get("method", ""), scope.get("path", ""))
+        token = _current_profile.set(profile)
+        messages = []
+
+        async def buffered_send(message):
+            messages.append(message)
+
+        start = time.perf_counter()
+        loop_profiled = _loop_profiler_lock.acquire(blocking=False)
+        try:
+            if loop_profiled:
+                with profile.thread_scope():
+                    await self.app(scope, receive, buffered_send)
+            else:
+                print(f"⚠️ Profiler busy, loop thread of {profile.path} not profiled")
+                await self.app(scope, receive, buffered_send)
+        finally:
+            if loop_profiled:
+                _loop_profiler_lock.release()
+            _current_profile.reset(token)
+            profile.wall_time = time.perf_counter() - start
+
+        profile.dump()
+        profile_store.add(profile)
+        print(f"🔬 Profiled {profile.method} {profile.path} in {profile.wall_time:.2f}s (id: {profile.profile_id})")
+
+        for message in self._attach_summary(messages, profile):
+            await send(message)
+
+    def _attach_summary(self, messages: List[Dict], profile: RequestProfile) -> List[Dict]:
+        start = next((m for m in messages if m["type"] == "http.response.start"), None)
+        if start is None:
+            return messages
+
+        headers = [(k, v) for k, v in start.get("headers", []) if k.lower() != b"content-length"]
+        headers.append((b"x-profile-id", profile.profile_id.encode("latin-1")))
+        content_type = dict((k.lower(), v) for k, v in headers).get(b"content-type", b"")
+        body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+
+        if content_type.startswith(b"application/json"):
+            try:
+                payload = json.loads(body)
+                if isinstance(payload, dict):
+                    payload["profile"] = profile.summary()
+                    body = json.dumps(payload).encode("utf-8")
+            except ValueError:
+                pass
+
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        return [
+            {**start, "headers": headers},
+            {"type": "http.response.body", "body": body, "more_body": False}
+        ]
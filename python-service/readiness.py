@@ -0,0 +1,114 @@
+"""Cached readiness state for the analysis service.
+
+The EmoAtlas self-test runs on a schedule in a background task; probes only
+read the last cached result, so they never do analysis work themselves.
+
+A timed-out self-test can't be stopped: its thread keeps running. While it
+does, no new self-test is started (a wedged model would otherwise take one
+more executor thread per check until analyses starve) and the checks report
+``timeout`` from the in-flight one.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+READINESS_INTERVAL_SECONDS = float(os.getenv("READINESS_INTERVAL_SECONDS", "300"))
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "60"))
+
+
+class ReadinessMonitor:
+    def __init__(self, self_test: Callable[[], Dict], model_state: Callable[[], Dict],
+                 interval: float = READINESS_INTERVAL_SECONDS, timeout: float = READINESS_TIMEOUT_SECONDS):
+        self.self_test = self_test
+        self.model_state = model_state
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Self-test thread still running from an earlier check, and when it started
+        self._inflight: Optional[asyncio.Future] = None
+        self._inflight_started = 0.0
+        self._state = {
+            "ready": False,
+            "status": "starting",
+            "last_check": None,
+            "last_duration": None,
+            "last_error": None,
+            "last_result": None,
+            "consecutive_failures": 0,
+            "checks_run": 0
+        }
+
+    def snapshot(self) -> Dict:
+        """Return the cached readiness state (no analysis is run here)"""
+        with self._lock:
+            state = dict(self._state)
+        state["models"] = self.model_state()
+        return state
+
+    @staticmethod
+    def _discard(future: asyncio.Future):
+        # Outcome of a self-test nobody waits for any more
+        if not future.cancelled():
+            future.exception()
+
+    async def check_once(self):
+        started = time.perf_counter()
+        timed_out = False
+        if self._inflight is not None and not self._inflight.done():
+            result, timed_out = None, True
+            error = f"self-test still running after {started - self._inflight_started:.0f}s, not restarted"
+        else:
+            self._inflight = asyncio.ensure_future(asyncio.to_thread(self.self_test))
+            self._inflight.add_done_callback(self._discard)
+            self._inflight_started = started
+            try:
+                # Shielded: on timeout the thread keeps running and stays the in-flight self-test
+                result = await asyncio.wait_for(asyncio.shield(self._inflight), timeout=self.timeout)
+                error = None
+            except asyncio.TimeoutError:
+                result, error, timed_out = None, f"self-test timed out after {self.timeout:.0f}s", True
+            except Exception as e:
+                result, error = None, str(e)
+        duration = time.perf_counter() - started
+
+        with self._lock:
+            self._state["checks_run"] += 1
+            self._state["last_check"] = datetime.now().isoformat()
+            self._state["last_duration"] = round(duration, 3)
+            self._state["last_result"] = result
+            self._state["last_error"] = error
+            if error is None:
+                self._state["ready"] = True
+                self._state["status"] = "ready"
+                self._state["consecutive_failures"] = 0
+            else:
+                self._state["ready"] = False
+                self._state["status"] = "timeout" if timed_out else "failed"
+                self._state["consecutive_failures"] += 1
+
+        if error is None:
+            print(f"✅ Readiness self-test passed in {duration:.2f}s")
+        else:
+            print(f"❌ Readiness self-test failed: {error}")
+
+    async def run_forever(self):
+        while True:
+            await self.check_once()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
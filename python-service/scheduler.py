@@ -0,0 +1,250 @@
+"""Fair-share admission control in front of the blocking analysis executors.
+
+At most ``SCHEDULER_CONCURRENCY`` analyses run at once per worker process;
+the rest wait in bounded per-endpoint queues. Waiting requests are granted
+by weighted fair queuing across users (``X-User-Id``, else the client
+address): each request gets a virtual finish tag ``max(V, user's last
+finish) + cost / weight``, and the smallest tag runs next. A therapist who
+submits a dozen long analyses therefore interleaves with everyone else
+instead of going first. When an endpoint's queue is full the request is
+rejected at once (``SchedulerBusy`` → 429 with ``Retry-After``) rather than
+piling up. A waiting request whose ``CancelToken`` is cancelled (client gone,
+deadline passed) leaves the queue at once with ``AnalysisCancelled``.
+
+Queue depth, wait times and rejections are exposed by ``stats()``.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from cancellation import AnalysisCancelled, CancelToken
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "2"))
+SCHEDULER_QUEUE_LIMIT = int(os.getenv("SCHEDULER_QUEUE_LIMIT", "32"))
+# Comma-separated "user=weight" pairs; everyone else weighs 1
+SCHEDULER_USER_WEIGHTS = os.getenv("SCHEDULER_USER_WEIGHTS", "")
+# Wait and service time samples kept per queue for the percentiles
+_SAMPLES = 256
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        user, _, weight = item.partition("=")
+        try:
+            if user.strip() and float(weight) > 0:
+                weights[user.strip()] = float(weight)
+        except ValueError:
+            print(f"⚠️ Ignoring scheduler weight '{item}'")
+    return weights
+
+
+def queue_limit(queue: str) -> int:
+    """``SCHEDULER_QUEUE_LIMIT_<QUEUE>`` (e.g. ``..._SEMANTIC_FRAME``), else ``SCHEDULER_QUEUE_LIMIT``"""
+    name = queue.upper().replace("-", "_")
+    return int(os.getenv(f"SCHEDULER_QUEUE_LIMIT_{name}", str(SCHEDULER_QUEUE_LIMIT)))
+
+
+class SchedulerBusy(Exception):
+    def __init__(self, queue: str, retry_after: int):
+        super().__init__(f"Too many {queue} requests queued, retry in {retry_after}s")
+        self.queue = queue
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("queue", "user", "start", "finish", "seq", "granted", "enqueued_at")
+
+    def __init__(self, queue: str, user: str, start: float, finish: float, seq: int, granted: asyncio.Future):
+        self.queue = queue
+        self.user = user
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.granted = granted
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+
+class _QueueStats:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.depth = 0
+        self.max_depth = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.completed = 0
+        self.waits = deque(maxlen=_SAMPLES)
+        self.services = deque(maxlen=_SAMPLES)
+
+    def summary(self) -> Dict:
+        waits = sorted(self.waits)
+        return {
+            "limit": self.limit,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "running": self.running,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "wait_mean_s": round(sum(waits) / len(waits), 4) if waits else 0.0,
+            "wait_p95_s": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 4) if waits else 0.0,
+            "wait_max_s": round(waits[-1], 4) if waits else 0.0,
+            "service_mean_s": round(self.mean_service(), 4)
+        }
+
+    def mean_service(self) -> float:
+        return sum(self.services) / len(self.services) if self.services else 1.0
+
+
+class FairScheduler:
+    """Weighted fair queuing of blocking analyses across users, one instance per process (event loop side)"""
+
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY, weights: Optional[Dict[str, float]] = None):
+        self.concurrency = max(concurrency, 1)
+        self.weights = weights if weights is not None else _parse_weights(SCHEDULER_USER_WEIGHTS)
+        self._heap: List[_Ticket] = []
+        self._running = 0
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._queues: Dict[str, _QueueStats] = {}
+        self._users: Dict[str, Dict[str, int]] = {}
+
+    def _queue(self, name: str) -> _QueueStats:
+        stats = self._queues.get(name)
+        if stats is None:
+            stats = self._queues[name] = _QueueStats(queue_limit(name))
+        return stats
+
+    def _user(self, user: str) -> Dict[str, int]:
+        return self._users.setdefault(user, {"queued": 0, "running": 0, "served": 0, "rejected": 0})
+
+    def idle(self) -> bool:
+        """A free slot and nobody waiting: background work may start without delaying anyone"""
+        return self._running < self.concurrency and not self._heap
+
+    def retry_after(self, queue: str) -> int:
+        """Seconds until the queue has likely drained enough to admit one more request"""
+        stats = self._queue(queue)
+        return max(1, math.ceil((stats.depth + 1) * stats.mean_service() / self.concurrency))
+
+    async def run(self, queue: str, user: str, func: Callable[[], Awaitable], cost: float = 1.0,
+                  token: Optional[CancelToken] = None):
+        """Await ``func()`` once admitted and granted a slot; raises ``SchedulerBusy`` when the queue is full"""
+        stats = self._queue(queue)
+        if token is not None:
+            token.check("queued")
+        if self._running < self.concurrency and not self._heap:
+            # Idle: run immediately, but still advance the virtual clocks
+            start, _ = self._tag(user, cost)
+            self._virtual_time = max(self._virtual_time, start)
+            self._running += 1
+            wait = 0.0
+        else:
+            if stats.depth >= stats.limit:
+                stats.rejected += 1
+                self._user(user)["rejected"] += 1
+                raise SchedulerBusy(queue, self.retry_after(queue))
+            ticket = _Ticket(queue, user, *self._tag(user, cost), next(self._seq),
+                             asyncio.get_running_loop().create_future())
+            heapq.heappush(self._heap, ticket)
+            stats.depth += 1
+            stats.max_depth = max(stats.max_depth, stats.depth)
+            self._user(user)["queued"] += 1
+            drop = None
+            if token is not None:
+                # Cancellation may come from a worker thread (a checkpoint past the deadline)
+                loop = asyncio.get_running_loop()
+                drop = lambda: loop.call_soon_threadsafe(self._drop, ticket)
+                token.add_callback(drop)
+            try:
+                # _dispatch reserves the slot before granting it
+                await ticket.granted
+            except asyncio.CancelledError:
+                if ticket.granted.done() and not ticket.granted.cancelled():
+                    # Granted just as the caller went away: hand the slot on
+                    self._release()
+                else:
+                    ticket.granted.cancel()
+                    stats.depth -= 1
+                    self._user(user)["queued"] -= 1
+                if token is not None and token.cancelled:
+                    stats.dropped += 1
+                    raise AnalysisCancelled(token.reason, "queued") from None
+                raise
+            finally:
+                if drop is not None:
+                    token.remove_callback(drop)
+            wait = time.perf_counter() - ticket.enqueued_at
+
+        stats.admitted += 1
+        stats.waits.append(wait)
+        stats.running += 1
+        self._user(user)["running"] += 1
+        start = time.perf_counter()
+        try:
+            return await func()
+        finally:
+            stats.services.append(time.perf_counter() - start)
+            stats.running -= 1
+            stats.completed += 1
+            user_stats = self._user(user)
+            user_stats["running"] -= 1
+            user_stats["served"] += 1
+            self._release()
+
+    def _drop(self, ticket: _Ticket):
+        """Withdraw a waiting request whose token was cancelled"""
+        if not ticket.granted.done():
+            ticket.granted.cancel()
+
+    def _tag(self, user: str, cost: float) -> Tuple[float, float]:
+        """Virtual start and finish tags of a new request"""
+        start = max(self._virtual_time, self._last_finish.get(user, 0.0))
+        finish = start + max(cost, 0.01) / self.weights.get(user, 1.0)
+        self._last_finish[user] = finish
+        return start, finish
+
+    def _release(self):
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.concurrency and self._heap:
+            ticket = heapq.heappop(self._heap)
+            if ticket.granted.cancelled():
+                continue
+            # Virtual time follows the start tag of the request in service
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            stats = self._queue(ticket.queue)
+            stats.depth -= 1
+            self._user(ticket.user)["queued"] -= 1
+            self._running += 1
+            ticket.granted.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "queued": sum(q.depth for q in self._queues.values()),
+            "virtual_time": round(self._virtual_time, 4),
+            "queues": {name: stats.summary() for name, stats in self._queues.items()},
+            "users": {user: dict(counts) for user, counts in self._users.items()
+                      if counts["queued"] or counts["running"] or counts["served"] or counts["rejected"]}
+        }
+
+
+analysis_scheduler = FairScheduler()
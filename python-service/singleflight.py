@@ -0,0 +1,70 @@
+"""Single-flight coalescing of identical concurrent requests.
+
+Requests are keyed by a hash of their canonical JSON body. While a
+computation for a key is in flight, identical requests await the same task
+instead of starting their own, and all of them receive its result. The task
+is shielded, so a caller that disconnects doesn't cancel it for the others;
+the computation's ``CancelToken`` (see ``cancellation``) is shared instead,
+and abandons the work only once every caller is gone.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from cancellation import CancelToken
+
+
+def request_key(payload: Any) -> str:
+    """SHA-256 of the canonical JSON form (sorted keys, no whitespace) of a request body"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+        self._waiters: Dict[str, int] = {}
+        self._tokens: Dict[str, CancelToken] = {}
+
+    def token(self, key: str) -> Optional[CancelToken]:
+        """Cancel token of the in-flight computation for ``key``, if any"""
+        return self._tokens.get(key)
+
+    async def do(self, key: str, func: Callable[[], Awaitable], token: Optional[CancelToken] = None):
+        """Await the in-flight computation for ``key``, starting it (with ``token``) if there is none"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            if token is not None:
+                self._tokens[key] = token
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            self.coalesced += 1
+            print(f"🔗 Coalesced identical {self.name} request ({key[:12]})")
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        self.max_waiters = max(self.max_waiters, self._waiters[key])
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        self._waiters.pop(key, None)
+        self._tokens.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "max_waiters": self.max_waiters
+        }
@@ -0,0 +1,200 @@
+"""Serialized warm state of the EmoAtlas analyzers.
+
+At image build time ``python snapshot.py build`` constructs a fully initialized
+``EmoScores`` per language and writes everything except the spaCy pipeline
+(lexicon, idiomatic tokens, emojis, antonyms, baseline distribution and the
+z-score lookup table) to ``warm_state/<language>.snapshot``.
+
+At runtime the file is read and unpickled in one go, so an analyzer is
+assembled without re-reading and re-deriving the EmoAtlas resources from
+their many source files. This only makes the load faster: the unpickled
+state lives in each process's private heap and nothing is shared between
+workers (the lexicon and null-model arrays that are shared live in
+``lexicon_arrays.py``). Loading the spaCy pipeline, the larger part of a
+cold start, is not affected. A header records the EmoAtlas version: when it
+no longer matches the installed one the snapshot is rebuilt.
+"""
+import argparse
+import functools
+import json
+import os
+import pickle
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_MAGIC = b"EMOSNAP\n"
+SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_state")
+)
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# The spaCy pipeline is reloaded at runtime, never pickled
+_RUNTIME_ATTRIBUTES = ("_tagger",)
+
+
+def snapshot_path(language: str, directory: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(directory, f"{language}.snapshot")
+
+
+def _emoatlas_version() -> str:
+    import emoatlas
+    return getattr(emoatlas, "__version__", "unknown")
+
+
+@functools.lru_cache(maxsize=None)
+def _package_lookup_table(language: str) -> Dict:
+    """EmoAtlas ships precomputed z-score baselines but looks for them relative to the cwd.
+
+    The one null model of the service, whichever way an analyzer is built:
+    callers that may add to it take a copy.
+    """
+    import emoatlas
+    path = os.path.join(emoatlas.__path__[0], "baseline_tables", f"{language}_baseline.dict")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError):
+        return {}
+
+
+def _spacy_model_name(tagger) -> Optional[str]:
+    meta = getattr(tagger, "meta", None) or {}
+    if meta.get("lang") and meta.get("name"):
+        return f"{meta['lang']}_{meta['name']}"
+    return None
+
+
+def build_snapshot(language: str, directory: str = SNAPSHOT_DIR) -> Tuple[Dict, Dict]:
+    """Initialize an analyzer the slow way and write its state to disk"""
+    from emoatlas import EmoScores
+    from nlp_registry import model_for_language, nlp_registry
+
+    start = time.perf_counter()
+    model = model_for_language(language)
+    emo = EmoScores(language=language, spacy_model=model)
+    # Built at runtime (stale snapshot): keep the pipeline instead of loading it again
+    nlp_registry.adopt(model, emo._tagger)
+    state = {k: v for k, v in vars(emo).items() if k not in _RUNTIME_ATTRIBUTES}
+    state["_lookup"] = dict(_package_lookup_table(language))
+
+    header = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "emoatlas_version": _emoatlas_version(),
+        "language": language,
+        "spacy_model": model,
+        "attributes": sorted(list(state.keys()) + list(_RUNTIME_ATTRIBUTES)),
+        "lookup_entries": len(state["_lookup"]),
+        "created_at": datetime.now().isoformat()
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(language, directory)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    print(f"📦 Snapshot for '{language}' written to {path} "
+          f"({os.path.getsize(path) / 1024:.0f} KB, {time.perf_counter() - start:.2f}s)")
+    return header, state
+
+
+def read_snapshot(language: str, directory: str = SNAPSHOT_DIR) -> Optional[Tuple[Dict, Dict]]:
+    """Read a snapshot and unpickle its state; None if missing or corrupt"""
+    path = snapshot_path(language, directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                print(f"⚠️ {path} is not an EmoAtlas snapshot")
+                return None
+            header = json.loads(f.readline())
+            state = pickle.load(f)
+        return header, state
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        print(f"⚠️ Could not read snapshot {path}: {e}")
+        return None
+
+
+def is_current(header: Dict) -> bool:
+    return (
+        header.get("format_version") == SNAPSHOT_FORMAT_VERSION
+        and header.get("emoatlas_version") == _emoatlas_version()
+    )
+
+
+def load_state(language: str, directory: str = SNAPSHOT_DIR) -> Tuple[Dict, Dict]:
+    """Load the warm state for a language, rebuilding the snapshot when it is missing or stale"""
+    snapshot = read_snapshot(language, directory)
+    if snapshot is not None and is_current(snapshot[0]):
+        return snapshot
+    if snapshot is not None:
+        print(f"🔄 Snapshot for '{language}' built with EmoAtlas {snapshot[0].get('emoatlas_version')}, "
+              f"installed {_emoatlas_version()}: rebuilding")
+    try:
+        return build_snapshot(language, directory)
+    except OSError as e:
+        # Read-only filesystem: build in memory only
+        print(f"⚠️ Could not write snapshot for '{language}': {e}")
+        from emoatlas import EmoScores
+        emo = EmoScores(language=language)
+        state = {k: v for k, v in vars(emo).items() if k not in _RUNTIME_ATTRIBUTES}
+        state["_lookup"] = dict(_package_lookup_table(language))
+        return {"spacy_model": _spacy_model_name(emo._tagger)}, state
+
+
+def assemble_emoscores(state: Dict, tagger):
+    """Build an EmoScores from a snapshot state and a loaded spaCy pipeline, skipping __init__"""
+    from emoatlas import EmoScores
+
+    emo = EmoScores.__new__(EmoScores)
+    for name, value in state.items():
+        setattr(emo, name, value)
+    # Each analyzer mutates its lookup table as new word counts are sampled
+    emo._lookup = dict(state.get("_lookup") or {})
+    emo._tagger = tagger
+    return emo
+
+
+def load_emoscores(language: str, directory: str = SNAPSHOT_DIR):
+    """EmoScores for a language assembled from its snapshot, on the shared spaCy pipeline"""
+    from nlp_registry import model_for_language, nlp_registry
+
+    header, state = load_state(language, directory)
+    model = model_for_language(language, header.get("spacy_model"))
+    try:
+        tagger = nlp_registry.task(model, "network")
+    except OSError:
+        tagger = nlp_registry.task(model_for_language(language), "network")
+    return assemble_emoscores(state, tagger)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect EmoAtlas warm-state snapshots')
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--languages', type=str, default='italian', help='Comma-separated languages')
+    parser.add_argument('--dir', type=str, default=SNAPSHOT_DIR, help='Snapshot directory')
+    args = parser.parse_args()
+
+    languages = [l.strip() for l in args.languages.split(',') if l.strip()]
+    for language in languages:
+        if args.command == 'build':
+            build_snapshot(language, args.dir)
+        else:
+            snapshot = read_snapshot(language, args.dir)
+            if snapshot is None:
+                print(f"❌ No snapshot for '{language}' in {args.dir}")
+                sys.exit(1)
+            header = snapshot[0]
+            print(json.dumps({**header, "current": is_current(header)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
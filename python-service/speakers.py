@@ -0,0 +1,94 @@
+"""Speaker-separated emotion analysis for diarized transcripts.
+
+Diarized transcripts carry ``Paziente:`` / ``Terapeuta:`` turns (the same
+labels the frontend highlights). Every turn of every session in a request is
+lemmatized in a single batched ``nlp.pipe`` pass; per-speaker vectors and
+arcs are then derived from the concatenated turn word lists, and the whole
+session vector from all turns together, so no text is parsed twice.
+"""
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from emotion_stats import emotional_arc, load_wordlists, summarize_zscores, wordlist_zscores
+
+PATIENT = 'patient'
+THERAPIST = 'therapist'
+
+SPEAKER_ROLES = {
+    'paziente': PATIENT,
+    'patient': PATIENT,
+    'terapeuta': THERAPIST,
+    'therapist': THERAPIST,
+}
+
+_SPEAKER_LABEL_RE = re.compile(r'(?i)\b(paziente|patient|terapeuta|therapist)\s*:')
+
+Segment = Tuple[str, str]
+
+
+def normalize_speaker(label: str) -> str:
+    """Map a diarization label to 'patient' / 'therapist'; other labels are kept as-is"""
+    key = label.strip().rstrip(':').strip().lower()
+    return SPEAKER_ROLES.get(key, key or 'unknown')
+
+
+def split_speaker_turns(transcript: str) -> List[Segment]:
+    """Split a labelled transcript into (speaker, text) turns; text before the first label is 'unknown'"""
+    segments = []
+    matches = list(_SPEAKER_LABEL_RE.finditer(transcript))
+    head = transcript[:matches[0].start()] if matches else transcript
+    if head.strip():
+        segments.append(('unknown', head.strip()))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(transcript)
+        text = transcript[match.end():end].strip()
+        if text:
+            segments.append((normalize_speaker(match.group(1)), text))
+    return segments
+
+
+def analyze_speaker_sessions(emo, sessions: Sequence[Sequence[Segment]],
+                             arc: Optional[Tuple[int, int]] = None) -> List[Dict]:
+    """Per-session and per-speaker statistics for many sessions from one batched spaCy pass.
+
+    Returns, for each session, the word list of all turns (for the session vector)
+    and a ``speakers`` dict with z-scores, valence, token counts and optionally the arc.
+    """
+    texts = [text for segments in sessions for _, text in segments]
+    wordlists = iter(load_wordlists(emo, texts))
+
+    results = []
+    for segments in sessions:
+        by_speaker: Dict[str, List[str]] = {}
+        turns: Dict[str, int] = {}
+        session_words: List[str] = []
+        for speaker, _ in segments:
+            words = next(wordlists)
+            by_speaker.setdefault(speaker, []).extend(words)
+            turns[speaker] = turns.get(speaker, 0) + 1
+            session_words.extend(words)
+
+        speakers = {}
+        for speaker, words in by_speaker.items():
+            stats = summarize_zscores(wordlist_zscores(emo, words))
+            stats['token_count'] = len(words)
+            stats['turn_count'] = turns[speaker]
+            if arc is not None:
+                stats['emotional_arc'] = emotional_arc(emo, words, window=arc[0], stride=arc[1])
+            speakers[speaker] = stats
+        results.append({'wordlist': session_words, 'speakers': speakers})
+    return results
+
+
+def speaker_trends(session_speakers: Sequence[Tuple[str, Dict]]) -> Dict:
+    """Per-speaker series across sessions: {speaker: [{session_id, z_scores, emotional_valence}]}"""
+    trends: Dict[str, List[Dict]] = {}
+    for session_id, speakers in session_speakers:
+        for speaker, stats in speakers.items():
+            trends.setdefault(speaker, []).append({
+                'session_id': session_id,
+                'z_scores': stats['z_scores'],
+                'emotional_valence': stats['emotional_valence'],
+                'token_count': stats['token_count']
+            })
+    return trends
@@ -58,6 +58,9 @@ echo 📊 Service will be available for single-document analysis
 echo ⏹️  Press Ctrl+C to stop the service
 echo.
 
+REM Background jobs run in their own process next to the API
+start "job worker" /b %PYTHON_EXE% job_worker.py
+
 %PYTHON_EXE% main.py
 
 pause
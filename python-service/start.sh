@@ -32,4 +32,9 @@ echo "📊 Service will be available for topic modeling, sentiment and semantic
 echo "⏹️  Press Ctrl+C to stop the service"
 echo ""
 
+# Background jobs run in their own service, stopped together with the API
+python job_worker.py &
+JOB_WORKER_PID=$!
+trap 'kill $JOB_WORKER_PID 2>/dev/null' EXIT
+
 python main.py
@@ -0,0 +1,178 @@
+"""Emotion trends of long patient histories, downsampled on the server.
+
+Works on the column arrays of ``AnalysisStore.load_series`` (one row per
+stored session, in date order). Averages, extremes, the summary and the
+combined analysis are reductions over all sessions in the range; only the
+charted series are downsampled to at most ``points`` points, either with
+Largest-Triangle-Three-Buckets (``lttb``: keeps the sessions that shape the
+curve, first and last included, each series on its own) or with equal-count
+bucket means (``mean``: one shared x axis, every session counted). The
+response size depends on ``points``, not on how many sessions were stored.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from emotion_stats import EMOTIONS
+
+DOWNSAMPLING_METHODS = ("lttb", "mean")
+TRENDS_MAX_POINTS = int(os.getenv("TRENDS_MAX_POINTS", "1000"))
+# Sessions per page of individual_sessions (default and upper bound)
+TRENDS_PAGE_SIZE = int(os.getenv("TRENDS_PAGE_SIZE", "50"))
+TRENDS_MAX_PAGE_SIZE = int(os.getenv("TRENDS_MAX_PAGE_SIZE", "200"))
+SIGNIFICANCE_THRESHOLD = 1.96
+
+
+def date_days(dates: np.ndarray) -> Optional[np.ndarray]:
+    """Days since the epoch of each session date; None if any date is missing or doesn't parse"""
+    try:
+        days = np.array([(d or '')[:10] for d in dates], dtype="datetime64[D]")
+    except ValueError:
+        return None
+    # Empty dates (allowed by the pager) parse as NaT
+    if np.isnat(days).any():
+        return None
+    return days.astype(np.float64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Indices of the ``points`` samples LTTB keeps (all of them when there are fewer)"""
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1][:max(points, 1)])
+    # points - 2 buckets between the fixed first and last samples
+    edges = np.append(np.floor(np.arange(points - 1) * (n - 2) / (points - 2)).astype(int) + 1, n)
+    selected = np.empty(points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def bucket_bounds(n: int, points: int) -> np.ndarray:
+    """Start offsets of ``min(points, n)`` equal-count buckets"""
+    return np.linspace(0, n, min(points, n) + 1).astype(int)[:-1]
+
+
+def _round(values: np.ndarray, digits: int = 4) -> List:
+    return np.round(values, digits).tolist()
+
+
+def _charted(series: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    charted = {emotion: series['z_scores'][:, i] for i, emotion in enumerate(EMOTIONS)}
+    charted['emotional_valence'] = series['emotional_valence']
+    return charted
+
+
+def downsample(series: Dict[str, np.ndarray], points: Optional[int], method: str = "lttb") -> Dict[str, Dict]:
+    """Charted series (each emotion and the valence): ``{name: {'dates', 'values', ...}}``"""
+    dates = series['session_dates']
+    ids = series['session_ids']
+    n = len(dates)
+    points = n if not points else points
+    charted = _charted(series)
+    days = date_days(dates)
+    # Undated sessions are spaced evenly
+    x = days if days is not None else np.arange(n, dtype=np.float64)
+    if method == "mean" and points < n:
+        bounds = bucket_bounds(n, points)
+        counts = np.diff(np.append(bounds, n))
+        if days is not None:
+            # Each bucket sits at the mean date of its sessions
+            bucket_dates = [str(np.datetime64(int(round(v)), 'D')) for v in np.add.reduceat(days, bounds) / counts]
+        else:
+            bucket_dates = [dates[start] for start in bounds]
+        shared = {
+            'dates': bucket_dates,
+            'date_ranges': [[dates[start], dates[start + count - 1]] for start, count in zip(bounds, counts)],
+            'counts': counts.tolist()
+        }
+        return {name: {**shared, 'values': _round(np.add.reduceat(y, bounds) / counts)}
+                for name, y in charted.items()}
+
+    result = {}
+    for name, y in charted.items():
+        keep = lttb_indices(x, y, points)
+        result[name] = {
+            'dates': [dates[i] for i in keep],
+            'session_ids': [ids[i] for i in keep],
+            'values': _round(y[keep])
+        }
+    return result
+
+
+def _trend(values: np.ndarray) -> str:
+    return 'improving' if values[-1] > values[0] else 'declining'
+
+
+def series_trends(series: Dict[str, np.ndarray], points: Optional[int], method: str = "lttb") -> Dict:
+    """``calculate_emotion_trends`` over all sessions, with the charted values downsampled"""
+    z = series['z_scores']
+    valence = series['emotional_valence']
+    charts = downsample(series, points, method)
+    trends = {}
+    for i, emotion in enumerate(EMOTIONS):
+        trends[emotion] = {
+            **charts[emotion],
+            'average': float(z[:, i].mean()),
+            'min': float(z[:, i].min()),
+            'max': float(z[:, i].max()),
+            'trend': 'stable'
+        }
+    trends['overall'] = {
+        'emotional_valence': {**charts['emotional_valence'], 'average': float(valence.mean()),
+                              'trend': _trend(valence)},
+        'session_count': len(valence),
+        'points': len(charts['emotional_valence']['values']),
+        'method': method
+    }
+    return trends
+
+
+def series_summaries(series: Dict[str, np.ndarray], language: str = 'italian') -> Tuple[Dict, Dict]:
+    """``generate_analysis_summary`` and ``generate_combined_analysis`` as reductions over the arrays"""
+    z = series['z_scores']
+    n = z.shape[0]
+    total_words = int(series['word_count'].sum())
+    valence = float(series['emotional_valence'].mean())
+
+    significant = np.abs(z) >= SIGNIFICANCE_THRESHOLD
+    hits = significant.sum(axis=0)
+    mean_significance = np.where(hits > 0, (np.abs(z) * significant).sum(axis=0) / np.maximum(hits, 1), 0.0)
+    most_significant = sorted(
+        ((emotion, float(mean_significance[i])) for i, emotion in enumerate(EMOTIONS) if hits[i]),
+        key=lambda item: item[1], reverse=True
+    )[:3]
+    summary = {
+        'total_sessions': n,
+        'total_words': total_words,
+        'average_words_per_session': total_words / n,
+        'average_emotional_valence': valence,
+        'most_significant_emotions': most_significant,
+        'analysis_language': language
+    }
+
+    combined_z = {emotion: float(value) for emotion, value in zip(EMOTIONS, z.mean(axis=0))}
+    combined = {
+        'analysis': {
+            'z_scores': combined_z,
+            'significant_emotions': {e: s for e, s in combined_z.items() if abs(s) >= SIGNIFICANCE_THRESHOLD},
+            'dominant_emotions': sorted(combined_z.items(), key=lambda item: abs(item[1]), reverse=True),
+            'emotional_valence': valence,
+            'positive_score': float(series['positive_score'].mean()),
+            'negative_score': float(series['negative_score'].mean()),
+            'text_length': total_words,
+            'language': language
+        }
+    }
+    return summary, combined
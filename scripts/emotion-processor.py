@@ -45,10 +45,14 @@ class EmotionProcessor:
             emotions = self.emo.emotions(text)
             z_scores = self.emo.zscores(text)
             
-            # Generate the emotional flower visualization and save as base64
+            # Draw the emotional flower from the z-scores above instead of re-analyzing the text
             flower_plot_base64 = None
             try:
-                flower_plot = self.emo.draw_statistically_significant_emotions(text)
+                import matplotlib
+                matplotlib.use('Agg')
+                import matplotlib.pyplot as plt
+                flower_plot = plt.figure(figsize=(8, 8))
+                self.emo.draw_plutchik(z_scores, ax=flower_plot.gca(), reject_range=[-1.96, 1.96])
                 if flower_plot:
                     # Save to temporary file and encode as base64
                     with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
@@ -62,6 +66,7 @@ class EmotionProcessor:
                         
                         # Clean up temp file
                         os.unlink(tmp.name)
+                    plt.close(flower_plot)
             except Exception as flower_error:
                 print(f"Warning: Could not generate flower plot: {flower_error}", file=sys.stderr)
             
@@ -284,34 +289,14 @@ class EmotionProcessor:
                 negative_score = sum(frame_emotions.get(e, 0) for e in negative_emotions)
                 emotional_valence = positive_score - negative_score
                 
-                # Get network edges for visualization
-                network_edges = []
-                for edge in frame_network.edges:
-                    try:
-                        # Handle different edge formats
-                        if hasattr(edge, 'v1') and hasattr(edge, 'v2'):
-                            # Object with v1, v2 attributes
-                            source = edge.v1
-                            target = edge.v2
-                            weight = getattr(edge, 'weight', 1.0) if hasattr(edge, 'weight') else 1.0
-                        elif isinstance(edge, tuple) and len(edge) >= 2:
-                            # Tuple format (source, target, [weight])
-                            source = edge[0]
-                            target = edge[1]
-                            weight = edge[2] if len(edge) > 2 else 1.0
-                        else:
-                            # Try to convert to string and parse
-                            print(f"Warning: Unknown edge format: {type(edge)}, value: {edge}", file=sys.stderr)
-                            continue
-                            
-                        network_edges.append({
-                            "source": str(source),
-                            "target": str(target),
-                            "weight": float(weight)
-                        })
-                    except Exception as edge_error:
-                        print(f"Warning: Error processing edge {edge}: {edge_error}", file=sys.stderr)
-                        continue
+                # Get network edges for visualization: EmoAtlas edges are (source, target) pairs,
+                # or per-type lists of pairs for multiplex networks
+                edges = frame_network.edges
+                pairs = [pair for typed in edges.values() for pair in typed] if isinstance(edges, dict) else edges
+                network_edges = [
+                    {"source": str(source), "target": str(target), "weight": 1.0}
+                    for source, target in dict.fromkeys(tuple(pair[:2]) for pair in pairs)
+                ]
                 
             else:
                 # Handle case where target word has no connections
@@ -48,7 +48,7 @@ export async function POST(request: NextRequest) {
     // STEP 3: Fetch sessions with transcripts from database
     const { data: sessions, error: fetchError } = await supabaseAdmin
       .from('sessions')
-      .select('id, title, transcript, createdAt')
+      .select('id, title, transcript, createdAt, patientId')
       .in('id', sessionIds)
       .eq('userId', authResult.user!.id)
       .not('transcript', 'is', null)
@@ -76,7 +76,10 @@ export async function POST(request: NextRequest) {
     console.log(`🔍 About to call EmoAtlas service with ${sessionData.length} sessions`)
     
     try {
-      const analysisResult = await emoatlasService.analyzeEmotions(sessionData, language)
+      // Sessions of a single patient are kept in the service's analysis store
+      const patientIds = new Set(sessions.map(session => session.patientId))
+      const patientId = patientIds.size === 1 ? sessions[0].patientId : undefined
+      const analysisResult = await emoatlasService.analyzeEmotions(sessionData, language, patientId)
       console.log(`🎯 EmoAtlas service response:`, {
         success: analysisResult.success,
         error: analysisResult.error,
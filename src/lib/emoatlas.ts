@@ -1,4 +1,6 @@
 // EmoAtlas Service - TypeScript client for emotion analysis
+import { createHash } from 'crypto'
+
 export interface SessionData {
     id: string
     title: string
@@ -52,11 +54,24 @@ export interface SessionData {
     }
     trends?: Record<string, any>
     summary?: Record<string, any>
+    missing_hashes?: string[]
+  }
+  
+  // Sessions are sent by content hash; the transcript only when the service asks for it
+  export interface SessionReference extends Omit<SessionData, 'transcript'> {
+    transcript?: string
+    content_hash: string
   }
   
   export interface EmotionAnalysisRequest {
-    sessions: SessionData[]
+    sessions: SessionReference[]
     language?: string
+    patient_id?: string  // il servizio salva i vettori emotivi delle sessioni del paziente
+  }
+  
+  // SHA-256 of the UTF-8 text, same as content_hash() in python-service/document.py
+  export function contentHash(text: string): string {
+    return createHash('sha256').update(text, 'utf8').digest('hex')
   }
   
   class EmoAtlasService {
@@ -66,29 +81,30 @@ export interface SessionData {
       this.baseUrl = process.env.PYTHON_SERVICE_URL || 'http://localhost:8001'
     }
   
-    async analyzeEmotions(sessions: SessionData[], language: string = 'italian'): Promise<EmotionTrendsResponse> {
+    async analyzeEmotions(sessions: SessionData[], language: string = 'italian', patientId?: string): Promise<EmotionTrendsResponse> {
       try {
         console.log(`🌸 Starting emotion analysis for ${sessions.length} sessions`)
         
-        const request: EmotionAnalysisRequest = {
-          sessions,
-          language
-        }
-  
-        const response = await fetch(`${this.baseUrl}/emotion-trends`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify(request)
+        const hashed = sessions.map(session => ({ ...session, content_hash: contentHash(session.transcript) }))
+        const withTranscripts = (upload: (hash: string) => boolean): EmotionAnalysisRequest => ({
+          sessions: hashed.map(({ transcript, ...reference }) =>
+            upload(reference.content_hash) ? { ...reference, transcript } : reference
+          ),
+          language,
+          patient_id: patientId
         })
   
-        if (!response.ok) {
-          const errorText = await response.text()
-          throw new Error(`HTTP ${response.status}: ${errorText}`)
+        // First round: hashes only, answered from the results the service already has
+        let result = await this.postEmotionTrends(withTranscripts(() => false))
+        if (result.success && result.missing_hashes?.length) {
+          const missing = new Set(result.missing_hashes)
+          console.log(`📤 Uploading ${missing.size} transcripts unknown to the service`)
+          result = await this.postEmotionTrends(withTranscripts(hash => missing.has(hash)))
+          if (result.success && result.missing_hashes?.length) {
+            // Evicted between the two rounds: send everything
+            result = await this.postEmotionTrends(withTranscripts(() => true))
+          }
         }
-  
-        const result: EmotionTrendsResponse = await response.json()
         
         if (!result.success) {
           throw new Error(result.error || 'Analysis failed')
@@ -107,6 +123,23 @@ export interface SessionData {
       }
     }
   
+    private async postEmotionTrends(request: EmotionAnalysisRequest): Promise<EmotionTrendsResponse> {
+      const response = await fetch(`${this.baseUrl}/emotion-trends`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(request)
+      })
+  
+      if (!response.ok) {
+        const errorText = await response.text()
+        throw new Error(`HTTP ${response.status}: ${errorText}`)
+      }
+  
+      return response.json()
+    }
+  
     async healthCheck(): Promise<{ healthy: boolean; error?: string }> {
       try {
         const response = await fetch(`${this.baseUrl}/health`, {
@@ -132,47 +165,56 @@ export interface SessionData {
       }
     }
   
+    private async postSemanticFrame(request: Record<string, any>, textLength: number): Promise<any> {
+      console.log('🌐 Sending request to Railway:', {
+        url: `${this.baseUrl}/semantic-frame-analysis`,
+        method: 'POST',
+        bodySize: JSON.stringify(request).length,
+        targetWord: request.target_word,
+        textLength,
+        textUploaded: request.text !== undefined
+      })
+  
+      const response = await fetch(`${this.baseUrl}/semantic-frame-analysis`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(request),
+        signal: AbortSignal.timeout(120000) // 2 minuti timeout
+      })
+
+      console.log('📡 Railway response:', {
+        status: response.status,
+        statusText: response.statusText,
+        ok: response.ok
+      })
+  
+      if (!response.ok) {
+        const errorText = await response.text()
+        console.error('❌ Railway error response:', errorText)
+        throw new Error(`HTTP ${response.status}: ${errorText}`)
+      }
+  
+      return response.json()
+    }
+  
     async analyzeSemanticFrame(text: string, targetWord: string, sessionId?: string, language: string = 'italian'): Promise<any> {
       try {
         console.log(`🔍 Starting semantic frame analysis for word "${targetWord}"`)
         
         const request = {
-          text,
+          text_hash: contentHash(text),
           target_word: targetWord,  // Python si aspetta target_word, non targetWord
           session_id: sessionId || 'unknown',
           language
         }
 
-        console.log('🌐 Sending request to Railway:', {
-          url: `${this.baseUrl}/semantic-frame-analysis`,
-          method: 'POST',
-          bodySize: JSON.stringify(request).length,
-          targetWord,
-          textLength: text.length
-        })
-  
-        const response = await fetch(`${this.baseUrl}/semantic-frame-analysis`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify(request),
-          signal: AbortSignal.timeout(120000) // 2 minuti timeout
-        })
-
-        console.log('📡 Railway response:', {
-          status: response.status,
-          statusText: response.statusText,
-          ok: response.ok
-        })
-  
-        if (!response.ok) {
-          const errorText = await response.text()
-          console.error('❌ Railway error response:', errorText)
-          throw new Error(`HTTP ${response.status}: ${errorText}`)
+        // Hash only first: the text is uploaded only if the service doesn't know it yet
+        let result = await this.postSemanticFrame(request, text.length)
+        if (!result.success && result.missing_hashes?.length) {
+          result = await this.postSemanticFrame({ ...request, text }, text.length)
         }
-  
-        const result = await response.json()
         
         if (!result.success) {
           throw new Error(result.error || 'Semantic analysis failed')